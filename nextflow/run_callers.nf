@@ -4,8 +4,12 @@ params.no_new_data = false
 params.callers_file = ""
 params.output_dir = ""
 params.max_forks_run_callers = 100
+params.run_callers_threads = 1
 params.summarise_threads = 10
+params.setup_threads = 8
+params.per_caller = false
 params.testing = false
+params.scratch_dir = ""
 params.species = ""
 
 
@@ -21,6 +25,21 @@ if (params.help){
         Other options:
             --max_forks_run_callers
                               add description
+            --run_callers_threads
+                              CPUs for each run_callers job. If more than 1,
+                              the callers for a sample are run at the same
+                              time [1]
+            --per_caller      Run each caller on each sample as a separate job,
+                              with its own CPUs (column 9 of the callers file)
+                              and RAM, and retried on its own. The summary of
+                              each sample is made when all its callers have
+                              finished
+            --setup_threads   Number of directories of samples to make at
+                              the same time when setting up the output
+                              directory [8]
+            --scratch_dir     Run each caller in a new directory inside this
+                              directory (eg node-local disk), and only copy
+                              the results to the output directory
 
     """.stripIndent()
 
@@ -50,6 +69,34 @@ if (!callers_file.exists()){
 }
 
 
+if (params.scratch_dir) {
+    scratch_dir_string = "EVALRESCALLERS_SCRATCH_DIR=${params.scratch_dir}"
+}
+else {
+    scratch_dir_string = ""
+}
+
+
+if (params.run_callers_threads > 1) {
+    concurrent_callers_string = "--concurrent_callers"
+}
+else {
+    concurrent_callers_string = ""
+}
+
+
+if (params.per_caller) {
+    per_caller_string = "--per_caller ${callers_file}"
+}
+else {
+    per_caller_string = ""
+}
+
+// Number of callers, so that with --per_caller the summary of a sample
+// can be made as soon as all of its callers have finished
+callers_count = callers_file.readLines().findAll{it.trim()}.size()
+
+
 if (params.no_new_data) {
     setup_no_new_data = "--no_new_data"
 }
@@ -81,47 +128,121 @@ process setup_output_dir {
     file jobs_tsv into jobs_tsv_channel
 
     """
-    evalrescallers setup_pipeline_outdir ${setup_no_new_data} ${input_data_file} jobs_tsv ${caller_output_dir}
+    evalrescallers resource_model --incremental ${caller_output_dir} resource_model.json
+    evalrescallers setup_pipeline_outdir ${setup_no_new_data} ${concurrent_callers_string} ${per_caller_string} --threads ${params.setup_threads} --resource_model resource_model.json --callers_file ${callers_file} ${input_data_file} jobs_tsv ${caller_output_dir}
     """
 }
 
 
-jobs_tsv_channel.splitCsv(header:true, sep:'\t').set{tsv_lines}
+jobs_tsv_channel.splitCsv(header:true, sep:'\t').into{tsv_lines; caller_tsv_lines}
 
 
 process run_callers {
     maxForks params.max_forks_run_callers
-    memory {params.testing ? '100 MB' : 13.GB * task.attempt}
+    // Use the RAM predicted from previous runs of the callers if there is
+    // a prediction for this sample (see the resource_model task)
+    memory {params.testing ? '100 MB' : (fields.memory_gb && fields.memory_gb != '.' ? "${Math.ceil(fields.memory_gb.toFloat() * task.attempt) as int} GB" : 13.GB * task.attempt)}
     errorStrategy {task.attempt < 3 ? 'retry' : 'ignore'}
     maxRetries 3
+    cpus params.run_callers_threads
+    // The memory of the job is passed to run_callers_on_one_sample as --ram,
+    // so that callers run at the same time do not use more than this between them
+
+    when:
+    !params.per_caller
 
     input:
     val fields from tsv_lines
 
     output:
     file run_callers_done
-    val(42) into summarise_input_channel
+    val(fields.name) into sample_done_channel
 
     """
-    evalrescallers run_callers_on_one_sample ${testing_string} ${callers_file} ${caller_output_dir}/${fields.sample_dir} ${fields.reads1} ${fields.reads2}
+    ${scratch_dir_string} evalrescallers run_callers_on_one_sample ${testing_string} --threads ${task.cpus} --ram ${task.memory.toMega() / 1024} ${callers_file} ${caller_output_dir}/${fields.sample_dir} ${fields.reads1} ${fields.reads2}
     touch run_callers_done
     """
 }
 
 
+process run_one_caller {
+    maxForks params.max_forks_run_callers
+    // RAM is from the callers file, or else predicted from previous runs
+    // of this caller (see the resource_model task)
+    memory {params.testing ? '100 MB' : (fields.memory_gb && fields.memory_gb != '.' ? "${Math.ceil(fields.memory_gb.toFloat() * task.attempt) as int} GB" : 13.GB * task.attempt)}
+    errorStrategy {task.attempt < 3 ? 'retry' : 'ignore'}
+    maxRetries 3
+    cpus {fields.cpus.toInteger()}
+
+    when:
+    params.per_caller
+
+    input:
+    val fields from caller_tsv_lines
+
+    output:
+    set val(fields.name), val(fields.sample_dir), val(fields.caller) into caller_done_channel
+
+    """
+    ${scratch_dir_string} evalrescallers run_one_caller ${testing_string} ${callers_file} ${fields.caller} ${caller_output_dir}/${fields.sample_dir} ${fields.reads1} ${fields.reads2}
+    """
+}
+
+
+process merge_sample_summary {
+    memory {params.testing ? '100 MB' : '1 GB'}
+
+    when:
+    params.per_caller
+
+    // Callers that failed after all their retries are not in the group, so
+    // remainder is needed to still make the summary of those samples
+    input:
+    set val(sample), val(sample_dir), val(callers) from caller_done_channel.groupTuple(by: [0, 1], size: callers_count, remainder: true)
+
+    output:
+    val(sample) into merge_done_channel
+
+    """
+    evalrescallers merge_sample_summary ${callers_file} ${caller_output_dir}/${sample_dir}
+    """
+}
+
+
+// Each sample is added to the summary SQLite file as soon as it has
+// finished, so that it can be queried while the pipeline is running.
+// Only one process writes to the file at a time
+process add_sample_to_summary {
+    maxForks 1
+    memory {params.testing ? '100 MB' : '1 GB'}
+    // Any sample that is not added here is added by summarise
+    errorStrategy 'ignore'
+
+    input:
+    val(sample) from sample_done_channel.mix(merge_done_channel)
+
+    output:
+    val(sample) into summary_added_channel
+
+    """
+    evalrescallers add_sample_to_summary ${caller_output_dir} ${summary_output_prefix}.sqlite ${sample}
+    """
+}
+
+
 process summarise {
     memory {params.testing ? '100 MB' : '3 GB'}
     cpus {params.testing ? 0 : params.summarise_threads}
 
 
     input:
-    val(foo) from summarise_input_channel.collect()
+    val(foo) from summary_added_channel.collect()
 
     output:
     file summary_done
 
     """
-    evalrescallers make_summary_json --threads ${params.summarise_threads} ${caller_output_dir} ${summary_output_prefix}.json
+    evalrescallers finalize_summary --threads ${params.summarise_threads} ${caller_output_dir} ${summary_output_prefix}.sqlite ${summary_output_prefix}.json
     touch summary_done
     """
 }
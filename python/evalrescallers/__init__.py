@@ -1,12 +1,28 @@
 __all__ = [
+    'benchmark',
+    'caller_adapters',
+    'ena_download',
+    'evaluate',
+    'json_io',
     'ten_k_validation_data',
+    'local_pipeline',
     'mykrobe_pub_data',
     'pipeline_output_dir',
+    'reads_subsample',
+    'reads_verify',
+    'reparse',
     'res_caller',
+    'resource_model',
+    'resource_profiler',
+    'result_cache',
     'run_res_callers',
+    'sample_index',
+    'summary_db',
     'tasks',
     'ten_k_reads_download',
+    'truth_data_cache',
     'utils',
+    'variant_parsers',
     'who_treatment',
 ]
 
@@ -0,0 +1,392 @@
+import logging
+import os
+import platform
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from evalrescallers import caller_adapters, json_io, pipeline_output_dir, res_caller, ten_k_validation_data
+
+default_sizes = [100, 1000, 10000, 50000]
+# Number of caller output files parsed in the parser stages is the number of
+# samples, but at most this, to keep the size of the fixtures sensible
+max_parse_files = 1000
+# A stage has regressed if its throughput is lower than the baseline by
+# more than this fraction, or its peak memory is higher by more than this
+default_tolerance = 0.2
+
+drugs_and_variants = {
+    'Isoniazid': [('katG', 'S315T', '2155168CG'), ('fabG1', 'C-15T', '1673425CT'), ('inhA', 'I21T', '1674262TC')],
+    'Rifampicin': [('rpoB', 'S450L', '761155CT'), ('rpoB', 'H445Y', '761139CT'), ('rpoB', 'D435V', '761110AT')],
+    'Ethambutol': [('embB', 'M306I', '4247431GC'), ('embB', 'M306V', '4247429AG'), ('embB', 'G406A', '4247730GC')],
+    'Pyrazinamide': [('pncA', 'H57D', '2288883GC'), ('pncA', 'Q10P', '2289213TG')],
+    'Streptomycin': [('rpsL', 'K43R', '781687AG'), ('rrs', 'A514C', '1472359AC')],
+    'Moxifloxacin': [('gyrA', 'D94G', '7582AG'), ('gyrA', 'A90V', '7570CT')],
+    'Ofloxacin': [('gyrA', 'D94G', '7582AG'), ('gyrA', 'A90V', '7570CT')],
+    'Amikacin': [('rrs', 'A1401G', '1473246AG')],
+    'Kanamycin': [('rrs', 'A1401G', '1473246AG'), ('eis', 'C-14T', '2715346GA')],
+    'Capreomycin': [('rrs', 'A1401G', '1473246AG')],
+}
+amino_acids = 'ACDEFGHIKLMNPQRSTVWY'
+nucleotides = 'ACGT'
+
+
+def _random_calls(rng):
+    # Returns list of (drug, gene, variant, genome position + change) of the
+    # resistant calls of one synthetic sample. About half the samples are
+    # fully susceptible, like in the real data
+    calls = []
+    if rng.random() < 0.5:
+        return calls
+    for drug, variants in drugs_and_variants.items():
+        if rng.random() < 0.3:
+            gene, variant, pos_change = rng.choice(variants)
+            calls.append((drug, gene, variant, pos_change))
+    return calls
+
+
+def _random_snp(rng):
+    pos = rng.randint(1, 1400)
+    return f'{rng.choice(amino_acids)}{pos}{rng.choice(amino_acids)}'
+
+
+def make_mykrobe_json(filename, rng):
+    calls = _random_calls(rng)
+    resistant = {}
+    for drug, gene, variant, _ in calls:
+        resistant.setdefault(drug, {})[f'{gene}_{variant}-{variant}'] = {
+            'info': {
+                'conf': rng.randint(10, 3000),
+                'coverage': {
+                    'reference': {'median_depth': rng.randint(0, 5), 'percent_coverage': 100.0},
+                    'alternate': {'median_depth': rng.randint(20, 120), 'percent_coverage': 100.0},
+                },
+                'expected_depths': [rng.randint(30, 100)],
+                'filter': [],
+            },
+            'genotype': [1, 1],
+        }
+    susceptibility = {}
+    for drug in drugs_and_variants:
+        if drug in resistant:
+            susceptibility[drug] = {'predict': 'R', 'called_by': resistant[drug]}
+        else:
+            susceptibility[drug] = {'predict': 'S'}
+
+    # Most of a real file is the variant calls, which are not needed
+    variant_calls = {}
+    for i in range(200):
+        gene, _, pos_change = rng.choice(rng.choice(list(drugs_and_variants.values())))
+        variant_calls[f'{gene}_{_random_snp(rng)}-{pos_change}{i}'] = {
+            'variant': pos_change,
+            'genotype': [0, 0],
+            'genotype_likelihoods': [round(rng.uniform(-1000, 0), 3) for _ in range(3)],
+            'info': {'coverage': {'reference': {'median_depth': rng.randint(20, 120)}, 'alternate': {'median_depth': 0}}},
+        }
+
+    data = {'sample': {
+        'susceptibility': susceptibility,
+        'phylogenetics': {'lineage': {'lineage': ['lineage4']}, 'species': {'Mycobacterium_tuberculosis': {'percent_coverage': 98.5}}},
+        'kmer': 21,
+        'probe_sets': ['tb-species-170421.fasta.gz', 'tb-hunt-probe-set-jan-03-2019.fasta.gz'],
+        'files': ['reads_1.fastq.gz', 'reads_2.fastq.gz'],
+        'version': {'mykrobe-predictor': 'v0.9.0', 'mykrobe-atlas': 'v0.9.0'},
+        'genotype_model': 'kmer_count',
+        'variant_calls': variant_calls,
+    }}
+    json_io.write(data, filename)
+
+
+def make_tb_profiler_json(filename, rng):
+    small_variants_dr = []
+    for drug, gene, variant, pos_change in _random_calls(rng):
+        before, pos, after = variant[0], variant[1:-1], variant[-1]
+        small_variants_dr.append({
+            'drug': drug.lower(),
+            'gene': gene,
+            'change': f'{pos}{before}>{pos}{after}',
+            'genome_pos': pos_change[:-2],
+            'freq': 1.0,
+            'type': 'missense',
+            'locus_tag': 'Rv0000',
+            'chr': 'Chromosome',
+        })
+    small_variants_other = []
+    for i in range(300):
+        snp = _random_snp(rng)
+        small_variants_other.append({
+            'gene': rng.choice(['gyrA', 'gyrB', 'rpoB', 'rpoC', 'katG', 'embB', 'pncA']),
+            'change': f'{snp[1:-1]}{snp[0]}>{snp[1:-1]}{snp[-1]}',
+            'genome_pos': str(rng.randint(1, 4411532)),
+            'freq': round(rng.uniform(0.7, 1.0), 3),
+            'type': 'missense',
+            'locus_tag': f'Rv{rng.randint(1, 3900):04}',
+            'chr': 'Chromosome',
+        })
+    data = {
+        'small_variants_dr': small_variants_dr,
+        'small_variants_other': small_variants_other,
+        'lineage': [{'lin': 'lineage4', 'frac': 1.0, 'family': 'Euro-American', 'spoligotype': 'LAM;T;S;X;H', 'rd': 'None'}],
+        'main_lin': 'lineage4',
+        'sublin': 'lineage4.1.1.3',
+        'drtype': 'Drug-resistant' if len(small_variants_dr) else 'Sensitive',
+        'tbprofiler_version': '2.8.6',
+    }
+    json_io.write(data, filename)
+
+
+def make_kvarq_json(filename, rng):
+    resistance = []
+    for drug, gene, variant, pos_change in _random_calls(rng):
+        # KvarQ uses both of these formats
+        if '-' in variant:
+            resistance.append(f'{drug} resistance::SNP{pos_change}={gene}.{variant}')
+        else:
+            resistance.append(f'{drug} resistance [{pos_change}={gene}.{variant}]')
+    resistance.append('remark: synthetic sample')
+    coverages = []
+    for i in range(500):
+        seq = ''.join(rng.choice(nucleotides) for _ in range(25))
+        depth = rng.randint(1, 20)
+        coverages.append([seq, '-'.join([str(depth)] * 25) + ' '])
+    data = {
+        'analyses': {'MTBC/resistance': resistance, 'MTBC/phylogeny': ['lineage 4']},
+        'coverages': coverages,
+        'info': {'fastq': 'reads_1.fastq.gz', 'readlength': 150, 'records_parsed': rng.randint(1000000, 5000000)},
+    }
+    json_io.write(data, filename)
+
+
+def make_ariba_json(filename, rng):
+    data = {}
+    for drug, gene, variant, _ in _random_calls(rng):
+        data.setdefault(drug, []).append([gene, variant])
+    json_io.write(data, filename)
+
+
+def make_mtbseq_tab(filename, rng):
+    resistant = [(gene, variant, drug) for drug, gene, variant, _ in _random_calls(rng)]
+    with open(filename, 'w') as f:
+        print('#Pos', 'Insindex', 'Ref', 'Type', 'Allel', 'CovFor', 'CovRev', 'Qual20', 'Freq', 'Cov', 'Subst', 'Gene', 'GeneName', 'Product', 'ResistanceSNP', 'PhyloSNP', 'InterestingRegion', sep='\t', file=f)
+        for i in range(1000):
+            gene = rng.choice(['gyrA', 'gyrB', 'rpoB', 'katG', 'embB', 'pncA', '-'])
+            resistance = ' '
+            subst = f'{_random_snp(rng)} (atg/atC)'
+            if i < len(resistant):
+                gene, variant, drug = resistant[i]
+                subst = f'{variant} (atg/atC)'
+                resistance = f'{drug.lower()} ({drug[0:3].upper()})'
+            cov = rng.randint(10, 200)
+            print(rng.randint(1, 4411532), 0, rng.choice(nucleotides), 'SNP', rng.choice(nucleotides), cov // 2, cov - cov // 2, cov, '100.00', cov, subst, f'Rv{rng.randint(1, 3900):04}', gene, 'synthetic product', resistance, ' ', ' ', sep='\t', file=f)
+
+
+def make_time_output(filename, rng):
+    with open(filename, 'w') as f:
+        for i in range(rng.randint(100, 500)):
+            print(f'[{i}] stdout and stderr of the tool', file=f)
+        print('\tCommand being timed: "synthetic"', file=f)
+        print(f'\tUser time (seconds): {rng.uniform(10, 3000):.2f}', file=f)
+        print(f'\tSystem time (seconds): {rng.uniform(1, 100):.2f}', file=f)
+        print('\tPercent of CPU this job got: 99%', file=f)
+        minutes, seconds = divmod(rng.uniform(10, 7200), 60)
+        hours, minutes = divmod(int(minutes), 60)
+        print(f'\tElapsed (wall clock) time (h:mm:ss or m:ss): {hours}:{minutes:02}:{seconds:05.2f}', file=f)
+        print(f'\tMaximum resident set size (kbytes): {rng.randint(100000, 8000000)}', file=f)
+        print('\tExit status: 0', file=f)
+
+
+caller_fixtures = {
+    'ARIBA': make_ariba_json,
+    'KvarQ': make_kvarq_json,
+    'Mykrobe': make_mykrobe_json,
+    'TB-Profiler': make_tb_profiler_json,
+}
+
+
+def make_sample_summary(rng):
+    '''Returns the summary.json data of one synthetic sample, as made by
+    run_res_callers.summary_json_from_all_callers'''
+    summary = {}
+    for caller in ['ARIBA', 'KvarQ', 'MTBseq', 'Mykrobe', 'TB-Profiler']:
+        if rng.random() < 0.02:
+            summary[caller] = {'Success': False}
+            continue
+        calls = {}
+        for drug, gene, variant, _ in _random_calls(rng):
+            info = {'conf': rng.randint(10, 3000), 'ref_depth': 0, 'alt_depth': rng.randint(20, 120), 'expected_depth': 50} if caller == 'Mykrobe' else None
+            calls.setdefault(drug, []).append(['R', gene, variant, info])
+        summary[caller] = {
+            'Success': True,
+            'resistance_calls': calls,
+            'time_and_memory': {
+                'ram': rng.randint(100000, 8000000),
+                'system_time': round(rng.uniform(1, 100), 2),
+                'user_time': round(rng.uniform(10, 3000), 2),
+                'wall_clock_time': round(rng.uniform(10, 7200), 2),
+            },
+        }
+    return summary
+
+
+def make_pipeline_dir(outdir, n_samples, rng):
+    '''Makes a pipeline directory (as made by setup_pipeline_outdir) with
+    n_samples synthetic samples, each with a summary.json file.
+    Returns the PipelineOutputDir'''
+    data_tsv = f'{outdir}.data.tsv'
+    with open(data_tsv, 'w') as f:
+        for i in range(n_samples):
+            print(f'sample.{i}', f'reads/{i}_1.fastq.gz', f'reads/{i}_2.fastq.gz', sep='\t', file=f)
+    pipe_dir = pipeline_output_dir.PipelineOutputDir(outdir)
+    pipe_dir.add_data_from_file(data_tsv)
+    os.unlink(data_tsv)
+    for sample, d in pipe_dir.data['samples'].items():
+        json_io.write(make_sample_summary(rng), os.path.join(outdir, d['dir'], 'summary.json'))
+    return pipe_dir
+
+
+def measure(function, items, repeats=1):
+    '''Runs function repeats times, and once more with tracemalloc to get
+    the peak memory (tracemalloc slows things down, so is not used for the
+    timing). items is the number of things (files, samples...) processed in
+    one run. Returns dict of the results. Memory used by child processes
+    is not included'''
+    times = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    seconds = min(times)
+    return {
+        'items': items,
+        'seconds': round(seconds, 6),
+        'items_per_second': round(items / seconds, 3) if seconds > 0 else None,
+        'peak_mb': round(peak / 1024 / 1024, 3),
+    }
+
+
+def _parse_all(function, filenames):
+    def f():
+        for filename in filenames:
+            function(filename)
+    return f
+
+
+def run_size(workdir, n_samples, stages=None, repeats=1, seed=42):
+    '''Makes the fixtures for n_samples samples in workdir, and runs the
+    benchmark stages on them. Returns dict of stage name -> results (see measure)'''
+    rng = random.Random(seed)
+    results = {}
+    n_files = min(n_samples, max_parse_files)
+    stage_functions = {}
+
+    for caller, make_fixture in caller_fixtures.items():
+        stage = f'json_to_resistance_calls.{caller}'
+        if stages is None or stage in stages:
+            filenames = [os.path.join(workdir, f'{caller}.{i}.json') for i in range(n_files)]
+            for filename in filenames:
+                make_fixture(filename, rng)
+            adapter = caller_adapters.get_adapter(caller)
+            stage_functions[stage] = (_parse_all(adapter.parse_output, filenames), n_files)
+
+    if stages is None or 'mtbseq_tab_file_to_res_calls' in stages:
+        filenames = [os.path.join(workdir, f'MTBseq.{i}.tab') for i in range(n_files)]
+        for filename in filenames:
+            make_mtbseq_tab(filename, rng)
+        stage_functions['mtbseq_tab_file_to_res_calls'] = (_parse_all(caller_adapters.mtbseq_tab_file_to_res_calls, filenames), n_files)
+
+    if stages is None or 'bash_out_to_time_and_memory' in stages:
+        filenames = [os.path.join(workdir, f'command.{i}.out') for i in range(n_files)]
+        for filename in filenames:
+            make_time_output(filename, rng)
+        stage_functions['bash_out_to_time_and_memory'] = (_parse_all(res_caller.ResCaller._bash_out_to_time_and_memory, filenames), n_files)
+
+    summary_stages = {'make_summary_json_of_all_samples', 'make_summary_json_of_all_samples.incremental'}
+    if stages is None or len(summary_stages.intersection(stages)) > 0:
+        pipe_dir = make_pipeline_dir(os.path.join(workdir, 'pipeline'), n_samples, rng)
+        summary_json = os.path.join(workdir, 'summary.json')
+        stage_functions['make_summary_json_of_all_samples'] = (lambda: pipe_dir.make_summary_json_of_all_samples(summary_json), n_samples)
+        # Nothing has changed after the first run, so this measures the
+        # cost of an incremental update where no samples were rerun
+        pipe_dir.make_summary_json_of_all_samples(summary_json, incremental=True)
+        stage_functions['make_summary_json_of_all_samples.incremental'] = (lambda: pipe_dir.make_summary_json_of_all_samples(summary_json, incremental=True), n_samples)
+
+    for stage, (function, items) in sorted(stage_functions.items()):
+        if stages is None or stage in stages:
+            logging.info(f'Benchmarking {stage} with {n_samples} samples')
+            results[stage] = measure(function, items, repeats=repeats)
+            logging.info(f'{stage}: {results[stage]}')
+
+    return results
+
+
+def run_benchmarks(sizes=None, stages=None, repeats=1, workdir=None, keep_workdir=False):
+    '''Runs the benchmark stages for each number of samples in sizes.
+    Fixtures are made in a new temporary directory inside workdir (default
+    is the system temporary directory). Only uses synthetic data and the
+    data files in this package, so does not need any callers installed.
+    Returns dict of the results, which can be used as a baseline'''
+    if sizes is None:
+        sizes = default_sizes
+    results = {
+        'info': {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'orjson': json_io.orjson is not None,
+            'ijson': json_io.ijson is not None,
+        },
+        'sizes': {},
+    }
+
+    if stages is None or 'load_all_data' in stages:
+        logging.info('Benchmarking load_all_data')
+        results['load_all_data'] = measure(ten_k_validation_data.load_all_data, 1, repeats=repeats)
+
+    for n_samples in sizes:
+        tmp_dir = tempfile.mkdtemp(prefix=f'evalrescallers.benchmark.{n_samples}.', dir=workdir)
+        try:
+            results['sizes'][str(n_samples)] = run_size(tmp_dir, n_samples, stages=stages, repeats=repeats)
+        finally:
+            if keep_workdir:
+                logging.info(f'Kept benchmark fixtures directory {tmp_dir}')
+            else:
+                shutil.rmtree(tmp_dir)
+
+    return results
+
+
+def _compare_stage(name, new, old, tolerance):
+    regressions = []
+    if new.get('items_per_second') is not None and old.get('items_per_second') is not None:
+        if new['items_per_second'] < old['items_per_second'] * (1 - tolerance):
+            regressions.append((name, 'items_per_second', old['items_per_second'], new['items_per_second']))
+    if new['peak_mb'] > old['peak_mb'] * (1 + tolerance):
+        regressions.append((name, 'peak_mb', old['peak_mb'], new['peak_mb']))
+    return regressions
+
+
+def compare_to_baseline(results, baseline, tolerance=default_tolerance):
+    '''Returns list of tuples (stage, metric, baseline value, new value) of
+    every stage in both results and baseline that is slower or uses more
+    memory than the baseline, by more than the fraction tolerance. Stage names
+    have the number of samples added, eg "100:make_summary_json_of_all_samples"'''
+    regressions = []
+    if 'load_all_data' in results and 'load_all_data' in baseline:
+        regressions.extend(_compare_stage('load_all_data', results['load_all_data'], baseline['load_all_data'], tolerance))
+
+    for size, stages in sorted(results['sizes'].items()):
+        for stage, new in sorted(stages.items()):
+            old = baseline.get('sizes', {}).get(size, {}).get(stage)
+            if old is not None:
+                regressions.extend(_compare_stage(f'{size}:{stage}', new, old, tolerance))
+
+    return regressions
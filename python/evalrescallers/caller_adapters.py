@@ -0,0 +1,475 @@
+import csv
+import json
+import logging
+import os
+import shutil
+import time
+
+from evalrescallers import json_io, variant_parsers
+
+try:
+    import importlib.metadata as importlib_metadata
+except ImportError:
+    # Python < 3.8
+    import importlib_metadata
+
+entry_point_group = 'evalrescallers.callers'
+quinolones = {'Ciprofloxacin', 'Moxifloxacin', 'Ofloxacin'}
+
+
+class CallerAdapter:
+    '''Base class of the adapters that know how to run one caller and
+    parse its output. To add a caller, make a subclass and either add it
+    to builtin_adapters, or register it from another package using an
+    entry point in the group "evalrescallers.callers"'''
+    name = None
+    # Command that prints the version of the tool
+    version_command = None
+    # Default CPUs and RAM (GB, None = unknown) needed by the tool. Used by
+    # the schedulers when they are not given in the callers file. The CPUs
+    # are given to the tool as the threads option of build_command
+    threads = 1
+    ram = None
+    # Resistance calls used instead of running the tool when testing
+    fake_resistance_calls = {}
+    # Parts of the results file that parse_json needs (see
+    # json_io.load_selected), or None to load the whole file
+    json_paths = None
+    # Options of build_command that change the results, and so are
+    # used in the result cache key (see result_cache.cache_key)
+    cache_options = ()
+
+    def build_command(self, outdir, reads1, reads2, json_results_file, command_line_opts='', threads=1, **options):
+        '''Returns the command to run the tool, using threads CPUs. It is run
+        in outdir. options are mykrobe_species, mykrobe_panel,
+        mykrobe_custom_probe_file, mykrobe_custom_var_to_res and ariba_ref'''
+        raise NotImplementedError
+
+
+    def check_finished(self, outdir, json_results_file, returncode):
+        '''Called after the tool has finished. Raises an exception if it failed'''
+        if returncode != 0:
+            raise Exception(f'{self.name} failed. Return code: {returncode}')
+
+
+    def collect_output(self, outdir, json_results_file):
+        '''Moves the results file made by the tool to json_results_file'''
+        pass
+
+
+    def clean_run_dir(self, outdir):
+        '''Deletes the files made by the tool that are not needed'''
+        pass
+
+
+    def parse_json(self, json_data, json_in, failures=None):
+        '''Returns dict of drug -> list of resistance calls, from the
+        contents of the results file json_in. Variants that cannot be parsed,
+        but do not stop the rest of the file being parsed, are added to the
+        list failures (see variant_parsers.ParseFailure)'''
+        raise NotImplementedError
+
+
+    def parse_output(self, json_in, failures=None):
+        '''Returns dict of drug -> list of resistance calls from the results
+        file json_in. Parse failures are added to the list failures if it is
+        given, otherwise they are counted and logged in one warning'''
+        if self.json_paths is None:
+            json_data = json_io.load(json_in)
+        else:
+            json_data = json_io.load_selected(json_in, self.json_paths)
+
+        if failures is not None:
+            return self.parse_json(json_data, json_in, failures=failures)
+
+        file_failures = []
+        resistance_calls = self.parse_json(json_data, json_in, failures=file_failures)
+        variant_parsers.report_failures(file_failures, json_in)
+        return resistance_calls
+
+
+    def resource_profile(self):
+        '''Returns tuple (CPUs, RAM in GB) that the tool needs by default'''
+        return self.threads, self.ram
+
+
+def threads_option(flag, threads, command_line_opts):
+    '''Returns the option that sets the number of threads of a tool (eg
+    "--threads 4"), or an empty string if it is already in the command
+    line options from the callers file'''
+    if command_line_opts is not None and flag in command_line_opts.split():
+        return ''
+    return f'{flag} {threads}'
+
+
+def mtbseq_tab_file_to_res_calls(tab_file):
+    res_calls = {}
+
+    with open(tab_file) as f:
+        file_reader = csv.DictReader(f, delimiter='\t')
+        for d in file_reader:
+            if d['ResistanceSNP'] is not None and len(d['ResistanceSNP'].strip()) > 0:
+                # Lines look like eg:
+                # fluoroquinolones (FQ)
+                drug = d['ResistanceSNP'].split()[0].capitalize()
+                if drug == 'Fluoroquinolones':
+                    drug = 'Quinolones'
+                gene = d['Gene'] if d['GeneName'] == '-' else d['GeneName']
+                # in the "uncovered" file, the Subst has a space.
+                # In the "variant" file, it has things like: Met306Ile (atg/atC)
+                if d['Subst'] == ' ':
+                    variant = None
+                else:
+                    variant = d['Subst'].split()[0]
+                if drug not in res_calls:
+                    res_calls[drug] = set()
+                res_calls[drug].add(('R', gene, variant, None))
+
+    return res_calls
+
+
+def mtbseq_outdir_to_res_calls(mtbseq_dir):
+    '''Returns dict of drug -> sorted list of resistance calls from the
+    Called/ directory of an MTBseq run'''
+    # The two files we want are in the Called/ directory.
+    # They have names like this:
+    #   sampleID_libID.gatk_position_uncovered_cf4_cr4_fr75_ph4_outmode000.tab
+    #   sampleID_libID.gatk_position_variants_cf4_cr4_fr75_ph4_outmode000.tab
+    # so first need to find those files
+    called_dir = os.path.join(mtbseq_dir, 'Called')
+    if not os.path.exists(called_dir):
+        raise FileNotFoundError(f'MTBseq "Called" directory not found. Looked for: {called_dir}')
+
+    variants_file = None
+    uncovered_file = None
+    for filename in os.listdir(called_dir):
+        if not filename.endswith('.tab'):
+            continue
+
+        if '_uncovered_' in filename:
+            uncovered_file = os.path.join(called_dir, filename)
+        elif '_variants_' in filename:
+            variants_file = os.path.join(called_dir, filename)
+
+    if variants_file is None:
+        raise FileNotFoundError(f'MTBseq variants file not found in dir {called_dir}')
+
+    res_calls = mtbseq_tab_file_to_res_calls(variants_file)
+    if uncovered_file is not None:
+        new_res_calls = mtbseq_tab_file_to_res_calls(uncovered_file)
+        for drug, call_list in new_res_calls.items():
+            if drug not in res_calls:
+                res_calls[drug] = set()
+            res_calls[drug].update(call_list)
+
+    for drug in res_calls:
+        res_calls[drug] = sorted(list(res_calls[drug]))
+
+    return res_calls
+
+
+def mtbseq_outdir_to_res_calls_json_file(mtbseq_dir, json_out):
+    res_calls = mtbseq_outdir_to_res_calls(mtbseq_dir)
+    with open(json_out, 'w') as f:
+        json.dump(res_calls, f, sort_keys=True, indent=4)
+
+
+class AribaAdapter(CallerAdapter):
+    name = 'ARIBA'
+    version_command = 'ariba version'
+    fake_resistance_calls = {'Ethambutol': [('R', 'embB', 'M306V', None)]}
+    cache_options = ('ariba_ref',)
+    threads = 2
+
+    def build_command(self, outdir, reads1, reads2, json_results_file, command_line_opts='', threads=1, ariba_ref=None, **options):
+        if ariba_ref is None or not os.path.exists(ariba_ref):
+            raise Exception(f'ARIBA ariba_ref not found: {ariba_ref}')
+        return f'ariba run {command_line_opts} {threads_option("--threads", threads, command_line_opts)} --verbose {ariba_ref} {reads1} {reads2} ariba.out'
+
+
+    def collect_output(self, outdir, json_results_file):
+        os.rename(os.path.join(outdir, 'ariba.out', 'tb.resistance.json'), json_results_file)
+
+
+    def parse_json(self, json_data, json_in, failures=None):
+        resistance_calls = {}
+        quinolone_calls = set()
+
+        for drug in json_data:
+            resistance_calls[drug] = []
+            for t in json_data[drug]:
+                to_append = ('R', t[0], t[1], None)
+                resistance_calls[drug].append(to_append)
+                if drug in quinolones:
+                    quinolone_calls.add(to_append)
+
+        if len(quinolone_calls) > 0:
+            resistance_calls['Quinolones'] = sorted(list(quinolone_calls))
+
+        return resistance_calls
+
+
+class KvarqAdapter(CallerAdapter):
+    name = 'KvarQ'
+    version_command = 'kvarq --version'
+    fake_resistance_calls = {'Ethambutol': [('R', 'embB', 'M306I', None)]}
+    json_paths = [('analyses', 'MTBC/resistance')]
+
+    def build_command(self, outdir, reads1, reads2, json_results_file, command_line_opts='', threads=1, **options):
+        return f'kvarq scan {command_line_opts} -l MTBC {threads_option("-t", threads, command_line_opts)} -p {reads1} {json_results_file}'
+
+
+    def parse_json(self, json_data, json_in, failures=None):
+        resistance_calls = {}
+        try:
+            res_list = json_data['analyses']['MTBC/resistance']
+        except:
+            raise Exception(f'Could not find analysis -> MTBC/resistance in JSON file "{os.path.abspath(json_in)}". Cannot continue')
+
+        for res_line in res_list:
+            drug, gene, change = variant_parsers.kvarq_var_string_parser(res_line, failures=failures)
+            if drug is None:
+                continue
+
+            if drug == 'Fluoroquinolones':
+                drug = 'Quinolones'
+
+            if drug == 'Kanamycin/Amikacin':
+                drugs = drug.split('/')
+            else:
+                drugs = [drug]
+
+            for d in drugs:
+                if d not in resistance_calls:
+                    resistance_calls[d] = []
+
+                resistance_calls[d].append(('R', gene, change, None))
+
+        return resistance_calls
+
+
+class MtbseqAdapter(CallerAdapter):
+    name = 'MTBseq'
+    version_command = 'MTBseq --version'
+    fake_resistance_calls = {'Ethambutol': [('R', 'embB', 'M306L', None)]}
+    run_dirs_to_delete = ['Amend', 'Bam', 'Classification', 'GATK_Bam', 'Groups', 'Joint', 'Mpileup', 'Position_Tables', 'Statistics']
+    threads = 4
+
+    def build_command(self, outdir, reads1, reads2, json_results_file, command_line_opts='', threads=1, **options):
+        # MTBseq uses /tmp/ when sorting BAM files. This means
+        # we need a unique sample and/or library name, otherwise the
+        # filenames in /tmp/ are not guaranteed to be unique. See
+        # https://github.com/ngs-fzb/MTBseq_source/issues/22
+        # Use the PID, plus the current time for extra paranoia
+        sample = f'{os.getppid()}.{time.time()}'
+
+        # Needs reads named in a specific way in the directory
+        # where it is run. Make symlinks with the correct name
+        link1 = os.path.join(outdir, f'{sample}_libID_R1.fastq.gz')
+        link2 = os.path.join(outdir, f'{sample}_libID_R2.fastq.gz')
+        try:
+            os.symlink(reads1, link1)
+            os.symlink(reads2, link2)
+        except:
+            raise Exception(f'Error making symlinks to reads files reads1 reads2')
+
+        return f'MTBseq --step TBfull {threads_option("--threads", threads, command_line_opts)}'
+
+
+    def check_finished(self, outdir, json_results_file, returncode):
+        # MTBseq currently makes the files we need to get the resistance
+        # calls, but crashes before the end of the whole pipeline. So we
+        # don't expect return code of zero. Counts as success if we can
+        # get the resistance calls from the files
+        try:
+            mtbseq_outdir_to_res_calls_json_file(outdir, json_results_file)
+        except:
+            raise Exception(f'Could not get resistance calls from MTBseq output dir {outdir}')
+
+
+    def clean_run_dir(self, outdir):
+        for directory in self.run_dirs_to_delete:
+            try:
+                shutil.rmtree(os.path.join(outdir, directory))
+            except:
+                pass
+
+
+    def parse_json(self, json_data, json_in, failures=None):
+        return json_data
+
+
+class MykrobeAdapter(CallerAdapter):
+    name = 'Mykrobe'
+    version_command = 'mykrobe --version'
+    fake_resistance_calls = {'Ethambutol': [('r', 'embB', 'M306J', 42)]}
+    json_paths = [('*', 'susceptibility')]
+    cache_options = ('mykrobe_species', 'mykrobe_panel', 'mykrobe_custom_probe_file', 'mykrobe_custom_var_to_res')
+    threads = 2
+
+    def build_command(self, outdir, reads1, reads2, json_results_file, command_line_opts='', threads=1, mykrobe_species=None, mykrobe_panel=None, mykrobe_custom_probe_file=None, mykrobe_custom_var_to_res=None, **options):
+        assert mykrobe_species in ['tb', 'staph']
+        command = [f'mykrobe predict sample {mykrobe_species} {command_line_opts}']
+        option = threads_option('--threads', threads, command_line_opts)
+        if option != '':
+            command.append(option)
+
+        if mykrobe_custom_probe_file is not None or mykrobe_custom_var_to_res is not None:
+            assert None not in {mykrobe_custom_probe_file, mykrobe_custom_var_to_res}
+            command.append(f'--panel custom --custom_probe_set_path {mykrobe_custom_probe_file} --custom_variant_to_resistance_json {mykrobe_custom_var_to_res}')
+        elif mykrobe_species == 'tb':
+            assert mykrobe_panel is not None
+            command.append(f'--panel {mykrobe_panel}')
+
+        command.append(f'--seq {reads1} {reads2} --output {json_results_file}')
+        return ' '.join(command)
+
+
+    def clean_run_dir(self, outdir):
+        shutil.rmtree(os.path.join(outdir, 'tmp'))
+        shutil.rmtree(os.path.join(outdir, 'mykrobe'))
+
+
+    def parse_json(self, json_data, json_in, failures=None):
+        resistance_calls = {}
+        sample_names = list(json_data.keys())
+        if len(sample_names) != 1:
+            raise Exception(f'Expected one key in json file "{os.path.abspath(json_in)}" but got: {sample_names}')
+
+        sample_name = sample_names[0]
+
+        try:
+            suscept_data = json_data[sample_name]['susceptibility']
+        except:
+            raise Exception(f'Error getting susceptibility from file "{os.path.abspath(json_in)}"')
+
+        for drug in suscept_data:
+            if drug not in resistance_calls:
+                resistance_calls[drug] = []
+
+            if drug in quinolones:
+                if 'Quinolones' not in resistance_calls:
+                    resistance_calls['Quinolones'] = []
+
+            if suscept_data[drug]['predict'] in {'r', 'R'}:
+
+                for variant in suscept_data[drug]['called_by']:
+                    gene, this_change = variant_parsers.mykrobe_called_by_parser(variant)
+                    try:
+                        conf = int(suscept_data[drug]['called_by'][variant]['info']['conf'])
+                    except:
+                        conf = None
+
+                    try:
+                        ref_depth = int(suscept_data[drug]['called_by'][variant]['info']['coverage']['reference']['median_depth'])
+                    except:
+                        ref_depth = None
+
+                    try:
+                        alt_depth = int(suscept_data[drug]['called_by'][variant]['info']['coverage']['alternate']['median_depth'])
+                    except:
+                        alt_depth = None
+
+                    try:
+                        expected_depths = suscept_data[drug]['called_by'][variant]['info']['expected_depths']
+                        expected_depth = round(sum(expected_depths) / len(expected_depths))
+                    except:
+                        expected_depth = None
+
+                    to_append = (suscept_data[drug]['predict'], gene, this_change, {'conf': conf, 'ref_depth': ref_depth, 'alt_depth': alt_depth, 'expected_depth': expected_depth})
+                    resistance_calls[drug].append(to_append)
+                    if drug in quinolones:
+                        resistance_calls['Quinolones'].append(to_append)
+
+            else:
+                to_append = (suscept_data[drug]['predict'], None, None, {})
+                resistance_calls[drug].append(to_append)
+                if drug in quinolones:
+                    resistance_calls['Quinolones'].append(to_append)
+
+        return resistance_calls
+
+
+class TbProfilerAdapter(CallerAdapter):
+    name = 'TB-Profiler'
+    version_command = 'tb-profiler version'
+    fake_resistance_calls = {'Ethambutol': [('R', 'embB', 'M306K', None)]}
+    json_paths = [('small_variants_dr',)]
+    threads = 4
+
+    def build_command(self, outdir, reads1, reads2, json_results_file, command_line_opts='', threads=1, **options):
+        return f'tb-profiler profile {command_line_opts} {threads_option("--threads", threads, command_line_opts)} -1 {reads1} -2 {reads2} -p out'
+
+
+    def collect_output(self, outdir, json_results_file):
+        os.rename(os.path.join(outdir, 'results', 'out.results.json'), json_results_file)
+
+
+    def clean_run_dir(self, outdir):
+        for directory in 'bam', 'results', 'vcf':
+            shutil.rmtree(os.path.join(outdir, directory))
+
+
+    def parse_json(self, json_data, json_in, failures=None):
+        resistance_calls = {}
+        if 'small_variants_dr' not in json_data:
+            raise Exception(f'Expected key "small_variants_dr" in json file "{os.path.abspath(json_in)}" but got: {list(json_data.keys())}')
+
+        for data in json_data['small_variants_dr']:
+            drug = data['drug'].capitalize()
+            if drug == 'Fluoroquinolones':
+                drug = 'Quinolones'
+            change = variant_parsers.tb_profiler_var_string_parser(data['change'])
+            if drug not in resistance_calls:
+                resistance_calls[drug] = []
+            resistance_calls[drug].append(('R', data['gene'], change, None))
+
+        return resistance_calls
+
+
+builtin_adapters = [AribaAdapter, KvarqAdapter, MtbseqAdapter, MykrobeAdapter, TbProfilerAdapter]
+registry = {}
+
+
+def register(adapter_class):
+    '''Adds an adapter class to the registry. Can be used as a decorator'''
+    if adapter_class.name is None:
+        raise Exception(f'Caller adapter {adapter_class} has no name')
+    registry[adapter_class.name] = adapter_class()
+    return adapter_class
+
+
+def _entry_points():
+    eps = importlib_metadata.entry_points()
+    if hasattr(eps, 'select'):
+        return list(eps.select(group=entry_point_group))
+    else:
+        return list(eps.get(entry_point_group, []))
+
+
+def load_registry():
+    '''Fills the registry with the builtin adapters, and any found from
+    entry points. Only does anything the first time it is called'''
+    if len(registry) > 0:
+        return
+
+    for adapter_class in builtin_adapters:
+        register(adapter_class)
+
+    for entry_point in _entry_points():
+        try:
+            register(entry_point.load())
+        except Exception as error:
+            logging.warning(f'Error loading caller adapter from entry point {entry_point}: {error}')
+
+
+def caller_names():
+    load_registry()
+    return set(registry)
+
+
+def get_adapter(name):
+    load_registry()
+    if name not in registry:
+        raise Exception(f'Caller "{name}" not recognised. Must be one of: {sorted(registry)}')
+    return registry[name]
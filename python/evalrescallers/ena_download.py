@@ -0,0 +1,457 @@
+import collections
+import concurrent.futures
+import csv
+import hashlib
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+# One run to download. outdir is used for any temporary files made while
+# downloading it
+RunJob = collections.namedtuple('RunJob', ['sample', 'run_id', 'outdir'])
+
+filereport_url = 'https://www.ebi.ac.uk/ena/portal/api/filereport'
+chunk_size = 1_048_576
+
+
+class TokenBucket:
+    '''Thread-safe token bucket. Tokens are added at rate per second, up to
+    capacity. consume(n) waits until n tokens have been paid for. Big requests
+    are allowed to go into debt, so that (eg) a chunk bigger than the capacity
+    does not wait forever, but the next caller waits for the debt to be paid'''
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = rate if capacity is None else capacity
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+
+    def consume(self, n=1):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= n
+            wait = 0 if self.tokens >= 0 else -self.tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+
+class HostLimits:
+    '''Limits on the number of requests per second and bytes per second,
+    separately for each host. None means no limit'''
+    def __init__(self, requests_per_second=None, bytes_per_second=None):
+        self.requests_per_second = requests_per_second
+        self.bytes_per_second = bytes_per_second
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+
+    def _bucket(self, host, kind, rate):
+        with self.lock:
+            if (host, kind) not in self.buckets:
+                self.buckets[(host, kind)] = TokenBucket(rate)
+            return self.buckets[(host, kind)]
+
+
+    def request(self, host):
+        '''Call before making a request to host'''
+        if self.requests_per_second is not None:
+            self._bucket(host, 'requests', self.requests_per_second).consume(1)
+
+
+    def transfer(self, host, n):
+        '''Call after n bytes were downloaded from host'''
+        if self.bytes_per_second is not None:
+            self._bucket(host, 'bytes', self.bytes_per_second).consume(n)
+
+
+def file_report(run_id, limits, portal_url=filereport_url, scheme='https'):
+    '''Returns list of (url, md5) of the paired FASTQ files of the run, from
+    the ENA filereport API at portal_url. md5 is "" if ENA does not have it'''
+    query = urllib.parse.urlencode({
+        'accession': run_id,
+        'result': 'read_run',
+        'fields': 'run_accession,fastq_ftp,fastq_md5,fastq_bytes',
+        'format': 'tsv',
+    })
+    limits.request(urllib.parse.urlparse(portal_url).hostname)
+    with urllib.request.urlopen(f'{portal_url}?{query}') as response:
+        lines = list(csv.DictReader(io.TextIOWrapper(response), delimiter='\t'))
+
+    files = []
+    for line in lines:
+        if line['run_accession'] != run_id:
+            continue
+        for path, md5 in zip(line['fastq_ftp'].split(';'), line['fastq_md5'].split(';')):
+            if path.endswith('_1.fastq.gz') or path.endswith('_2.fastq.gz'):
+                url = path if '://' in path else f'{scheme}://{path}'
+                files.append((url, md5))
+    if len(files) != 2:
+        raise Exception(f'Expected 2 paired FASTQ files for run {run_id}, but got {len(files)}')
+    return sorted(files)
+
+
+def check_md5(name, expected, got, writer):
+    '''Raises an exception if got is not the MD5 sum expected from the
+    ENA. Otherwise it is given to writer, to be saved with the sample.
+    Does nothing if the ENA does not have an MD5 sum (expected is "")'''
+    if expected == '':
+        return
+    if got != expected:
+        raise Exception(f'MD5 mismatch for {name}. Expected {expected} (from the ENA), got {got}')
+    writer.add_checked_md5(name, got)
+
+
+class EnaDataGetTransport:
+    '''Downloads runs using enaDataGet. Each run is downloaded to outdir,
+    appended to the sample reads files and then deleted, so only one run at
+    a time needs extra disk space. The files are checked against the MD5 sums
+    from the ENA filereport API, while they are appended. enaDataGet does the
+    downloading, so the bytes are counted (for the progress and the bandwidth
+    limit) while they are appended. This means that the bandwidth limit
+    slows down the next download instead of this one, so it only limits
+    the average speed. portal_url can be changed to use a different server
+    (eg a local copy for testing)'''
+    host = 'www.ebi.ac.uk'
+
+    def __init__(self, portal_url=filereport_url):
+        self.portal_url = portal_url
+
+
+    def stream(self, run_id, outdir, limits, progress, writer):
+        urls = {os.path.basename(url): (url, md5) for url, md5 in file_report(run_id, limits, portal_url=self.portal_url)}
+        limits.request(self.host)
+        command = f'enaDataGet -f fastq -d {outdir} {run_id}'
+        print(command, flush=True)
+        completed_process = subprocess.run(command, shell=True, stdout=subprocess.PIPE)
+        if completed_process.returncode != 0:
+            raise Exception(f'Error running command: {command}')
+
+        for mate in 1, 2:
+            basename = f'{run_id}_{mate}.fastq.gz'
+            filename = os.path.join(outdir, run_id, basename)
+            if not os.path.exists(filename):
+                raise Exception(f'File not found after running enaDataGet: {filename}')
+            if basename not in urls:
+                raise Exception(f'File {basename} not in ENA file report of run {run_id}')
+            url, md5 = urls[basename]
+            host = urllib.parse.urlparse(url).hostname
+            md5_sum = hashlib.md5()
+            with open(filename, 'rb') as f:
+                for chunk in iter(lambda: f.read(chunk_size), b''):
+                    writer.write(mate, chunk)
+                    md5_sum.update(chunk)
+                    limits.transfer(host, len(chunk))
+                    progress.add_bytes(len(chunk))
+            check_md5(basename, md5, md5_sum.hexdigest(), writer)
+        shutil.rmtree(outdir)
+
+
+class HttpTransport:
+    '''Downloads runs over HTTP(S) or FTP, straight into the sample reads
+    files. The FASTQ URLs and their MD5 sums are taken from the ENA filereport
+    API. Files are checked against the MD5 sums while they are downloaded.
+    portal_url and scheme can be changed to use a different server (eg a
+    local copy for testing)'''
+    def __init__(self, portal_url=filereport_url, scheme='https'):
+        self.portal_url = portal_url
+        self.scheme = scheme
+
+
+    def file_report(self, run_id, limits):
+        '''Returns list of (url, md5) of the paired FASTQ files of the run'''
+        return file_report(run_id, limits, portal_url=self.portal_url, scheme=self.scheme)
+
+
+    def stream(self, run_id, outdir, limits, progress, writer):
+        for mate, (url, md5) in enumerate(self.file_report(run_id, limits), start=1):
+            host = urllib.parse.urlparse(url).hostname
+            md5_sum = hashlib.md5()
+            limits.request(host)
+            with urllib.request.urlopen(url) as response:
+                for chunk in iter(lambda: response.read(chunk_size), b''):
+                    writer.write(mate, chunk)
+                    md5_sum.update(chunk)
+                    limits.transfer(host, len(chunk))
+                    progress.add_bytes(len(chunk))
+
+            check_md5(os.path.basename(urllib.parse.urlparse(url).path), md5, md5_sum.hexdigest(), writer)
+
+
+transports = {
+    'enaDataGet': EnaDataGetTransport,
+    'http': HttpTransport,
+}
+
+
+class SampleReadsWriter:
+    '''Appends the reads of each run of one sample to the files
+    reads_1.fastq.gz and reads_2.fastq.gz in outdir, computing the MD5 sum
+    of each file as it is written. A gzip file made of several gzip files
+    stuck together is still a valid gzip file, so the runs can be written one
+    after the other. Runs from different threads are written one at a time:
+    start_run() waits until any other run has finished. If a run fails,
+    rollback() truncates the files back to where they were when the run
+    started.
+    When a run finishes, the runs so far and the sizes of the files are saved
+    in runs.json in outdir. If that file is there when a new SampleReadsWriter
+    is made (eg after a crash), the reads files are truncated to those sizes,
+    and those runs are kept and not downloaded again (see has_run()).
+    The MD5 sums of the files of each run that were checked against the
+    ENA while downloading are kept in self.checked_md5s (filename -> md5)'''
+    def __init__(self, outdir):
+        self.outdir = outdir
+        self.filenames = {mate: os.path.join(outdir, f'reads_{mate}.fastq.gz') for mate in (1, 2)}
+        self.progress_file = os.path.join(outdir, 'runs.json')
+        self.handles = {}
+        self.md5s = {mate: hashlib.md5() for mate in (1, 2)}
+        self.runs = []
+        self.checked_md5s = {}
+        self.run_checked_md5s = {}
+        self.lock = threading.Lock()
+        self.run_start = None
+        self._resume()
+
+
+    def _resume(self):
+        try:
+            with open(self.progress_file) as f:
+                progress = json.load(f)
+            sizes = {mate: progress['sizes'][str(mate)] for mate in (1, 2)}
+            if any(os.path.getsize(self.filenames[mate]) < sizes[mate] for mate in (1, 2)):
+                raise ValueError('Reads files shorter than expected')
+        except (OSError, ValueError, KeyError):
+            if os.path.exists(self.progress_file):
+                os.unlink(self.progress_file)
+            return
+
+        for mate, filename in self.filenames.items():
+            with open(filename, 'r+b') as f:
+                f.truncate(sizes[mate])
+                for chunk in iter(lambda: f.read(chunk_size), b''):
+                    self.md5s[mate].update(chunk)
+        self.runs = progress['runs']
+        self.checked_md5s = progress.get('checked_md5s', {})
+
+
+    def has_run(self, run_id):
+        '''Returns True iff the run has already been written'''
+        return run_id in self.runs
+
+
+    def start_run(self, run_id):
+        '''Waits until no other run is being written, then starts writing
+        the run run_id. Call end_run() when it is finished. If the files
+        cannot be opened, the exception is raised and no run is started'''
+        self.lock.acquire()
+        try:
+            if len(self.handles) == 0:
+                mode = 'r+b' if len(self.runs) > 0 else 'wb'
+                for mate, filename in self.filenames.items():
+                    self.handles[mate] = open(filename, mode)
+                    self.handles[mate].seek(0, os.SEEK_END)
+            self.run_start = (run_id, {mate: f.tell() for mate, f in self.handles.items()}, {mate: m.copy() for mate, m in self.md5s.items()})
+            self.run_checked_md5s = {}
+        except:
+            for f in self.handles.values():
+                f.close()
+            self.handles = {}
+            self.lock.release()
+            raise
+
+
+    def write(self, mate, chunk):
+        self.handles[mate].write(chunk)
+        self.md5s[mate].update(chunk)
+
+
+    def add_checked_md5(self, filename, md5):
+        '''Records that the file filename of the current run had MD5 sum
+        md5, which matched the ENA'''
+        self.run_checked_md5s[filename] = md5
+
+
+    def rollback(self):
+        run_id, offsets, md5s = self.run_start
+        for mate, f in self.handles.items():
+            f.seek(offsets[mate])
+            f.truncate()
+        self.md5s = md5s
+
+
+    def _save_progress(self):
+        sizes = {}
+        for mate, f in self.handles.items():
+            f.flush()
+            os.fsync(f.fileno())
+            sizes[str(mate)] = f.tell()
+        tmp_file = self.progress_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({'runs': self.runs, 'sizes': sizes, 'checked_md5s': self.checked_md5s}, f)
+        os.replace(tmp_file, self.progress_file)
+
+
+    def end_run(self, success):
+        try:
+            if success:
+                self.runs.append(self.run_start[0])
+                self.checked_md5s.update(self.run_checked_md5s)
+                self._save_progress()
+            else:
+                self.rollback()
+        finally:
+            self.run_start = None
+            self.lock.release()
+
+
+    def close(self):
+        '''Closes the files, and returns dict of filename -> MD5 sum'''
+        for f in self.handles.values():
+            f.close()
+        self.handles = {}
+        return {os.path.basename(self.filenames[mate]): m.hexdigest() for mate, m in self.md5s.items()}
+
+
+class Progress:
+    '''Counts finished runs and downloaded bytes, and prints a summary
+    line with the speed and estimated time left at most every
+    interval seconds'''
+    def __init__(self, total, interval=30, outfile=sys.stdout):
+        self.total = total
+        self.interval = interval
+        self.outfile = outfile
+        self.ok = 0
+        self.failed = 0
+        self.bytes = 0
+        self.start = time.monotonic()
+        self.last_print = self.start
+        self.lock = threading.Lock()
+
+
+    def add_bytes(self, n):
+        with self.lock:
+            self.bytes += n
+
+
+    def run_finished(self, success):
+        with self.lock:
+            if success:
+                self.ok += 1
+            else:
+                self.failed += 1
+            now = time.monotonic()
+            if now - self.last_print >= self.interval or self.ok + self.failed == self.total:
+                self.last_print = now
+                print(self.summary_line(now), file=self.outfile, flush=True)
+
+
+    def summary_line(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        elapsed = max(now - self.start, 1e-9)
+        done = self.ok + self.failed
+        mb_per_sec = self.bytes / elapsed / 1_000_000
+        if done > 0:
+            eta = time.strftime('%H:%M:%S', time.gmtime((self.total - done) * elapsed / done))
+        else:
+            eta = 'unknown'
+        return f'Progress: {done}/{self.total} runs ({self.failed} failed), {self.bytes / 1_000_000:.1f} MB at {mb_per_sec:.2f} MB/s, ETA {eta}'
+
+
+def download_one_run(job, transport, limits, progress, writer, retries=3, backoff=10, max_backoff=600):
+    '''Downloads one run, appending it to the sample reads files using
+    writer (a SampleReadsWriter). Runs that writer already has (eg from before
+    a restart) are not downloaded again. Failed attempts are undone, and
+    retried after waiting backoff, 2 * backoff, 4 * backoff, ... seconds (with
+    some random jitter, and at most max_backoff).
+    Returns True/False for success/fail'''
+    if writer.has_run(job.run_id):
+        return True
+
+    for attempt in range(retries + 1):
+        if os.path.exists(job.outdir):
+            shutil.rmtree(job.outdir)
+        started = False
+        try:
+            writer.start_run(job.run_id)
+            started = True
+            transport.stream(job.run_id, job.outdir, limits, progress, writer)
+            # end_run releases the writer even if it fails, so it must
+            # not be ended again below
+            started = False
+            writer.end_run(True)
+            return True
+        except Exception as error:
+            if started:
+                writer.end_run(False)
+            print(f'Error getting run {job.run_id} (attempt {attempt + 1} of {retries + 1}):', error, flush=True)
+            if attempt < retries:
+                time.sleep(min(max_backoff, backoff * 2 ** attempt) * random.uniform(0.5, 1.5))
+
+    return False
+
+
+def download_runs(jobs, transport, writers, threads=1, limits=None, retries=3, backoff=10, on_run_done=None, skip=None, progress_interval=30):
+    '''Downloads all the runs in the list of RunJobs jobs, with at most
+    threads downloads at once. writers is a dict of sample name ->
+    SampleReadsWriter, which the runs of each sample are written to. The runs
+    of a sample are written to the same files, so they are downloaded one
+    after the other, in the order they are in jobs: the next run of a sample
+    is started as soon as the previous one finishes, and other threads
+    work on other samples. Samples are started in the order of their first
+    run in jobs. on_run_done(job, success) is called when each run finishes
+    (in the thread that downloaded it).
+    If given, skip(job) is called just before each run is started, and the
+    run is counted as failed without downloading it if it returns True (eg
+    because another run from the same sample already failed).
+    Returns dict of (sample, run_id) -> True/False for success/fail'''
+    if limits is None:
+        limits = HostLimits()
+    progress = Progress(len(jobs), interval=progress_interval)
+    results = {}
+    sample_queues = collections.OrderedDict()
+    for job in jobs:
+        sample_queues.setdefault(job.sample, collections.deque()).append(job)
+    new_samples = collections.deque(sample_queues)
+
+    def run_job(job):
+        if skip is not None and skip(job):
+            success = False
+        else:
+            success = download_one_run(job, transport, limits, progress, writers[job.sample], retries=retries, backoff=backoff)
+        progress.run_finished(success)
+        if on_run_done is not None:
+            on_run_done(job, success)
+        return success
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        futures = {}
+
+        def submit_next(sample):
+            job = sample_queues[sample].popleft()
+            futures[executor.submit(run_job, job)] = job
+
+        while len(futures) < threads and len(new_samples) > 0:
+            submit_next(new_samples.popleft())
+
+        while len(futures) > 0:
+            done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                job = futures.pop(future)
+                results[(job.sample, job.run_id)] = future.result()
+                if len(sample_queues[job.sample]) > 0:
+                    submit_next(job.sample)
+                elif len(new_samples) > 0:
+                    submit_next(new_samples.popleft())
+
+    return results
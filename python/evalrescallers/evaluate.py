@@ -0,0 +1,182 @@
+import numpy as np
+import pandas as pd
+
+from evalrescallers import summary_db, ten_k_validation_data, truth_data_cache
+
+pheno_categories = ['S', 'R']
+outcome_names = ['TN', 'FP', 'FN', 'TP']
+default_group_by = ['caller', 'drug', 'split', 'country']
+
+
+def phenotypes_dataframe(sample_to_pheno, split=None, sample_to_country=None):
+    '''Makes a long dataframe of phenotypes, from dict of
+    sample name -> drug -> phenotype. Only R and S phenotypes are kept.
+    Columns are sample, drug, pheno, split, country. pheno is categorical
+    (S, R). split is the same for all samples, and country is taken from
+    sample_to_country (missing countries are None)'''
+    samples = []
+    drugs = []
+    phenos = []
+    for sample, drug_to_pheno in sample_to_pheno.items():
+        for drug, pheno in drug_to_pheno.items():
+            if pheno in {'R', 'S'}:
+                samples.append(sample)
+                drugs.append(drug)
+                phenos.append(pheno)
+
+    df = pd.DataFrame({
+        'sample': samples,
+        'drug': pd.Categorical(drugs),
+        'pheno': pd.Categorical(phenos, categories=pheno_categories),
+    })
+    df['split'] = pd.Categorical([split] * len(df))
+    if sample_to_country is None:
+        df['country'] = pd.Categorical([None] * len(df))
+    else:
+        df['country'] = pd.Categorical(df['sample'].map(sample_to_country))
+    return df
+
+
+def pheno_matrix_to_dataframe(samples, drugs, pheno, split, country):
+    '''Same as phenotypes_dataframe, but made from a samples x drugs
+    phenotype matrix (see truth_data_cache). split and country are arrays
+    with one value per sample. Empty country strings are treated as None'''
+    rows, cols = np.nonzero(pheno != truth_data_cache.MISSING)
+    country = np.asarray(country)[rows]
+    return pd.DataFrame({
+        'sample': samples[rows],
+        'drug': pd.Categorical.from_codes(cols, categories=drugs),
+        # S=0, R=1 in the matrix, which is the same as the category codes
+        'pheno': pd.Categorical.from_codes(pheno[rows, cols], categories=pheno_categories),
+        'split': pd.Categorical(np.asarray(split)[rows]),
+        'country': pd.Categorical(np.where(country == '', None, country)),
+    })
+
+
+def ten_k_phenotypes_dataframe():
+    '''Returns phenotypes dataframe (see phenotypes_dataframe) of the 10k
+    validation data, with split set to "validate" or "test"'''
+    m = ten_k_validation_data.load_all_data_matrices()
+    return pheno_matrix_to_dataframe(m.samples, m.drugs, m.pheno, np.where(m.is_test, 'test', 'validate'), m.country)
+
+
+def calls_dataframe(rows, drugs):
+    '''Makes dataframe of calls, with columns sample, caller, drug, pred.
+    rows should be an iterable of (sample, caller, drug, predict, success),
+    where drug is None if the caller made no calls for that sample.
+    Callers that failed on a sample are left out.
+    For each successful (sample, caller), each drug in drugs is called R if
+    the caller made any R (or r) call for that drug, otherwise S'''
+    df = pd.DataFrame(list(rows), columns=['sample', 'caller', 'drug', 'predict', 'success'])
+    df = df[df['success'] == 1].copy()
+    df['is_r'] = df['predict'].isin(['R', 'r'])
+    ran = df[['sample', 'caller']].drop_duplicates()
+    drugs = sorted(drugs)
+    all_calls = ran.loc[ran.index.repeat(len(drugs))].reset_index(drop=True)
+    all_calls['drug'] = np.tile(drugs, len(ran))
+    resistant = df[df['is_r']][['sample', 'caller', 'drug']].drop_duplicates()
+    resistant['pred'] = 'R'
+    all_calls = all_calls.merge(resistant, how='left', on=['sample', 'caller', 'drug'])
+    all_calls['pred'] = pd.Categorical(all_calls['pred'].fillna('S'), categories=pheno_categories)
+    all_calls['caller'] = pd.Categorical(all_calls['caller'])
+    all_calls['drug'] = pd.Categorical(all_calls['drug'])
+    return all_calls
+
+
+def calls_dataframe_from_summary(summary_data, drugs):
+    '''Same as calls_dataframe, but using the data from a
+    summary JSON file (ie sample -> caller -> summary)'''
+    rows = []
+    for sample, sample_data in summary_data.items():
+        for row in summary_db.sample_summary_to_rows(sample, sample_data):
+            rows.append((row[0], row[1], row[2], row[3], row[-1]))
+    return calls_dataframe(rows, drugs)
+
+
+def calls_dataframe_from_sqlite(db_file, drugs):
+    '''Same as calls_dataframe, but using the calls in an
+    SQLite file made by summary_db.SummaryDb'''
+    rows = summary_db.query(db_file, 'SELECT sample, caller, drug, predict, success FROM calls')
+    return calls_dataframe(((x['sample'], x['caller'], x['drug'], x['predict'], x['success']) for x in rows), drugs)
+
+
+def calls_dataframe_to_matrices(calls_df, samples, drugs):
+    '''Returns dict of caller -> samples x drugs int8 matrix of the
+    predictions in calls_df, with rows and columns in the same order as
+    samples and drugs. Uses the same values as truth_data_cache, so
+    missing calls (eg the caller failed) are MISSING'''
+    sample_to_row = pd.Series(np.arange(len(samples)), index=samples)
+    drug_to_column = pd.Series(np.arange(len(drugs)), index=drugs)
+    df = calls_df[calls_df['sample'].isin(sample_to_row.index) & calls_df['drug'].isin(drug_to_column.index)]
+    rows = sample_to_row[df['sample']].to_numpy()
+    cols = drug_to_column[df['drug'].astype(str)].to_numpy()
+    values = df['pred'].cat.codes.to_numpy().astype(np.int8)
+    callers = df['caller'].astype(str).to_numpy()
+    matrices = {}
+    for caller in np.unique(callers):
+        matrix = np.full((len(samples), len(drugs)), truth_data_cache.MISSING, dtype=np.int8)
+        wanted = callers == caller
+        matrix[rows[wanted], cols[wanted]] = values[wanted]
+        matrices[caller] = matrix
+    return matrices
+
+
+def _add_stats(df):
+    tp, fp, tn, fn = (df[x].to_numpy(dtype=float) for x in ('TP', 'FP', 'TN', 'FN'))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        df['sensitivity'] = tp / (tp + fn)
+        df['specificity'] = tn / (tn + fp)
+        df['PPV'] = tp / (tp + fp)
+        df['NPV'] = tn / (tn + fn)
+    return df
+
+
+def confusion_matrices(pheno_df, calls_df, group_by=None):
+    '''Returns a dataframe with one row per group, with columns
+    of the group_by names, then TP, FP, TN, FN, sensitivity, specificity,
+    PPV, NPV. group_by is any of the columns of pheno_df and
+    calls_df (default is caller, drug, split, country). All groups are
+    counted in one pass over the joined phenotype and call tables'''
+    if group_by is None:
+        group_by = default_group_by
+    group_by = list(group_by)
+    merged = calls_df.merge(pheno_df, how='inner', on=['sample', 'drug'])
+    # pheno and pred are categorical (S, R) = (0, 1), so this gives
+    # TN=0, FP=1, FN=2, TP=3
+    merged['outcome'] = pd.Categorical.from_codes(2 * merged['pheno'].cat.codes + merged['pred'].cat.codes, categories=outcome_names)
+    counts = merged.groupby(group_by + ['outcome'], observed=True, dropna=False).size().unstack('outcome', fill_value=0)
+    counts = counts.reindex(columns=outcome_names, fill_value=0)
+    counts.columns = list(counts.columns)
+    counts = counts.reset_index()[group_by + ['TP', 'FP', 'TN', 'FN']]
+    return _add_stats(counts)
+
+
+def bootstrap_confidence_intervals(confusion_df, samples=1000, alpha=0.05, seed=None):
+    '''Adds columns <stat>_low and <stat>_high to a dataframe made by
+    confusion_matrices, for each of sensitivity, specificity, PPV, NPV.
+    Resamples each group's calls with replacement (which is the same as
+    drawing its TP/FP/TN/FN counts from a multinomial), for all groups
+    at once'''
+    rng = np.random.default_rng(seed)
+    counts = confusion_df[['TP', 'FP', 'TN', 'FN']].to_numpy(dtype=np.int64)
+    totals = counts.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        probs = np.where(totals[:, None] > 0, counts / totals[:, None], 0.25)
+    resampled = rng.multinomial(totals, probs, size=(samples, len(totals))).astype(float)
+    tp, fp, tn, fn = (resampled[:, :, i] for i in range(4))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stats = {
+            'sensitivity': tp / (tp + fn),
+            'specificity': tn / (tn + fp),
+            'PPV': tp / (tp + fp),
+            'NPV': tn / (tn + fn),
+        }
+
+    df = confusion_df.copy()
+    for stat, values in stats.items():
+        all_nan = np.isnan(values).all(axis=0)
+        values[:, all_nan] = 0
+        low, high = np.nanpercentile(values, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+        df[f'{stat}_low'] = np.where(all_nan, np.nan, low)
+        df[f'{stat}_high'] = np.where(all_nan, np.nan, high)
+    return df
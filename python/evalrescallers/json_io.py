@@ -0,0 +1,135 @@
+import json
+
+# Optional faster backends. orjson is used to load and write JSON, and
+# ijson (only with its C backend) to load parts of big files without
+# making python objects for the rest of the file
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+    if ijson.backend != 'yajl2_c':
+        ijson = None
+except ImportError:
+    ijson = None
+
+
+def _orjson_default(obj):
+    # eg numpy floats in the resource profile summary
+    if hasattr(obj, 'item'):
+        return obj.item()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def dumps(data, pretty=False):
+    '''Returns data as a JSON string, with keys sorted. Compact by
+    default. If pretty is True, indents with 4 spaces, in the same way as
+    json.dumps(data, sort_keys=True, indent=4)'''
+    if pretty:
+        return json.dumps(data, sort_keys=True, indent=4)
+    elif orjson is not None:
+        return orjson.dumps(data, default=_orjson_default, option=orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY).decode()
+    else:
+        return json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+
+def loads(s):
+    if orjson is not None:
+        return orjson.loads(s)
+    else:
+        return json.loads(s)
+
+
+def write(data, filename, pretty=False):
+    '''Writes data to a UTF-8 JSON file. See dumps()'''
+    with open(filename, 'w', encoding='utf-8') as f:
+        print(dumps(data, pretty=pretty), file=f)
+
+
+def load(filename):
+    with open(filename, 'rb') as f:
+        return loads(f.read())
+
+
+# Used in the key stack for values in lists, so that they never match
+_list_item = object()
+
+
+def _path_matches(path, paths):
+    for wanted in paths:
+        if len(wanted) == len(path) and all(w == p or (w == '*' and p is not _list_item) for w, p in zip(wanted, path)):
+            return True
+    return False
+
+
+def _add_to_nested_dict(d, path, value):
+    for key in path[:-1]:
+        d = d.setdefault(key, {})
+    d[path[-1]] = value
+
+
+def _select_from_data(data, paths, path=()):
+    # Yields (path, value) for each part of the loaded data that matches paths
+    if _path_matches(path, paths):
+        yield path, data
+    elif isinstance(data, dict) and len(path) < max(len(x) for x in paths):
+        for key, value in data.items():
+            yield from _select_from_data(value, paths, path + (key,))
+
+
+def _select_from_events(events, paths):
+    # Same as _select_from_data, but from ijson parser events. Keeps its
+    # own stack of keys because the ijson prefix strings join keys with
+    # ".", which is ambiguous when keys (eg sample names) have dots in them
+    path = []
+    builder = None
+    depth = 0
+
+    for _, event, value in events:
+        if builder is not None:
+            builder.event(event, value)
+            if event in ('start_map', 'start_array'):
+                depth += 1
+            elif event in ('end_map', 'end_array'):
+                depth -= 1
+                if depth == 0:
+                    yield tuple(path), builder.value
+                    builder = None
+        elif event == 'map_key':
+            path[-1] = value
+        elif event in ('end_map', 'end_array'):
+            path.pop()
+        elif _path_matches(path, paths):
+            if event in ('start_map', 'start_array'):
+                builder = ijson.common.ObjectBuilder()
+                builder.event(event, value)
+                depth = 1
+            else:
+                yield tuple(path), value
+        elif event == 'start_map':
+            path.append(None)
+        elif event == 'start_array':
+            path.append(_list_item)
+
+
+def load_selected(filename, paths):
+    '''Loads only some parts of a JSON file. paths = list of tuples of
+    keys, where "*" matches any key. eg [('*', 'susceptibility')] gets the
+    susceptibility of every sample in a Mykrobe file. Returns nested dicts
+    with only the matching parts of the file. Parts inside lists cannot be
+    selected. Uses ijson if it is installed, so that the rest of the file is
+    not loaded into memory, otherwise loads the whole file'''
+    selected = {}
+
+    if ijson is None:
+        items = _select_from_data(load(filename), paths)
+        for path, value in items:
+            _add_to_nested_dict(selected, path, value)
+    else:
+        with open(filename, 'rb') as f:
+            for path, value in _select_from_events(ijson.parse(f, use_float=True), paths):
+                _add_to_nested_dict(selected, path, value)
+
+    return selected
@@ -0,0 +1,206 @@
+import collections
+import concurrent.futures
+import itertools
+import logging
+import os
+import shutil
+import traceback
+
+from evalrescallers import pipeline_output_dir, resource_model, run_res_callers
+
+# One (sample, caller) pair to run. args is the tuple of arguments
+# for run_res_callers.run_one_caller. threads and ram (GB, or None
+# for unknown) are what the task needs from the budget
+Task = collections.namedtuple('Task', ['sample', 'caller', 'args', 'threads', 'ram'])
+
+# Only look this far along the queue for a task that fits in the free
+# CPUs and RAM, so that picking tasks stays fast with many samples
+scan_window = 1000
+
+
+def tasks_that_fit(pending, free_threads, free_ram, any_running):
+    '''Returns the indexes of tasks in the deque pending that can be
+    started now, given the free CPUs and RAM (in GB, or None for no RAM
+    limit). Tasks are taken first come first served, skipping any that
+    do not fit, so that small tasks fill in the gaps left by big ones.
+    If nothing is running, then the first task is always returned, so that
+    a task asking for more than the whole budget still gets run (on its own)'''
+    to_start = []
+
+    for i, task in enumerate(pending):
+        if i >= scan_window or free_threads <= 0:
+            break
+        ram_ok = free_ram is None or task.ram is None or task.ram <= free_ram
+        if task.threads <= free_threads and ram_ok:
+            to_start.append(i)
+            free_threads -= task.threads
+            if free_ram is not None and task.ram is not None:
+                free_ram -= task.ram
+
+    if len(to_start) == 0 and not any_running and len(pending) > 0:
+        to_start.append(0)
+
+    return to_start
+
+
+def _run_task(run_function, args):
+    # If this is a retry, the failed attempt may have left files behind
+    caller_outdir = args[1]
+    if os.path.exists(caller_outdir):
+        shutil.rmtree(caller_outdir)
+    return run_function(*args)
+
+
+def run_tasks(tasks, threads, ram=None, retries=2, run_function=run_res_callers.run_one_caller, on_task_done=None):
+    '''Runs all the tasks in a process pool, using at most threads CPUs and
+    ram GB of RAM (None means no limit) at once. A worker that becomes free
+    takes the next task in the queue that fits. Failed tasks are put back at
+    the end of the queue, up to retries times. on_task_done(task, success) is
+    called in this process when each task has finished (after any retries).
+    tasks can be any iterable, eg a generator that yields tasks as their
+    samples are set up. Only up to scan_window tasks are taken from it
+    ahead of the ones running, so tasks can start before it is finished.
+    Returns the number of tasks that failed'''
+    max_workers = threads
+    if hasattr(tasks, '__len__'):
+        max_workers = min(threads, len(tasks))
+    tasks = iter(tasks)
+    more_tasks = True
+    pending = collections.deque()
+    attempts = collections.Counter()
+    running = {}
+    free_threads = threads
+    free_ram = ram
+    fails = 0
+    finished = 0
+    total = 0
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        while True:
+            while more_tasks and len(pending) < scan_window:
+                task = next(tasks, None)
+                if task is None:
+                    more_tasks = False
+                else:
+                    pending.append(task)
+                    total += 1
+
+            if len(pending) == 0 and len(running) == 0:
+                break
+
+            to_start = tasks_that_fit(pending, free_threads, free_ram, len(running) > 0)
+            for i in reversed(to_start):
+                task = pending[i]
+                del pending[i]
+                attempts[(task.sample, task.caller)] += 1
+                logging.info(f'Submitting {task.caller.outdir_name} on sample {task.sample} (threads={task.threads}, ram={task.ram}, attempt {attempts[(task.sample, task.caller)]})')
+                future = executor.submit(_run_task, run_function, task.args)
+                running[future] = task
+                free_threads -= task.threads
+                if free_ram is not None and task.ram is not None:
+                    free_ram -= task.ram
+
+            done, not_done = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                task = running.pop(future)
+                free_threads += task.threads
+                if free_ram is not None and task.ram is not None:
+                    free_ram += task.ram
+                try:
+                    success = future.result()
+                except Exception:
+                    logging.info(f'Failed {task.caller.outdir_name} on sample {task.sample}. Traceback is:')
+                    logging.info(traceback.format_exc())
+                    success = False
+
+                if not success and attempts[(task.sample, task.caller)] <= retries:
+                    logging.info(f'Retrying {task.caller.outdir_name} on sample {task.sample}')
+                    pending.append(task)
+                    continue
+
+                finished += 1
+                if not success:
+                    fails += 1
+                logging.info(f'Finished {finished}/{total} tasks queued so far ({fails} failed)')
+                if on_task_done is not None:
+                    on_task_done(task, success)
+
+    return fails
+
+
+def run_pipeline(input_data_file, callers_file, output_dir, no_new_data=False, threads=1, ram=None, retries=2, testing=False, profile_interval=1.0, summary_threads=1):
+    '''Does the same as the nextflow pipeline run_callers.nf, on this machine
+    and without nextflow. The output directory is the same as made by
+    nextflow, so the two can be used on the same directory:
+    output_dir/caller_output (the PipelineOutputDir), and the summary of
+    all samples in output_dir/summary.json and output_dir/summary.sqlite.
+    Each (sample, caller) pair is run as a separate task. Callers that already
+    have a "done" file are not rerun, so this can be used to resume a run.
+    The CPUs and RAM each caller needs are taken from the callers file,
+    and each caller is told to use that many CPUs.
+    If the RAM is not there, it is predicted from previous runs (see
+    resource_model), if there are any'''
+    output_dir = os.path.abspath(output_dir)
+    caller_output_dir = os.path.join(output_dir, 'caller_output')
+    # The pipeline directory is made first, because the resource model
+    # keeps its cache in it
+    os.makedirs(caller_output_dir, exist_ok=True)
+
+    logging.info('Setting up pipeline output directory')
+    pipe_dir = pipeline_output_dir.PipelineOutputDir(caller_output_dir)
+    model = resource_model.fit_model(resource_model.collect_observations(pipe_dir, threads=summary_threads, incremental=True))
+    # A caller never gets more CPUs than are available in total
+    callers = [x._replace(threads=min(x.threads, threads)) for x in run_res_callers.load_callers_file(callers_file)]
+    summary_json_files = {}
+    sample_outstanding = {}
+    task_count = collections.Counter()
+    summary_sqlite = os.path.join(output_dir, 'summary.sqlite')
+
+    def write_sample_summary(sample):
+        # Also adds the sample to the summary of all samples straight away,
+        # so it can be queried while the rest are running
+        sample_dir = os.path.join(caller_output_dir, pipe_dir.get_sample(sample)['dir'])
+        run_res_callers.summary_json_from_all_callers(summary_json_files[sample], os.path.join(sample_dir, 'summary.json'))
+        pipe_dir.add_sample_to_summary(sample, summary_sqlite)
+
+    def sample_tasks(samples):
+        # Yields the tasks of each sample. New samples come from the
+        # pipeline directory as soon as their directories are made, so the
+        # first callers start while the rest of the samples are set up
+        for d in samples:
+            sample = d['name']
+            sample_dir = os.path.join(caller_output_dir, d['dir'])
+            if not os.path.exists(sample_dir):
+                os.makedirs(sample_dir)
+            summary_json_files[sample], jobs = run_res_callers.caller_jobs_for_one_sample(callers, sample_dir, d['reads'][0], d['reads'][1], testing=testing, profile_interval=profile_interval)
+            if len(jobs) == 0:
+                # All callers were done already. Write the sample summary
+                # if it is not there (eg the last run was killed at that point)
+                if not os.path.exists(os.path.join(sample_dir, 'summary.json')):
+                    write_sample_summary(sample)
+                continue
+
+            sample_outstanding[sample] = len(jobs)
+            task_count['samples'] += 1
+            input_bytes = resource_model.reads_bytes(d['reads'])
+            for caller, args in jobs:
+                task_ram = resource_model.caller_hints(model, caller.outdir_name, input_bytes, ram=caller.ram)[0]
+                task_count['tasks'] += 1
+                yield Task(sample, caller, args, caller.threads, task_ram)
+
+    def on_task_done(task, success):
+        sample_outstanding[task.sample] -= 1
+        if sample_outstanding[task.sample] == 0:
+            write_sample_summary(task.sample)
+
+    samples = [d for sample, d in sorted(pipe_dir.data['samples'].items())]
+    if not no_new_data:
+        samples = itertools.chain(samples, pipe_dir.iter_add_data_from_file(input_data_file, threads=max(1, threads)))
+
+    logging.info('Running caller tasks')
+    fails = run_tasks(sample_tasks(samples), threads, ram=ram, retries=retries, on_task_done=on_task_done)
+    logging.info(f'Finished running callers. {fails} of {task_count["tasks"]} tasks on {task_count["samples"]} samples failed')
+
+    logging.info('Making summary of all samples')
+    pipe_dir.finalize_summary(os.path.join(output_dir, 'summary.json'), summary_sqlite, threads=summary_threads)
+    return fails
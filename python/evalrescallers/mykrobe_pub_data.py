@@ -1,11 +1,27 @@
+from collections import namedtuple
 import csv
+import functools
 import os
 
+import numpy as np
+
 import evalrescallers
+from evalrescallers import truth_data_cache
 
 eval_dir = os.path.abspath(os.path.dirname(evalrescallers.__file__))
 publication_suppl_files_dir = os.path.join(eval_dir, 'data')
 tb_comid_to_country = None
+nature_suppl_files = {
+    'staph': ['ncomms10063-s4.txt'],
+    'tb': [
+        'ncomms10063-s10.txt',
+        'ncomms10063-s7.txt',
+        'ncomms10063-s8.txt',
+        'ncomms10063-s9.txt',
+    ],
+}
+
+NatureMatrices = namedtuple('NatureMatrices', ['samples', 'drugs', 'pheno', 'country'])
 
 
 def load_nature_suppl_file(infile, species):
@@ -67,15 +83,7 @@ def load_sample_to_country_file(infile):
 def load_all_nature_suppl_files(species):
     sample_to_res = {}
     assert os.path.exists(publication_suppl_files_dir)
-    files = {
-        'staph': ['ncomms10063-s4.txt'],
-        'tb': [
-            'ncomms10063-s10.txt',
-            'ncomms10063-s7.txt',
-            'ncomms10063-s8.txt',
-            'ncomms10063-s9.txt',
-        ],
-    }
+    files = nature_suppl_files
     assert species in files
     all_drugs = set()
     sample_to_res = {}
@@ -100,3 +108,34 @@ def load_all_nature_suppl_files(species):
 
     return all_drugs, sample_to_res, sample_to_country
 
+
+# Version of the arrays made by _build_all_nature_suppl_matrices. Change this
+# when that function changes, so that old cache files are not used
+matrices_version = 1
+
+
+def _build_all_nature_suppl_matrices(species):
+    drugs, sample_to_res, sample_to_country = load_all_nature_suppl_files(species)
+    drugs = sorted(drugs)
+    samples = sorted(sample_to_res)
+    return {
+        'samples': np.array(samples),
+        'drugs': np.array(drugs),
+        'pheno': truth_data_cache.pheno_dict_to_matrix(sample_to_res, samples, drugs),
+        'country': np.array([sample_to_country.get(x, '') for x in samples]),
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def load_all_nature_suppl_matrices(species):
+    '''Returns the same data as load_all_nature_suppl_files, as a
+    NatureMatrices tuple of numpy arrays: samples and drugs (sorted names),
+    pheno (samples x drugs int8 matrix, using the values in truth_data_cache),
+    and country (empty string if not known). The arrays are cached on disk
+    after the first call (see truth_data_cache), and are read only'''
+    assert species in nature_suppl_files
+    source_files = [os.path.join(publication_suppl_files_dir, x) for x in nature_suppl_files[species]]
+    if species == 'tb':
+        source_files.append(os.path.join(publication_suppl_files_dir, 'ncomms_countries.tsv'))
+    arrays = truth_data_cache.load_or_build(f'ncomms10063.{species}', source_files, lambda: _build_all_nature_suppl_matrices(species), build_version=matrices_version)
+    return NatureMatrices(**{k: arrays[k] for k in NatureMatrices._fields})
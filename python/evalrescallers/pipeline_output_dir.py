@@ -1,8 +1,12 @@
+from collections import OrderedDict
+import concurrent.futures
+import hashlib
 import json
 import logging
 import multiprocessing
 import os
-import pathlib
+
+from evalrescallers import json_io, sample_index, summary_db
 
 
 def load_one_sample_summary_json_file(data_tuple):
@@ -10,21 +14,330 @@ def load_one_sample_summary_json_file(data_tuple):
     if not os.path.exists(json_file):
         return sample, None
 
-    with open(json_file) as f:
-        data = json.load(f)
+    return sample, json_io.load(json_file)
+
+
+def _read_shard_record(shard_file, offset, length, sample):
+    '''Returns the summary data of sample from the line of the shard file
+    that starts at byte offset and has the given length (not including the
+    newline). Returns None if the file is missing, or that is not a whole
+    line that is the record of sample, for example if the shard was
+    rewritten or only partly written when a previous run crashed'''
+    try:
+        with open(shard_file, 'rb') as f:
+            if offset > 0:
+                f.seek(offset - 1)
+                if f.read(1) != b'\n':
+                    return None
+            line = f.read(length + 1)
+        if len(line) != length + 1 or not line.endswith(b'\n'):
+            return None
+        record = json_io.loads(line)
+        if record['sample'] != sample:
+            return None
+        return record['summary']
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def load_one_sample_summary_json_file_if_changed(data_tuple):
+    '''Same as load_one_sample_summary_json_file, but only loads the JSON
+    file if its (mtime_ns, size) is not old_stat. The file is looked at
+    before it is loaded, so that a change while it is loaded is found next
+    time. Returns tuple (sample, data, (mtime_ns, size)). data is None if
+    the file has not changed, and the stat is None if there is no file'''
+    sample, json_file, old_stat = data_tuple
+    try:
+        stat = os.stat(json_file)
+    except FileNotFoundError:
+        return sample, None, None
+
+    new_stat = (stat.st_mtime_ns, stat.st_size)
+    if new_stat == old_stat:
+        return sample, None, new_stat
+    return sample, load_one_sample_summary_json_file((sample, json_file))[1], new_stat
+
+
+def load_one_sample_summary_json_file_incremental(data_tuple):
+    '''Same as load_one_sample_summary_json_file, but only parses the
+    JSON file if it has changed since the entry old_entry in the summary
+    manifest was made. Otherwise the sample is read from the old shard file,
+    unless its record there is not as expected (eg after a crash), in which
+    case the JSON file is parsed.
+    Returns tuple (sample, data, new manifest entry, True iff JSON was parsed)'''
+    sample, json_file, old_entry, old_shards_dir = data_tuple
+    try:
+        stat = os.stat(json_file)
+    except FileNotFoundError:
+        return sample, None, None, False
+
+    entry = {'path': json_file, 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'sha256': None}
+
+    if old_entry is not None and old_shards_dir is not None and old_entry['path'] == json_file:
+        old_shard_file = os.path.join(old_shards_dir, f'{old_entry["shard"]}.jsonl')
+        unchanged = old_entry['mtime_ns'] == entry['mtime_ns'] and old_entry['size'] == entry['size']
+        if unchanged:
+            entry['sha256'] = old_entry['sha256']
+            contents = None
+        else:
+            with open(json_file, 'rb') as f:
+                contents = f.read()
+            entry['sha256'] = hashlib.sha256(contents).hexdigest()
+            unchanged = entry['sha256'] == old_entry['sha256']
+
+        if unchanged:
+            summary = _read_shard_record(old_shard_file, old_entry['offset'], old_entry['length'], sample)
+            if summary is not None:
+                return sample, summary, entry, False
+            logging.warning(f'Record of sample {sample} not found in {old_shard_file} at the position in the manifest. Using {json_file} instead')
+    else:
+        contents = None
+
+    if contents is None:
+        with open(json_file, 'rb') as f:
+            contents = f.read()
+        entry['sha256'] = hashlib.sha256(contents).hexdigest()
+
+    return sample, json_io.loads(contents), entry, True
+
+
+def make_bucket_dirs(data_tuple):
+    '''Makes the directory of one samples_per_dir bucket (if it does not
+    exist already), then the directories of the given samples in it.
+    Sample directories that exist already are an error, unless exist_ok
+    is True. Returns the list of sample dicts'''
+    output_dir, bucket_dir, samples, exist_ok = data_tuple
+    os.makedirs(os.path.join(output_dir, bucket_dir), exist_ok=True)
+    for sample_dict in samples:
+        os.makedirs(os.path.join(output_dir, sample_dict['dir']), exist_ok=exist_ok)
+    return samples
+
+
+def _samples_by_bucket(samples):
+    # Returns OrderedDict of samples_per_dir bucket directory -> list of
+    # the sample dicts in it
+    buckets = OrderedDict()
+    for sample_dict in samples:
+        buckets.setdefault(os.path.dirname(sample_dict['dir']), []).append(sample_dict)
+    return buckets
+
+
+def iter_summary_shard(shard_file):
+    '''Yields (sample name, summary data) tuples from one
+    JSON Lines shard file made by make_summary_json_of_all_samples'''
+    with open(shard_file, 'rb') as f:
+        for line in f:
+            d = json_io.loads(line)
+            yield d['sample'], d['summary']
+
+
+def iter_summary_shards(shards_dir):
+    '''Yields the shard files in shards_dir, in order of the bucket number.
+    Use iter_summary_shard to get the samples from each one'''
+    shards = [x for x in os.listdir(shards_dir) if x.endswith('.jsonl')]
+    for filename in sorted(shards, key=lambda x: int(x.split('.')[0])):
+        yield os.path.join(shards_dir, filename)
+
+
+def write_summary_json(sample_summaries, outfile, pretty=False):
+    '''Writes the summary of all samples to a JSON file, where
+    sample_summaries is an iterable of (sample name, summary data) tuples,
+    sorted by sample name. Gives the same output as
+    json_io.write(dict(sample_summaries), outfile, pretty=pretty), but
+    without needing all the samples in memory'''
+    wrote_any = False
+
+    with open(outfile, 'w', encoding='utf-8') as f:
+        print('{', end='', file=f)
+
+        for sample, sample_data in sample_summaries:
+            if pretty:
+                sample_json = json_io.dumps(sample_data, pretty=True).replace('\n', '\n    ')
+                print(',' if wrote_any else '', '\n    ', json.dumps(sample), ': ', sample_json, sep='', end='', file=f)
+            else:
+                print(',' if wrote_any else '', json_io.dumps(sample), ':', json_io.dumps(sample_data), sep='', end='', file=f)
+            wrote_any = True
+
+        print('\n}' if pretty and wrote_any else '}', file=f)
+
+
+class ShardWriter:
+    '''Writes lines to one file per bucket. Lines for any bucket can be added
+    in any order. Only keeps max_open files open at once. Files are written to
+    a temporary name, and renamed by close(), so that a crash does not leave
+    a partially written shard'''
+    def __init__(self, outdir, max_open=64):
+        self.outdir = os.path.abspath(outdir)
+        self.max_open = max_open
+        self.handles = OrderedDict()
+        self.started = set()
+        if not os.path.exists(self.outdir):
+            os.mkdir(self.outdir)
+
+
+    def _tmp_file(self, bucket):
+        return os.path.join(self.outdir, f'{bucket}.jsonl.tmp')
+
+
+    def write_line(self, bucket, line):
+        '''Appends line to the file for bucket. Returns the byte offset
+        and length of the line (not including the newline) in the file'''
+        if bucket in self.handles:
+            self.handles.move_to_end(bucket)
+        else:
+            if len(self.handles) >= self.max_open:
+                _, old_handle = self.handles.popitem(last=False)
+                old_handle.close()
+            mode = 'ab' if bucket in self.started else 'wb'
+            self.handles[bucket] = open(self._tmp_file(bucket), mode)
+            self.started.add(bucket)
+
+        handle = self.handles[bucket]
+        offset = handle.tell()
+        line = line.encode()
+        handle.write(line + b'\n')
+        return offset, len(line)
+
+
+    def close(self):
+        for handle in self.handles.values():
+            handle.close()
+        self.handles = OrderedDict()
+
+        for bucket in self.started:
+            os.rename(self._tmp_file(bucket), os.path.join(self.outdir, f'{bucket}.jsonl'))
+
+
+class JobsTsvWriter:
+    '''Writes the jobs TSV file for nextflow, one sample at a time. Each line
+    is flushed when it is written, so that the file can be read while more
+    samples are being added. If with_hints is True, adds columns memory_gb and
+    time_hours (see resource_model.sample_hints), with "." where a sample has
+    no hint. If per_caller is True, there is one line per (sample, caller)
+    instead of one line per sample, with extra columns caller (the caller's
+    outdir_name) and cpus. Use as a context manager, or call close()'''
+    def __init__(self, outfile, with_hints=False, per_caller=False):
+        self.with_hints = with_hints
+        self.per_caller = per_caller
+        self.handle = open(outfile, 'w')
+        header = ['name', 'reads1', 'reads2', 'sample_dir']
+        if self.per_caller:
+            header.extend(['caller', 'cpus'])
+        if self.with_hints:
+            header.extend(['memory_gb', 'time_hours'])
+        self._write_line(header)
+
+
+    def __enter__(self):
+        return self
+
 
-    return sample, data
+    def __exit__(self, *args):
+        self.close()
+
+
+    def _write_line(self, fields):
+        print(*fields, sep='\t', file=self.handle, flush=True)
+
+
+    def add(self, sample_dict, hints=None, caller=None):
+        '''Writes the line for one sample. hints = tuple (RAM in GB, wall
+        clock hours), or None for no hint. Ignored unless with_hints is True.
+        If per_caller is True, caller must be the run_res_callers.Caller
+        of this line'''
+        fields = [sample_dict['name'], sample_dict['reads'][0], sample_dict['reads'][1], sample_dict['dir']]
+        if self.per_caller:
+            fields.extend([caller.outdir_name, caller.threads])
+        if self.with_hints:
+            if hints is None:
+                hints = (None, None)
+            fields.extend(['.' if x is None else round(x, 2) for x in hints])
+        self._write_line(fields)
+
+
+    def close(self):
+        self.handle.close()
 
 
 class PipelineOutputDir:
+    '''The samples are kept in the SQLite file samples.db (see
+    sample_index.SampleIndex). Older directories have them in data.json
+    instead, and these are copied into samples.db the first time samples are
+    added. data.json is left where it is, but is only updated if asked for
+    (see iter_add_data_from_file and write_json_data_file). self.data has all the samples, in the same format as data.json.
+    It is loaded when first used, so use get_sample() to look up a few
+    samples in a big directory.
+    New samples are pending in samples.db until their directories are
+    made. Directories of pending samples left by a run that was killed are
+    made when the samples are next loaded'''
     def __init__(self, output_dir, samples_per_dir=100):
         self.output_dir = os.path.abspath(output_dir)
         self.json_data_file = os.path.join(self.output_dir, 'data.json')
-        if os.path.exists(self.json_data_file):
-            with open(self.json_data_file) as f:
-                self.data = json.load(f)
-        else:
-            self.data = {'samples_per_dir': samples_per_dir, 'samples': {}}
+        self.sample_index_file = os.path.join(self.output_dir, 'samples.db')
+        self.summary_manifest_file = os.path.join(self.output_dir, 'summary_manifest.json')
+        self.default_shards_dir = os.path.join(self.output_dir, 'summary_shards')
+        self.samples_per_dir = samples_per_dir
+        self._data = None
+
+
+    @property
+    def data(self):
+        if self._data is None:
+            if os.path.exists(self.sample_index_file):
+                with sample_index.SampleIndex(self.sample_index_file) as index:
+                    self._make_pending_dirs(index)
+                    self._data = {'samples_per_dir': index.samples_per_dir, 'samples': {x['name']: x for x in index}}
+            elif os.path.exists(self.json_data_file):
+                self._data = json_io.load(self.json_data_file)
+            else:
+                self._data = {'samples_per_dir': self.samples_per_dir, 'samples': {}}
+        return self._data
+
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+
+
+    def get_sample(self, name):
+        '''Returns dict of one sample (name, reads, number, dir), or
+        None if it is not in this directory'''
+        if self._data is None and os.path.exists(self.sample_index_file):
+            with sample_index.SampleIndex(self.sample_index_file) as index:
+                self._make_pending_dirs(index)
+                return index.get(name)
+        return self.data['samples'].get(name)
+
+
+    def _make_pending_dirs(self, index):
+        # Makes the directories of samples that were added to the index
+        # by a run that was killed before it made them
+        pending = index.pending_samples()
+        if len(pending) == 0:
+            return
+        logging.info(f'Making directories of {len(pending)} samples that were added to {self.sample_index_file} but not set up')
+        for bucket_dir, samples in _samples_by_bucket(pending).items():
+            make_bucket_dirs((self.output_dir, bucket_dir, samples, True))
+        index.clear_pending([x['number'] for x in pending])
+
+
+    def _open_sample_index(self):
+        # Makes samples.db if it does not exist, importing the samples
+        # from data.json if there is one. data.json is left where it is
+        if os.path.exists(self.sample_index_file) or not os.path.exists(self.json_data_file):
+            return sample_index.SampleIndex(self.sample_index_file, samples_per_dir=self.samples_per_dir)
+
+        old_data = json_io.load(self.json_data_file)
+        tmp_file = self.sample_index_file + '.tmp'
+        for filename in tmp_file, tmp_file + '-wal', tmp_file + '-shm':
+            if os.path.exists(filename):
+                os.unlink(filename)
+        with sample_index.SampleIndex(tmp_file, samples_per_dir=old_data['samples_per_dir']) as index:
+            index.add_samples(sorted(old_data['samples'].values(), key=lambda x: x['number']), PipelineOutputDir.sample_number_to_dir)
+            index.connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        os.rename(tmp_file, self.sample_index_file)
+        logging.info(f'Copied {len(old_data["samples"])} samples from {self.json_data_file} to {self.sample_index_file}')
+        return sample_index.SampleIndex(self.sample_index_file)
 
 
     @classmethod
@@ -46,50 +359,202 @@ class PipelineOutputDir:
         return os.path.join(str(sample_number // samples_per_dir), str(sample_number))
 
 
-    def add_data_from_file(self, input_data_file):
+    def iter_add_data_from_file(self, input_data_file, threads=1, write_json_data=False):
+        '''Adds the samples in input_data_file to samples.db, and makes
+        their directories. All the samples are added, or none if any of
+        them are already in this directory. Directories are made one
+        samples_per_dir bucket at a time, with up to threads buckets at once.
+        Yields the dict of each new sample (name, reads, number, dir) as soon
+        as its directory exists, so that the caller can start using samples
+        before the rest are set up. Samples in a bucket are yielded in order
+        of sample number, but buckets can be yielded in any order.
+        If write_json_data is True, data.json is written with all the samples
+        at the end (see write_json_data_file). This loads and writes every
+        sample, so is off by default'''
         if not os.path.exists(self.output_dir):
             os.mkdir(self.output_dir)
 
         data_from_file = PipelineOutputDir.load_input_data_file(input_data_file)
 
-        for this_sample_name, sample_dict in data_from_file.items():
-            if this_sample_name in self.data['samples']:
-                raise Exception('Sample already exists. Cannot add another with the same name. Sample name: ' + this_sample_name)
+        with self._open_sample_index() as index:
+            self._make_pending_dirs(index)
+            new_samples = index.add_samples(list(data_from_file.values()), PipelineOutputDir.sample_number_to_dir, pending=True)
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+                futures = [executor.submit(make_bucket_dirs, (self.output_dir, bucket_dir, samples, False)) for bucket_dir, samples in _samples_by_bucket(new_samples).items()]
+                for future in concurrent.futures.as_completed(futures):
+                    samples = future.result()
+                    index.clear_pending([x['number'] for x in samples])
+                    for sample_dict in samples:
+                        if self._data is not None:
+                            self._data['samples'][sample_dict['name']] = sample_dict
+                        yield sample_dict
+
+        if write_json_data:
+            self.write_json_data_file()
 
-            sample_dict['number'] = len(self.data['samples'])
-            sample_dict['dir'] = PipelineOutputDir.sample_number_to_dir(sample_dict['number'], self.data['samples_per_dir'])
-            pathlib.Path(os.path.join(self.output_dir, sample_dict['dir'])).mkdir(parents=True)
-            self.data['samples'][this_sample_name] = sample_dict
+
+    def add_data_from_file(self, input_data_file, threads=1, write_json_data=False):
+        '''Same as iter_add_data_from_file, but returns when all the new
+        samples have been set up'''
+        for _ in self.iter_add_data_from_file(input_data_file, threads=threads, write_json_data=write_json_data):
+            pass
 
 
     def write_json_data_file(self):
+        '''Writes all the samples to data.json. This package uses samples.db,
+        so this is only needed by other programs that read data.json'''
         if not os.path.exists(self.output_dir):
             os.mkdir(self.output_dir)
 
-        with open(self.json_data_file, 'w') as f:
+        tmp_file = self.json_data_file + '.tmp'
+        with open(tmp_file, 'w') as f:
             print(json.dumps(self.data, sort_keys=True, indent=4), file=f)
+        os.replace(tmp_file, self.json_data_file)
 
 
-    def write_tsv_file(self, outfile):
-        with open(outfile, 'w') as f:
-            print('name', 'reads1', 'reads2', 'sample_dir', sep='\t', file=f)
+    def write_tsv_file(self, outfile, resource_hints=None):
+        '''Writes the jobs TSV file for nextflow, with all the samples sorted
+        by name. resource_hints is an optional dict of sample name ->
+        (RAM in GB, wall clock hours) (see JobsTsvWriter)'''
+        with JobsTsvWriter(outfile, with_hints=resource_hints is not None) as writer:
             for sample_name, d in sorted(self.data['samples'].items()):
-                print(sample_name, d['reads'][0], d['reads'][1], d['dir'], sep='\t', file=f)
+                hints = None if resource_hints is None else resource_hints.get(sample_name)
+                writer.add(dict(d, name=sample_name), hints=hints)
+
+
+    def load_summary_manifest(self):
+        if os.path.exists(self.summary_manifest_file):
+            with open(self.summary_manifest_file) as f:
+                return json.load(f)
+        else:
+            return {'shards_dir': None, 'samples': {}}
+
+
+    def write_summary_manifest(self, manifest):
+        tmp_file = self.summary_manifest_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(manifest, f, sort_keys=True)
+        os.rename(tmp_file, self.summary_manifest_file)
+
+
+    def make_summary_json_of_all_samples(self, outfile, threads=1, shards_dir=None, incremental=False, sqlite_file=None, pretty=False):
+        '''Writes all the sample summary.json files into one JSON file.
+        Samples are written in sorted order as they are loaded, so only a
+        few samples are in memory at once. The JSON is compact, unless pretty
+        is True (see json_io.dumps). If shards_dir is given, also writes
+        one JSON Lines file per samples_per_dir bucket in that directory.
+
+        If incremental is True, a manifest of the summary.json files
+        (path, mtime, size, sha256 and where the sample is in the shards) is
+        kept in the pipeline directory, and only files that changed since the
+        last run are parsed. Unchanged samples are taken from the shards of
+        the previous run. Shards are always written in this case, to
+        default_shards_dir if shards_dir is not given.
+
+        If sqlite_file is given, also writes a flat table of all the calls to
+        that SQLite file (see summary_db.SummaryDb)'''
+        samples = sorted(self.data['samples'])
+        sample_files = [os.path.join(self.output_dir, self.data['samples'][sample]['dir'], 'summary.json') for sample in samples]
+
+        if incremental:
+            if shards_dir is None:
+                shards_dir = self.default_shards_dir
+            old_manifest = self.load_summary_manifest()
+            old_shards_dir = old_manifest['shards_dir']
+            new_manifest = {'shards_dir': os.path.abspath(shards_dir), 'samples': {}}
+            load_function = load_one_sample_summary_json_file_incremental
+            load_args = [(sample, json_file, old_manifest['samples'].get(sample), old_shards_dir) for sample, json_file in zip(samples, sample_files)]
+        else:
+            load_function = load_one_sample_summary_json_file
+            load_args = list(zip(samples, sample_files))
+
+        shard_writer = None if shards_dir is None else ShardWriter(shards_dir)
+        db = None if sqlite_file is None else summary_db.SummaryDb(sqlite_file)
+        parsed_count = 0
+
+        def loaded_samples(pool):
+            nonlocal parsed_count
+            for result in pool.imap(load_function, load_args, chunksize=16):
+                sample, sample_data = result[:2]
+                if sample_data is None:
+                    logging.warning(f'No JSON file for sample {sample}')
+                    continue
+
+                if db is not None:
+                    db.add_sample(sample, sample_data)
+
+                if shard_writer is not None:
+                    bucket = self.data['samples'][sample]['number'] // self.data['samples_per_dir']
+                    offset, length = shard_writer.write_line(bucket, json_io.dumps({'sample': sample, 'summary': sample_data}))
+
+                    if incremental:
+                        entry, parsed = result[2:]
+                        entry.update({'shard': bucket, 'offset': offset, 'length': length})
+                        new_manifest['samples'][sample] = entry
+                        parsed_count += parsed
+
+                yield sample, sample_data
+
+        with multiprocessing.Pool(processes=threads) as pool:
+            write_summary_json(loaded_samples(pool), outfile, pretty=pretty)
+
+        if shard_writer is not None:
+            shard_writer.close()
+
+        if db is not None:
+            db.close()
+
+        if incremental:
+            logging.info(f'Parsed {parsed_count} changed summary JSON files. Used previous data for {len(new_manifest["samples"]) - parsed_count} unchanged samples')
+            self.write_summary_manifest(new_manifest)
+
 
+    def add_sample_to_summary(self, sample, sqlite_file):
+        '''Adds one sample, from its summary.json file, to the summary
+        SQLite file sqlite_file (see summary_db.SummaryStore). This is for
+        adding each sample as soon as its callers have finished. Use
+        finalize_summary when all samples have been added'''
+        sample_dict = self.get_sample(sample)
+        if sample_dict is None:
+            raise Exception(f'Sample "{sample}" not found in {self.output_dir}')
+        json_file = os.path.join(self.output_dir, sample_dict['dir'], 'summary.json')
+        sample_data, file_stat = load_one_sample_summary_json_file_if_changed((sample, json_file, None))[1:]
+        if sample_data is None:
+            raise Exception(f'No summary JSON file for sample {sample}: {json_file}')
 
-    def make_summary_json_of_all_samples(self, outfile, threads=1):
-        samples_and_files_list = [(sample, os.path.join(self.output_dir, self.data['samples'][sample]['dir'], 'summary.json')) for sample in self.data['samples']]
-        pool = multiprocessing.Pool(processes=threads)
-        results = pool.map(load_one_sample_summary_json_file, samples_and_files_list)
-        pool.close()
-        all_data = {}
-        for sample, sample_data in sorted(results):
-            if sample_data is None:
-                logging.warning(f'No JSON file for sample {sample}')
-                continue
+        with summary_db.SummaryStore(sqlite_file) as store:
+            store.add_sample(sample, sample_data, file_stat=file_stat)
 
-            all_data[sample] = sample_data
 
-        with open(outfile, 'w') as f:
-            print(json.dumps(all_data, sort_keys=True, indent=4), file=f)
+    def finalize_summary(self, outfile, sqlite_file, threads=1, pretty=False):
+        '''Finishes the summary SQLite file sqlite_file made by adding samples
+        with add_sample_to_summary, and writes the summary of all samples to
+        the JSON file outfile (in the same format as
+        make_summary_json_of_all_samples). Samples that have a summary.json
+        file but were not added (eg because they were finished by an earlier
+        run) are added first. Samples whose summary.json file has a different
+        mtime or size from when it was added (eg because of reparse) are
+        replaced. Other samples are not read again'''
+        with summary_db.SummaryStore(sqlite_file) as store:
+            in_store = store.samples()
+            old_stats = store.file_stats()
+            samples = sorted(self.data['samples'])
+            load_args = [(sample, os.path.join(self.output_dir, self.data['samples'][sample]['dir'], 'summary.json'), old_stats.get(sample)) for sample in samples]
+            added = 0
+            replaced = 0
+            with multiprocessing.Pool(processes=threads) as pool:
+                for sample, sample_data, file_stat in pool.imap(load_one_sample_summary_json_file_if_changed, load_args, chunksize=16):
+                    if file_stat is None:
+                        if sample not in in_store:
+                            logging.warning(f'No JSON file for sample {sample}')
+                    elif sample_data is not None:
+                        store.add_sample(sample, sample_data, file_stat=file_stat)
+                        if sample in in_store:
+                            replaced += 1
+                        else:
+                            added += 1
+            logging.info(f'Added {added} samples to {sqlite_file} that were not added while the pipeline was running, and replaced {replaced} samples whose summary.json changed')
 
+            store.finalize()
+            write_summary_json(store.iter_sample_summaries(), outfile, pretty=pretty)
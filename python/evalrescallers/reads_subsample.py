@@ -0,0 +1,92 @@
+import gzip
+import itertools
+import logging
+
+import numpy as np
+
+h37rv_genome_size = 4411532
+subsample_methods = {'first', 'random'}
+
+
+def _open_reads(filename):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rb')
+    else:
+        return open(filename, 'rb')
+
+
+def _open_out(filename):
+    # mtime=0 so that the same reads always give the same file. This
+    # means the result cache (see result_cache) works with subsampled reads
+    return gzip.GzipFile(filename, 'wb', compresslevel=1, mtime=0)
+
+
+def _read_pairs(reads1, reads2):
+    '''Yields tuples of (lines of forward read, lines of reverse read)'''
+    with _open_reads(reads1) as f1, _open_reads(reads2) as f2:
+        while True:
+            record1 = list(itertools.islice(f1, 4))
+            record2 = list(itertools.islice(f2, 4))
+            if len(record1) == 0 and len(record2) == 0:
+                return
+            if len(record1) != 4 or len(record2) != 4:
+                raise Exception(f'Reads files {reads1} and {reads2} have different number of reads, or are not in FASTQ format')
+            yield record1, record2
+
+
+def _pair_bases(record1, record2):
+    return len(record1[1].rstrip()) + len(record2[1].rstrip())
+
+
+def subsample_reads(reads1, reads2, out1, out2, depth, genome_size=h37rv_genome_size, method='first', seed=42):
+    '''Writes read pairs from reads1 and reads2 to the gzipped files out1 and
+    out2, to get depth times genome_size bases in total. If method is "first",
+    uses the first read pairs. If it is "random", reads the files once to
+    count the pairs, and then takes that many pairs chosen at random (using
+    seed) in a second pass. If there are not enough reads, all reads are used.
+    Returns dict describing the subsample, for adding to summary files'''
+    if method not in subsample_methods:
+        raise Exception(f'Subsample method must be one of {sorted(subsample_methods)}, but got "{method}"')
+
+    target_bases = depth * genome_size
+    pairs = 0
+    bases = 0
+
+    if method == 'first':
+        wanted = None
+    else:
+        total_pairs = 0
+        total_bases = 0
+        for record1, record2 in _read_pairs(reads1, reads2):
+            total_pairs += 1
+            total_bases += _pair_bases(record1, record2)
+        mean_bases = total_bases / total_pairs if total_pairs > 0 else 0
+        n_wanted = total_pairs if mean_bases == 0 else min(total_pairs, int(np.ceil(target_bases / mean_bases)))
+        rng = np.random.default_rng(seed)
+        wanted = np.zeros(total_pairs, dtype=bool)
+        wanted[rng.choice(total_pairs, size=n_wanted, replace=False)] = True
+
+    with _open_out(out1) as f1, _open_out(out2) as f2:
+        for i, (record1, record2) in enumerate(_read_pairs(reads1, reads2)):
+            if wanted is None:
+                if bases >= target_bases:
+                    break
+            elif not wanted[i]:
+                continue
+            f1.writelines(record1)
+            f2.writelines(record2)
+            pairs += 1
+            bases += _pair_bases(record1, record2)
+
+    info = {
+        'method': method,
+        'target_depth': depth,
+        'genome_size': genome_size,
+        'pairs': pairs,
+        'bases': bases,
+        'depth': round(bases / genome_size, 3),
+    }
+    if method == 'random':
+        info['seed'] = seed
+    logging.info(f'Subsampled reads {reads1} {reads2} to depth {info["depth"]} ({pairs} pairs)')
+    return info
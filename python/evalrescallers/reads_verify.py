@@ -0,0 +1,151 @@
+import concurrent.futures
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import zlib
+
+chunk_size = 1_048_576
+manifest_filename = 'manifest.json'
+md5_filename = 'reads.md5'
+ena_md5_filename = 'ena.md5'
+
+
+def verify_fastq_gz(filename):
+    '''Reads a gzipped FASTQ file once, checking the gzip CRC and length of
+    every gzip member (there can be more than one, eg when runs were
+    concatenated), and counting the FASTQ records. Returns dict with
+    bytes, md5, records and error (None if the file is OK)'''
+    result = {'bytes': 0, 'md5': None, 'records': 0, 'error': None}
+    md5 = hashlib.md5()
+    lines = 0
+    first_byte = None
+    last_byte = None
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    # True when part of a gzip member has been read, but not its end
+    in_member = False
+
+    try:
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                md5.update(chunk)
+                result['bytes'] += len(chunk)
+                while len(chunk) > 0:
+                    in_member = True
+                    data = decompressor.decompress(chunk)
+                    if len(data) > 0:
+                        lines += data.count(b'\n')
+                        if first_byte is None:
+                            first_byte = data[:1]
+                        last_byte = data[-1:]
+                    if decompressor.eof:
+                        # Start of the next gzip member, if there is one
+                        in_member = False
+                        chunk = decompressor.unused_data
+                        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                    else:
+                        chunk = b''
+    except OSError as error:
+        result['error'] = f'Error reading file: {error}'
+        return result
+    except zlib.error as error:
+        result['error'] = f'Bad gzip data (corrupt or wrong CRC): {error}'
+        return result
+    finally:
+        result['md5'] = md5.hexdigest()
+
+    if in_member:
+        result['error'] = 'Truncated gzip data'
+    elif result['bytes'] == 0:
+        result['error'] = 'Empty file'
+    elif first_byte != b'@':
+        result['error'] = 'Not a FASTQ file: does not start with "@"'
+    else:
+        if last_byte != b'\n':
+            lines += 1
+        if lines % 4 != 0:
+            result['error'] = f'Number of lines ({lines}) is not a multiple of 4'
+        result['records'] = lines // 4
+
+    return result
+
+
+def load_md5_file(filename):
+    '''Returns dict of filename -> md5 from a file in the format
+    made by md5sum (and ten_k_reads_download)'''
+    md5s = {}
+    with open(filename) as f:
+        for line in f:
+            md5, name = line.rstrip().split(maxsplit=1)
+            md5s[name] = md5
+    return md5s
+
+
+def verify_sample(sample_dir, expected_md5s=None):
+    '''Checks the files reads_1.fastq.gz and reads_2.fastq.gz in sample_dir
+    (see verify_fastq_gz), and that they have the same number of records.
+    MD5 sums are checked against expected_md5s (dict of filename -> md5), or
+    if not given then against the file reads.md5 if it exists. Those MD5 sums
+    were made locally while downloading, so they only show that the files have
+    not changed since. The MD5 sums of the files of each run that were checked
+    against the ENA while downloading are in ena.md5 (the reads files are the
+    runs stuck together, so cannot be checked against the ENA directly).
+    These are put in the manifest, as ena_md5s. Writes the
+    results to manifest.json in sample_dir, and returns them'''
+    filenames = ['reads_1.fastq.gz', 'reads_2.fastq.gz']
+    md5_file = os.path.join(sample_dir, md5_filename)
+    if expected_md5s is None and os.path.exists(md5_file):
+        expected_md5s = load_md5_file(md5_file)
+    ena_md5_file = os.path.join(sample_dir, ena_md5_filename)
+    ena_md5s = load_md5_file(ena_md5_file) if os.path.exists(ena_md5_file) else {}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        results = list(executor.map(verify_fastq_gz, [os.path.join(sample_dir, x) for x in filenames]))
+
+    manifest = {'files': dict(zip(filenames, results)), 'ena_md5s': ena_md5s, 'errors': []}
+    for filename, result in manifest['files'].items():
+        if result['error'] is not None:
+            manifest['errors'].append(f'{filename}: {result["error"]}')
+        if expected_md5s is not None and filename in expected_md5s:
+            result['expected_md5'] = expected_md5s[filename]
+            if result['md5'] != expected_md5s[filename]:
+                manifest['errors'].append(f'{filename}: MD5 mismatch. Expected {expected_md5s[filename]}, got {result["md5"]}')
+
+    records = [x['records'] for x in results]
+    if records[0] != records[1]:
+        manifest['errors'].append(f'Different number of records in reads files: {records[0]} and {records[1]}')
+
+    manifest['ok'] = len(manifest['errors']) == 0
+    with open(os.path.join(sample_dir, manifest_filename), 'w') as f:
+        json.dump(manifest, f, sort_keys=True, indent=4)
+    return manifest
+
+
+def _verify_one_sample(sample_dir):
+    return sample_dir, verify_sample(sample_dir)
+
+
+def verify_download_dir(download_dir, outfile, threads=1):
+    '''Verifies every downloaded sample in a directory made by
+    ten_k_reads_download.get_samples, and writes a TSV summary to outfile.
+    Returns the number of samples that failed'''
+    sample_dirs = sorted(os.path.dirname(x) for x in glob.glob(os.path.join(download_dir, '*', '*', 'reads_1.fastq.gz')))
+    fails = 0
+
+    with multiprocessing.Pool(processes=threads) as pool, open(outfile, 'w') as f:
+        print('sample', 'ok', 'records_1', 'records_2', 'md5_1', 'md5_2', 'errors', sep='\t', file=f)
+        for sample_dir, manifest in pool.imap(_verify_one_sample, sample_dirs):
+            results = [manifest['files'][x] for x in ('reads_1.fastq.gz', 'reads_2.fastq.gz')]
+            if not manifest['ok']:
+                fails += 1
+            print(os.path.basename(sample_dir),
+                int(manifest['ok']),
+                results[0]['records'],
+                results[1]['records'],
+                results[0]['md5'],
+                results[1]['md5'],
+                '.' if manifest['ok'] else ';'.join(manifest['errors']),
+                sep='\t', file=f)
+
+    return fails
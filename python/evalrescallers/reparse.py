@@ -0,0 +1,135 @@
+import json
+import logging
+import multiprocessing
+import os
+
+from evalrescallers import caller_adapters, json_io, pipeline_output_dir, run_res_callers, variant_parsers
+
+
+def _normalise_calls(resistance_calls):
+    # Calls are tuples when made by the parsers, but lists when loaded
+    # from JSON. Convert to how they look after a round trip through JSON
+    return json.loads(json.dumps(resistance_calls, sort_keys=True))
+
+
+def diff_resistance_calls(old_calls, new_calls):
+    '''Returns dict of drug -> {'removed': [...], 'added': [...]}, for each
+    drug where the calls are different. Both inputs are dicts of
+    drug -> list of calls'''
+    old_calls = _normalise_calls(old_calls)
+    new_calls = _normalise_calls(new_calls)
+    diffs = {}
+
+    for drug in sorted(set(old_calls) | set(new_calls)):
+        old = old_calls.get(drug, [])
+        new = new_calls.get(drug, [])
+        removed = [x for x in old if x not in new]
+        added = [x for x in new if x not in old]
+        if len(removed) > 0 or len(added) > 0:
+            diffs[drug] = {'removed': removed, 'added': added}
+
+    return diffs
+
+
+def reparse_caller_dir(caller_name, caller_dir, dry_run=False, failures=None):
+    '''Makes the resistance calls again from the output of a caller that was
+    already run in caller_dir, and writes them in its summary.json, keeping
+    everything else in that file (time_and_memory etc). For MTBseq, if the
+    Called/ directory was kept then the calls are made from its .tab files
+    (and out.json is remade), instead of from out.json.
+    If dry_run is True, no files are changed. Variant strings that could not
+    be parsed are added to the list failures (see caller_adapters.CallerAdapter.parse_output).
+    Returns tuple (status, new resistance calls, diffs), where status is one of
+    "changed", "unchanged", "no_output" (nothing to reparse), or "error"'''
+    summary_json = os.path.join(caller_dir, 'summary.json')
+    json_results_file = os.path.join(caller_dir, 'out.json')
+    if not os.path.exists(summary_json):
+        return 'no_output', None, None
+
+    adapter = caller_adapters.get_adapter(caller_name)
+    remake_out_json = caller_name == 'MTBseq' and os.path.exists(os.path.join(caller_dir, 'Called'))
+
+    try:
+        if remake_out_json:
+            res_calls = adapter.parse_json(_normalise_calls(caller_adapters.mtbseq_outdir_to_res_calls(caller_dir)), json_results_file, failures=failures)
+        elif os.path.exists(json_results_file):
+            res_calls = adapter.parse_output(json_results_file, failures=failures)
+        else:
+            return 'no_output', None, None
+
+        summary_data = json_io.load(summary_json)
+    except Exception as error:
+        logging.warning(f'Error reparsing {caller_name} output in {caller_dir}: {error}')
+        return 'error', None, str(error)
+
+    diffs = diff_resistance_calls(summary_data.get('resistance_calls', {}), res_calls)
+    if len(diffs) == 0:
+        return 'unchanged', res_calls, diffs
+
+    if not dry_run:
+        if remake_out_json:
+            caller_adapters.mtbseq_outdir_to_res_calls_json_file(caller_dir, json_results_file)
+        summary_data['resistance_calls'] = res_calls
+        json_io.write(summary_data, summary_json)
+
+    return 'changed', res_calls, diffs
+
+
+def reparse_sample(data_tuple):
+    '''data_tuple = (sample name, sample directory, dict of caller outdir_name
+    -> caller name, dry_run). Reparses each caller (see reparse_caller_dir),
+    and updates the resistance calls in the summary.json of the sample.
+    Returns tuple (sample name, list of (outdir_name, status, diffs),
+    list of variant_parsers.ParseFailure)'''
+    sample, sample_dir, outdir_names, dry_run = data_tuple
+    results = []
+    new_calls = {}
+    failures = []
+
+    for outdir_name, caller_name in sorted(outdir_names.items()):
+        status, res_calls, diffs = reparse_caller_dir(caller_name, os.path.join(sample_dir, outdir_name), dry_run=dry_run, failures=failures)
+        results.append((outdir_name, status, diffs))
+        if status == 'changed':
+            new_calls[outdir_name] = res_calls
+
+    sample_summary_json = os.path.join(sample_dir, 'summary.json')
+    if len(new_calls) > 0 and not dry_run and os.path.exists(sample_summary_json):
+        summary_data = json_io.load(sample_summary_json)
+        for outdir_name, res_calls in new_calls.items():
+            if summary_data.get(outdir_name, {}).get('Success', False):
+                summary_data[outdir_name]['resistance_calls'] = res_calls
+        json_io.write(summary_data, sample_summary_json)
+
+    return sample, results, failures
+
+
+def reparse_pipeline_dir(pipeline_dir, callers_file, outfile, threads=1, dry_run=False):
+    '''Reparses the output of every caller in the callers file, for every
+    sample in pipeline_dir (made by setup_pipeline_outdir), without running
+    any of the tools. Writes a TSV file of the caller runs that changed (or
+    failed to be reparsed), with the calls removed and added for each drug.
+    Variant strings that could not be parsed are counted and logged at the end.
+    Returns dict of status -> number of caller runs.
+    The summary of all samples is not remade: run make_summary_json
+    afterwards to do that'''
+    pipe_dir = pipeline_output_dir.PipelineOutputDir(pipeline_dir)
+    outdir_names = {x.outdir_name: x.name for x in run_res_callers.load_callers_file(callers_file)}
+    reparse_args = [(sample, os.path.join(pipe_dir.output_dir, d['dir']), outdir_names, dry_run) for sample, d in sorted(pipe_dir.data['samples'].items())]
+    counts = {x: 0 for x in ('changed', 'unchanged', 'no_output', 'error')}
+    failures = []
+
+    with multiprocessing.Pool(processes=threads) as pool, open(outfile, 'w') as f:
+        print('sample', 'caller', 'status', 'drug', 'removed', 'added', sep='\t', file=f)
+        for sample, results, sample_failures in pool.imap(reparse_sample, reparse_args, chunksize=16):
+            failures.extend(sample_failures)
+            for outdir_name, status, diffs in results:
+                counts[status] += 1
+                if status == 'error':
+                    print(sample, outdir_name, status, '.', '.', diffs, sep='\t', file=f)
+                elif status == 'changed':
+                    for drug, drug_diffs in diffs.items():
+                        print(sample, outdir_name, status, drug, json.dumps(drug_diffs['removed']), json.dumps(drug_diffs['added']), sep='\t', file=f)
+
+    logging.info(f'Reparsed caller output. Number of caller runs by status: {counts}')
+    variant_parsers.report_failures(failures, pipe_dir.output_dir)
+    return counts
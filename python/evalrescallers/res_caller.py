@@ -1,310 +1,54 @@
-import csv
-import json
 import logging
 import os
-import re
 import shutil
 import subprocess
 import sys
-import time
+import tempfile
+
+from evalrescallers import caller_adapters, json_io, resource_profiler, result_cache, variant_parsers
 
 logging.basicConfig(level=logging.INFO)
-allowed_callers = {'ARIBA', 'KvarQ', 'MTBseq', 'Mykrobe', 'TB-Profiler'}
-tb_profiler_change_regex = re.compile(r'''^(?P<position>-?\d*)(?P<sequence>[A-Z\*]+)$''')
-kvarq_var_with_square_brackets_regex = re.compile(r'''^resistance.*\[.*=(?P<gene>.*)\.(?P<variant>[A-Z0-9]+)\]$''')
+# Files moved to the output directory when a caller is run in scratch space
+files_kept_from_scratch = ['out.json', 'command.out', 'summary.json', 'resource_profile.npz']
 
 class ResCaller:
     def __init__(self, caller, outdir):
-        assert caller in allowed_callers
+        self.adapter = caller_adapters.get_adapter(caller)
         self.caller = caller
         self.outdir = os.path.abspath(outdir)
         self.json_results_file = os.path.join(self.outdir, 'out.json')
         self.summary_output_json = os.path.join(self.outdir, 'summary.json')
         self.command_stdouterr_file = os.path.join(self.outdir, 'command.out')
+        self.resource_profile_file = os.path.join(self.outdir, 'resource_profile.npz')
 
 
-    def _clean_run_dir(self, skip=False):
-        if self.caller == 'ARIBA':
-            json_old = os.path.join(self.outdir, 'ariba.out', 'tb.resistance.json')
-            os.rename(json_old, self.json_results_file)
-        elif self.caller == 'KvarQ' or skip:
-            pass
-        elif self.caller == 'MTBseq':
-            to_delete = ['Amend', 'Bam', 'Classification', 'GATK_Bam', 'Groups', 'Joint', 'Mpileup', 'Position_Tables', 'Statistics']
-            for directory in to_delete:
-                try:
-                    shutil.rmtree(os.path.join(self.outdir, directory))
-                except:
-                    pass
-        elif self.caller == 'Mykrobe':
-            shutil.rmtree(os.path.join(self.outdir, 'tmp'))
-            shutil.rmtree(os.path.join(self.outdir, 'mykrobe'))
-        elif self.caller == 'TB-Profiler':
-            json_old = os.path.join(self.outdir, 'results', 'out.results.json')
-            os.rename(json_old, self.json_results_file)
-            shutil.rmtree(os.path.join(self.outdir, 'bam'))
-            shutil.rmtree(os.path.join(self.outdir, 'results'))
-            shutil.rmtree(os.path.join(self.outdir, 'vcf'))
-        else:
-            raise Exception('Caller "' + self.caller + '" not recognised. Must be one of: ' + str(allowed_callers))
+    def _clean_run_dir(self):
+        self.adapter.clean_run_dir(self.outdir)
 
 
     @classmethod
     def _mtbseq_tab_file_to_res_calls(cls, tab_file):
-        res_calls = {}
-
-        with open(tab_file) as f:
-            file_reader = csv.DictReader(f, delimiter='\t')
-            for d in file_reader:
-                if d['ResistanceSNP'] is not None and len(d['ResistanceSNP'].strip()) > 0:
-                    # Lines look like eg:
-                    # fluoroquinolones (FQ)
-                    drug = d['ResistanceSNP'].split()[0].capitalize()
-                    if drug == 'Fluoroquinolones':
-                        drug = 'Quinolones'
-                    gene = d['Gene'] if d['GeneName'] == '-' else d['GeneName']
-                    # in the "uncovered" file, the Subst has a space.
-                    # In the "variant" file, it has things like: Met306Ile (atg/atC)
-                    if d['Subst'] == ' ':
-                        variant = None
-                    else:
-                        variant = d['Subst'].split()[0]
-                    if drug not in res_calls:
-                        res_calls[drug] = set()
-                    res_calls[drug].add(('R', gene, variant, None))
-
-        return res_calls
+        return caller_adapters.mtbseq_tab_file_to_res_calls(tab_file)
 
 
     @classmethod
     def _mtbseq_outdir_to_res_calls_json_file(cls, mtbseq_dir, json_out):
-        # The two files we want are in the Called/ directory.
-        # They have names like this:
-        #   sampleID_libID.gatk_position_uncovered_cf4_cr4_fr75_ph4_outmode000.tab
-        #   sampleID_libID.gatk_position_variants_cf4_cr4_fr75_ph4_outmode000.tab
-        # so first need to find those files
-        called_dir = os.path.join(mtbseq_dir, 'Called')
-        if not os.path.exists(called_dir):
-            raise FileNotFoundError(f'MTBseq "Called" directory not found. Looked for: {called_dir}')
-
-        tab_files = [x for x in os.listdir(called_dir) if x.endswith('.tab')]
-        variants_file = None
-        uncovered_file = None
-        for filename in os.listdir(called_dir):
-            if not filename.endswith('.tab'):
-                continue
-
-            if '_uncovered_' in filename:
-                uncovered_file = os.path.join(called_dir, filename)
-            elif '_variants_' in filename:
-                variants_file = os.path.join(called_dir, filename)
-
-        if variants_file is None:
-            raise FileNotFoundError(f'MTBseq variants file not found in dir {called_dir}')
-
-        res_calls = ResCaller._mtbseq_tab_file_to_res_calls(variants_file)
-        if uncovered_file is not None:
-            new_res_calls = ResCaller._mtbseq_tab_file_to_res_calls(uncovered_file)
-            for drug, call_list in new_res_calls.items():
-                if drug not in res_calls:
-                    res_calls[drug] = set()
-                res_calls[drug].update(call_list)
-
-        for drug in res_calls:
-            res_calls[drug] = sorted(list(res_calls[drug]))
-
-        with open(json_out, 'w') as f:
-            json.dump(res_calls, f, sort_keys=True, indent=4)
+        caller_adapters.mtbseq_outdir_to_res_calls_json_file(mtbseq_dir, json_out)
 
 
     @classmethod
     def _kvarq_var_string_parser(cls, var_string):
-        if var_string.startswith('remark'):
-            return None, None, None
-        elif 'resistance' not in var_string:
-            raise Exception(f'Cannot parse line of KvarQ output: {var_string}')
-
-        drug, the_rest = var_string.split(maxsplit=1)
-
-        if '::' in the_rest:
-            # looks like one of these:
-            #   Isoniazid resistance::SNP1673425CT=inhA promoter mutation -15'
-            #   Ethambutol resistance::SNP4247431GC=embB.M306I
-            if '=' in the_rest:
-                gene_and_mutation = the_rest.split(':')[-1].split('=')[-1]
-                if '.' in gene_and_mutation:
-                    gene, mutation = gene_and_mutation.split('.')
-                else:
-                    gene, mutation = gene_and_mutation.split(None, maxsplit=1)
-                return drug, gene, mutation
-        else:
-            # looks like:
-            #   Isoniazid resistance [2155168CG=katG.S315T]
-            #   Rifampicin resistance (RRDR) [761155CT=rpoB.S450L]
-            match = kvarq_var_with_square_brackets_regex.search(the_rest)
-
-            if match is not None:
-                return drug, match.group('gene'), match.group('variant')
-
-        logging.warning(f'Got drug as "{drug}" but could not get variant from TB-Profiler string: {var_string}')
-        return drug, 'Parse_error', 'Parse_error'
+        return variant_parsers.kvarq_var_string_parser(var_string)
 
 
     @classmethod
     def _tb_profiler_var_string_parser(cls, var_string):
-        if '>' not in var_string:
-            raise Exception(f'Expected ">" in variant string from TB-Profiler, but got "{var_string}"')
-
-        change_before, change_after = var_string.split('>')
-        match_before = tb_profiler_change_regex.search(change_before)
-        match_after = tb_profiler_change_regex.search(change_after)
-
-        if match_before is None or match_after is None:
-            raise Exception(f'Error using regex on variant string "{var_string}" from TB-Profiler')
-
-        if len(match_before.group('position')) == 0:
-            raise Exception(f'Could not get position of variant from "{var_string}" from TB-Profiler')
-
-        if len(match_after.group('position')) > 0 and match_before.group('position') != match_after.group('position'):
-            raise Exception(f'Positions not the same in variant string "{var_string}" from TB-Profiler')
-
-        return match_before.group('sequence') + match_before.group('position') + match_after.group('sequence')
+        return variant_parsers.tb_profiler_var_string_parser(var_string)
 
 
     @classmethod
     def _json_to_resistance_calls(cls, json_in, caller):
-        with open(json_in) as f:
-            json_data = json.load(f)
-
-        resistance_calls = {}
-        quinolones = {'Ciprofloxacin', 'Moxifloxacin', 'Ofloxacin'}
-
-        if caller == 'ARIBA':
-            quinolone_calls = set()
-
-            for drug in json_data:
-                resistance_calls[drug] = []
-                for t in json_data[drug]:
-                    to_append = ('R', t[0], t[1], None)
-                    resistance_calls[drug].append(to_append)
-                    if drug in quinolones:
-                        quinolone_calls.add(to_append)
-
-            if len(quinolone_calls) > 0:
-                resistance_calls['Quinolones'] = sorted(list(quinolone_calls))
-        elif caller == 'KvarQ':
-            try:
-                res_list = json_data['analyses']['MTBC/resistance']
-            except:
-                raise Exception(f'Could not find analysis -> MTBC/resistance in JSON file "{os.path.abspath(json_in)}". Cannot continue')
-
-            for res_line in res_list:
-                drug, gene, change = ResCaller._kvarq_var_string_parser(res_line)
-                if drug is None:
-                    continue
-
-                if drug == 'Fluoroquinolones':
-                    drug = 'Quinolones'
-
-                if drug == 'Kanamycin/Amikacin':
-                    drugs = drug.split('/')
-                else:
-                    drugs = [drug]
-
-                for d in drugs:
-                    if d not in resistance_calls:
-                        resistance_calls[d] = []
-
-                    resistance_calls[d].append(('R', gene, change, None))
-        elif caller == 'MTBseq':
-            resistance_calls = json_data
-        elif caller == 'Mykrobe':
-            sample_names = list(json_data.keys())
-            if len(sample_names) != 1:
-                raise Exception(f'Expected one key in json file "{os.path.abspath(json_in)}" but got: {sample_names}')
-
-            sample_name = sample_names[0]
-
-            try:
-                suscept_data = json_data[sample_name]['susceptibility']
-            except:
-                raise Exception(f'Error getting susceptibility from file "{os.path.abspath(json_in)}"')
-
-            for drug in suscept_data:
-                if drug not in resistance_calls:
-                    resistance_calls[drug] = []
-
-                if drug in quinolones:
-                    if 'Quinolones' not in resistance_calls:
-                        resistance_calls['Quinolones'] = []
-
-                if suscept_data[drug]['predict'] in {'r', 'R'}:
-
-                    for variant in suscept_data[drug]['called_by']:
-                        # Presence of a gene just has the gene name.
-                        # Variant calls have an underscore
-                        if '_' in variant:
-                            gene, change = variant.split('_')
-                            # Most vars look like this: embB_Q497R-Q497R. But not all.
-                            # Have also seen this: fabG1_C-15X-C. Try spltting on "-" to get
-                            # two things, but if that doesn't wok then keep everything
-                            changes = change.split('-')
-                            if len(changes) == 2:
-                                if changes[0] != changes[1]:
-                                    raise Exception(f'Unexpected format in "called_by" key: {variant}')
-                                this_change = changes[0]
-                            else:
-                                this_change = change
-                        else:
-                            gene = variant
-                            this_change = 'NA'
-                        try:
-                            conf = int(suscept_data[drug]['called_by'][variant]['info']['conf'])
-                        except:
-                            conf = None
-
-                        try:
-                            ref_depth = int(suscept_data[drug]['called_by'][variant]['info']['coverage']['reference']['median_depth'])
-                        except:
-                            ref_depth = None
-
-                        try:
-                            alt_depth = int(suscept_data[drug]['called_by'][variant]['info']['coverage']['alternate']['median_depth'])
-                        except:
-                            alt_depth = None
-
-                        try:
-                            expected_depths = suscept_data[drug]['called_by'][variant]['info']['expected_depths']
-                            expected_depth = round(sum(expected_depths) / len(expected_depths))
-                        except:
-                            expected_depth = None
-
-                        to_append = (suscept_data[drug]['predict'], gene, this_change, {'conf': conf, 'ref_depth': ref_depth, 'alt_depth': alt_depth, 'expected_depth': expected_depth})
-                        resistance_calls[drug].append(to_append)
-                        if drug in quinolones:
-                            resistance_calls['Quinolones'].append(to_append)
-
-                else:
-                    to_append = (suscept_data[drug]['predict'], None, None, {})
-                    resistance_calls[drug].append(to_append)
-                    if drug in quinolones:
-                        resistance_calls['Quinolones'].append(to_append)
-        elif caller == 'TB-Profiler':
-            if 'small_variants_dr' not in json_data:
-                raise Exception(f'Expected one key in json file "{os.path.abspath(json_in)}" but got: {sample_names}')
-
-            for data in json_data['small_variants_dr']:
-                drug = data['drug'].capitalize()
-                if drug == 'Fluoroquinolones':
-                    drug = 'Quinolones'
-                change = ResCaller._tb_profiler_var_string_parser(data['change'])
-                if drug not in resistance_calls:
-                    resistance_calls[drug] = []
-                resistance_calls[drug].append(('R', data['gene'], change, None))
-        else:
-            raise Exception('Caller "' + caller + '" not recognised. Must be one of: ' + str(allowed_callers))
-
-        return resistance_calls
+        return caller_adapters.get_adapter(caller).parse_output(json_in)
 
 
     @classmethod
@@ -335,7 +79,64 @@ class ResCaller:
         return stats
 
 
-    def run(self, reads1, reads2, mykrobe_species=None, mykrobe_panel=None, mykrobe_custom_probe_file=None, mykrobe_custom_var_to_res=None, debug=False, fake_for_fast_test=False, command_line_opts=None, ariba_ref=None):
+    def run(self, reads1, reads2, mykrobe_species=None, mykrobe_panel=None, mykrobe_custom_probe_file=None, mykrobe_custom_var_to_res=None, debug=False, fake_for_fast_test=False, command_line_opts=None, ariba_ref=None, profile_interval=1.0, result_cache_dir=None, scratch_dir=None, threads=1):
+        '''Runs the caller using threads CPUs, writing summary.json in the
+        output directory. If result_cache_dir is given (default is from the environment variable
+        EVALRESCALLERS_RESULT_CACHE_DIR, see result_cache), a run with the
+        same reads, tool version, panel and options is taken from the cache
+        instead of running the tool, and new results are added to the cache.
+        The raw output (out.json) is cached too, so that runs taken from the
+        cache can be reparsed. Nothing is cached when testing or debugging.
+
+        If scratch_dir is given (default is from the environment variable
+        EVALRESCALLERS_SCRATCH_DIR), the tool is run in a new directory inside
+        scratch_dir (eg on a node-local disk), and only the files in
+        files_kept_from_scratch are moved to the output directory. The scratch
+        directory is deleted afterwards, even if the caller fails, unless
+        debug is True'''
+        run_options = {
+            'mykrobe_species': mykrobe_species,
+            'mykrobe_panel': mykrobe_panel,
+            'mykrobe_custom_probe_file': mykrobe_custom_probe_file,
+            'mykrobe_custom_var_to_res': mykrobe_custom_var_to_res,
+            'debug': debug,
+            'fake_for_fast_test': fake_for_fast_test,
+            'command_line_opts': command_line_opts,
+            'ariba_ref': ariba_ref,
+            'profile_interval': profile_interval,
+            'result_cache_dir': result_cache_dir,
+            'threads': threads,
+        }
+        if scratch_dir is None:
+            scratch_dir = os.environ.get('EVALRESCALLERS_SCRATCH_DIR')
+        if scratch_dir is None or scratch_dir == '':
+            self._run_in_dir(reads1, reads2, **run_options)
+            return
+
+        try:
+            os.mkdir(self.outdir)
+        except:
+            raise Exception(f'Error mkdir {self.outdir!r}. Cannot continue')
+
+        os.makedirs(scratch_dir, exist_ok=True)
+        scratch_root = tempfile.mkdtemp(prefix=f'evalrescallers.{self.caller}.', dir=scratch_dir)
+        scratch_caller = ResCaller(self.caller, os.path.join(scratch_root, 'run'))
+        logging.info(f'Running caller {self.caller} in scratch directory {scratch_caller.outdir!r}')
+        try:
+            scratch_caller._run_in_dir(reads1, reads2, **run_options)
+        finally:
+            # Keep command.out even if the caller failed, to help debugging
+            for filename in files_kept_from_scratch:
+                scratch_file = os.path.join(scratch_caller.outdir, filename)
+                if os.path.exists(scratch_file):
+                    shutil.move(scratch_file, os.path.join(self.outdir, filename))
+            if debug:
+                logging.info(f'Debug mode, so not deleting scratch directory {scratch_root!r}')
+            else:
+                shutil.rmtree(scratch_root, ignore_errors=True)
+
+
+    def _run_in_dir(self, reads1, reads2, mykrobe_species=None, mykrobe_panel=None, mykrobe_custom_probe_file=None, mykrobe_custom_var_to_res=None, debug=False, fake_for_fast_test=False, command_line_opts=None, ariba_ref=None, profile_interval=1.0, result_cache_dir=None, threads=1):
         if command_line_opts is None:
             command_line_opts = ''
 
@@ -352,98 +153,85 @@ class ResCaller:
         except:
             raise Exception(f'Error mkdir {self.outdir!r}. Cannot continue')
 
+        if result_cache_dir is None:
+            result_cache_dir = result_cache.cache_dir()
+        cache_key = None
+        if result_cache_dir is not None and not (fake_for_fast_test or debug):
+            cache_key = result_cache.cache_key(self.caller, reads1, reads2,
+                mykrobe_species=mykrobe_species,
+                mykrobe_panel=mykrobe_panel,
+                mykrobe_custom_probe_file=mykrobe_custom_probe_file,
+                mykrobe_custom_var_to_res=mykrobe_custom_var_to_res,
+                command_line_opts=command_line_opts,
+                ariba_ref=ariba_ref,
+            )
+            summary_data = None if cache_key is None else result_cache.get(result_cache_dir, cache_key, raw_output_file=self.json_results_file)
+            if summary_data is not None:
+                logging.info(f'Using result from cache for caller {self.caller} (key {cache_key})')
+                summary_data['from_result_cache'] = True
+                json_io.write(summary_data, self.summary_output_json)
+                return
+
         original_dir = os.getcwd()
         os.chdir(self.outdir)
         logging.info(f'Output directory {self.outdir!r} set up for caller {self.caller}')
 
-        if self.caller == 'ARIBA':
-            if ariba_ref is None or not os.path.exists(ariba_ref):
-                raise Exception(f'ARIBA ariba_ref not found: {ariba_ref}')
-            command = [f'ariba run {command_line_opts} --verbose {ariba_ref} {reads1} {reads2} ariba.out']
-        elif self.caller == 'KvarQ':
-            command = [f'kvarq scan {command_line_opts} -l MTBC -t 1 -p {reads1} {self.json_results_file}']
-        elif self.caller == 'MTBseq':
-            # MTBseq uses /tmp/ when sorting BAM files. This means
-            # we need a unique sample and/or library name, otherwise the
-            # filenames in /tmp/ are not guaranteed to be unique. See
-            # https://github.com/ngs-fzb/MTBseq_source/issues/22
-            # Use the PID, plus the current time for extra paranoia
-            sample = f'{os.getppid()}.{time.time()}'
-
-            # Needs reads named in a specific way in the directory
-            # where it is run. Make symlinks with the correct name
-            link1 = f'{sample}_libID_R1.fastq.gz'
-            link2 = f'{sample}_libID_R2.fastq.gz'
-            try:
-                os.symlink(reads1, link1)
-                os.symlink(reads2, link2)
-            except:
-                raise Exception(f'Error making symlinks to reads files reads1 reads2')
-
-            reads1 = os.path.abspath(link1)
-            reads2 = os.path.abspath(link2)
-            command = [f'MTBseq --step TBfull']
-        elif self.caller == 'Mykrobe':
-            assert mykrobe_species in ['tb', 'staph']
-            command = [f'mykrobe predict sample {mykrobe_species} {command_line_opts}']
-
-            if mykrobe_custom_probe_file is not None or mykrobe_custom_var_to_res is not None:
-                assert None not in {mykrobe_custom_probe_file, mykrobe_custom_var_to_res}
-                mykrobe_panel = 'custom'
-                command.append(f'--panel custom --custom_probe_set_path {mykrobe_custom_probe_file} --custom_variant_to_resistance_json {mykrobe_custom_var_to_res}')
-            elif mykrobe_species == 'tb':
-                assert mykrobe_panel is not None
-                command.append(f'--panel {mykrobe_panel}')
-
-            command.append(f'--seq {reads1} {reads2} --output {self.json_results_file}')
-        elif self.caller == 'TB-Profiler':
-            command = [f'tb-profiler profile {command_line_opts} -1 {reads1} -2 {reads2} -p out']
-        else:
-            raise Exception('Caller "' + self.caller + '" not recognised. Must be one of: ' + str(allowed_callers))
+        options = {
+            'mykrobe_species': mykrobe_species,
+            'mykrobe_panel': mykrobe_panel,
+            'mykrobe_custom_probe_file': mykrobe_custom_probe_file,
+            'mykrobe_custom_var_to_res': mykrobe_custom_var_to_res,
+            'ariba_ref': ariba_ref,
+        }
+        command = self.adapter.build_command(self.outdir, reads1, reads2, self.json_results_file, command_line_opts, threads=threads, **options)
 
         if fake_for_fast_test:
             if self.caller == 'Mykrobe' and mykrobe_panel == 'Fail':
                 raise Exception('Deliberately failing test run')
 
             command = f'/usr/bin/time -v sleep 1s &> {self.command_stdouterr_file}'
-            res_call_dict = {
-                'KvarQ': {'Ethambutol': [('R', 'embB', 'M306I', None)]},
-                'MTBseq': {'Ethambutol': [('R', 'embB', 'M306L', None)]},
-                'Mykrobe': {'Ethambutol': [('r', 'embB', 'M306J', 42)]},
-                'TB-Profiler': {'Ethambutol': [('R', 'embB', 'M306K', None)]},
-            }
-            resistance_calls = res_call_dict[self.caller]
+            resistance_calls = self.adapter.fake_resistance_calls
         else:
             # Want to redirect stderr and stdout to the output file.
             # Specify bash shell with "executable='/bin/bash'" in the
             # subprocess.run call, so the '&>' works.
-            command = '/usr/bin/time -v ' + ' '.join(command) + ' &> ' + self.command_stdouterr_file
+            command = f'/usr/bin/time -v {command} &> {self.command_stdouterr_file}'
 
 
         logging.info(f'Running command: {command}')
-        completed_process = subprocess.run(command, stderr=subprocess.STDOUT, stdout=subprocess.PIPE, shell=True, executable='/bin/bash')
+        process = subprocess.Popen(command, stderr=subprocess.STDOUT, stdout=subprocess.PIPE, shell=True, executable='/bin/bash')
+        # Sample the memory, CPU etc of the command and all its child
+        # processes, as well as getting the overall stats from /usr/bin/time
+        profiler = None
+        if profile_interval:
+            profiler = resource_profiler.ProcessTreeProfiler(process.pid, interval=profile_interval)
+            profiler.start()
+        stdout, _ = process.communicate()
+        if profiler is not None:
+            profiler.stop()
         os.chdir(original_dir)
 
-        # MTBseq currently makes the files we need to get the resistance
-        # calls, but crashes before the end of the whole pipeline. So we
-        # don't expect return code of zero. Counts as success if we can
-        # get the resistance calls from the files
-        if self.caller == 'MTBseq' and not fake_for_fast_test:
+        if fake_for_fast_test:
+            if process.returncode != 0:
+                raise Exception(f'Error running command: {command}\nError code:{process.returncode}\nOutput was:\n{stdout}')
+        else:
             try:
-                ResCaller._mtbseq_outdir_to_res_calls_json_file(self.outdir, self.json_results_file)
+                self.adapter.check_finished(self.outdir, self.json_results_file, process.returncode)
             except:
-                raise Exception(f'Could not get resistance calls from MTBseq output dir {self.outdir}')
-        elif completed_process.returncode != 0:
-            raise Exception(f'Error running command: {command}\nError code:{completed_process.returncode}\nOutput was:\n{completed_process.stdout}')
-
-        if not debug:
-            self._clean_run_dir(skip=fake_for_fast_test)
+                logging.error(f'Error running command: {command}\nError code:{process.returncode}\nOutput was:\n{stdout}')
+                raise
+            self.adapter.collect_output(self.outdir, self.json_results_file)
+            if not debug:
+                self._clean_run_dir()
+            resistance_calls = self.adapter.parse_output(self.json_results_file)
 
-        if not fake_for_fast_test:
-            resistance_calls = ResCaller._json_to_resistance_calls(self.json_results_file, self.caller)
         time_and_memory = ResCaller._bash_out_to_time_and_memory(self.command_stdouterr_file)
+        if profiler is not None:
+            profiler.save(self.resource_profile_file)
+            time_and_memory['profile'] = profiler.summary()
         summary_data = {'resistance_calls': resistance_calls, 'time_and_memory': time_and_memory}
+        json_io.write(summary_data, self.summary_output_json)
 
-        with open(self.summary_output_json, 'w') as f:
-            json.dump(summary_data, f, sort_keys=True, indent=4)
+        if cache_key is not None:
+            result_cache.put(result_cache_dir, cache_key, summary_data, raw_output_file=self.json_results_file)
 
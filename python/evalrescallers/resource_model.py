@@ -0,0 +1,215 @@
+import json
+import logging
+import multiprocessing
+import os
+
+import numpy as np
+
+from evalrescallers import pipeline_output_dir
+
+# Hints are the fitted value plus the 95th percentile of the residuals,
+# times this factor, and never less than the minimums
+safety_factor = 1.1
+residual_quantile = 95
+min_ram_gb = 1.0
+min_wall_clock_hours = 0.1
+
+
+def reads_bytes(reads_files):
+    '''Returns total size in bytes of the reads files, or None if any
+    of them are missing'''
+    try:
+        return sum(os.path.getsize(x) for x in reads_files)
+    except OSError:
+        return None
+
+
+def caller_ram_gb(time_and_memory):
+    '''Returns peak RAM in GB from the time_and_memory dict of one caller. Uses
+    the bigger of the /usr/bin/time RAM (peak of the biggest single process)
+    and the profiler peak (peak of all processes added up)'''
+    ram_kb = [time_and_memory.get('ram'), time_and_memory.get('profile', {}).get('ram_peak')]
+    ram_kb = [x for x in ram_kb if x is not None]
+    return None if len(ram_kb) == 0 else max(ram_kb) / 1024 / 1024
+
+
+def _load_observations(data_tuple):
+    sample, json_file, reads_files = data_tuple
+    input_bytes = reads_bytes(reads_files)
+    sample, sample_data = pipeline_output_dir.load_one_sample_summary_json_file((sample, json_file))
+    observations = []
+    if sample_data is None or input_bytes is None:
+        return observations
+
+    for caller, caller_data in sample_data.items():
+        # Results taken from the result cache have the time and memory of
+        # the original run, which would be counted twice
+        if not caller_data.get('Success', False) or 'time_and_memory' not in caller_data or caller_data.get('from_result_cache', False):
+            continue
+        ram = caller_ram_gb(caller_data['time_and_memory'])
+        wall_clock = caller_data['time_and_memory'].get('wall_clock_time')
+        if ram is not None and wall_clock is not None:
+            observations.append((caller, input_bytes, ram, wall_clock / 3600))
+
+    return observations
+
+
+def observations_cache_file(pipe_dir):
+    return os.path.join(pipe_dir.output_dir, 'resource_observations.json')
+
+
+def load_observations_cache(pipe_dir):
+    '''Returns dict of sample -> {mtime_ns, size, observations} from the
+    cache file made by collect_observations(incremental=True), or an empty
+    dict if there is no cache file or it cannot be read'''
+    try:
+        with open(observations_cache_file(pipe_dir)) as f:
+            return json.load(f)['samples']
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def write_observations_cache(pipe_dir, cache):
+    cache_file = observations_cache_file(pipe_dir)
+    tmp_file = cache_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump({'samples': cache}, f, sort_keys=True)
+    os.rename(tmp_file, cache_file)
+
+
+def collect_observations(pipe_dir, threads=1, incremental=False):
+    '''Returns list of tuples (caller, reads bytes, ram GB, wall clock hours),
+    one for each successful caller run in the PipelineOutputDir pipe_dir.
+    If incremental is True, the observations of each sample are kept in a
+    cache file in the pipeline directory, and only the summary.json files
+    that changed (mtime or size) since the last run with incremental=True
+    are loaded. The cache file is only written if it changed, so nothing is
+    written for a pipeline directory with no finished samples (which may
+    not exist yet)'''
+    old_cache = load_observations_cache(pipe_dir) if incremental else {}
+    new_cache = {}
+    load_args = []
+    for sample, d in sorted(pipe_dir.data['samples'].items()):
+        json_file = os.path.join(pipe_dir.output_dir, d['dir'], 'summary.json')
+        try:
+            stat = os.stat(json_file)
+        except FileNotFoundError:
+            continue
+        old_entry = old_cache.get(sample)
+        entry = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+        if old_entry is not None and old_entry['mtime_ns'] == entry['mtime_ns'] and old_entry['size'] == entry['size']:
+            new_cache[sample] = old_entry
+        else:
+            new_cache[sample] = entry
+            load_args.append((sample, json_file, d['reads']))
+
+    if len(load_args) > 0:
+        with multiprocessing.Pool(processes=threads) as pool:
+            for (sample, _, _), sample_observations in zip(load_args, pool.imap(_load_observations, load_args, chunksize=16)):
+                new_cache[sample]['observations'] = sample_observations
+
+    if incremental:
+        logging.info(f'Loaded resource use of {len(load_args)} samples. Used cached values for {len(new_cache) - len(load_args)} samples')
+        if new_cache != old_cache:
+            write_observations_cache(pipe_dir, new_cache)
+
+    observations = []
+    for sample in sorted(new_cache):
+        observations.extend(tuple(x) for x in new_cache[sample]['observations'])
+    return observations
+
+
+def _fit_one(x, y):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if len(np.unique(x)) > 1:
+        slope, intercept = np.polyfit(x, y, 1)
+        # More input should never need less resources
+        if slope < 0:
+            slope, intercept = 0.0, float(y.mean())
+    else:
+        slope, intercept = 0.0, float(y.mean())
+    residuals = y - (intercept + slope * x)
+    margin = max(0.0, float(np.percentile(residuals, residual_quantile)))
+    return {'intercept': float(intercept), 'slope': float(slope), 'margin': margin, 'n': len(x)}
+
+
+def fit_model(observations):
+    '''Fits linear models of RAM and wall clock time against reads file size,
+    for each caller. Returns a dict that can be saved as JSON:
+    caller -> {'ram_gb': params, 'wall_clock_hours': params}'''
+    by_caller = {}
+    for caller, input_bytes, ram, wall_clock in observations:
+        by_caller.setdefault(caller, []).append((input_bytes, ram, wall_clock))
+
+    model = {}
+    for caller, values in sorted(by_caller.items()):
+        x, ram, wall_clock = zip(*values)
+        model[caller] = {
+            'ram_gb': _fit_one(x, ram),
+            'wall_clock_hours': _fit_one(x, wall_clock),
+        }
+    return model
+
+
+def _predict(params, input_bytes, minimum):
+    value = (params['intercept'] + params['slope'] * input_bytes + params['margin']) * safety_factor
+    return max(minimum, value)
+
+
+def predict(model, caller, input_bytes):
+    '''Returns tuple (RAM in GB, wall clock time in hours) that caller is
+    expected to need for reads files of total size input_bytes'''
+    return (
+        _predict(model[caller]['ram_gb'], input_bytes, min_ram_gb),
+        _predict(model[caller]['wall_clock_hours'], input_bytes, min_wall_clock_hours),
+    )
+
+
+def caller_hints(model, caller, input_bytes, ram=None):
+    '''Returns tuple (RAM in GB, wall clock time in hours) for running one
+    caller on one sample. If ram is given (eg from the callers file), it is
+    used instead of the predicted RAM. Values are None where there is no
+    prediction (model is None, or has no data for the caller)'''
+    hours = None
+    if model is not None and caller in model and input_bytes is not None:
+        predicted_ram, hours = predict(model, caller, input_bytes)
+        if ram is None:
+            ram = predicted_ram
+    return ram, hours
+
+
+def sample_hints(model, input_bytes, callers, concurrent=False):
+    '''Returns tuple (RAM in GB, wall clock time in hours) for running all
+    of the callers (list of names, ie outdir_name in the callers file) on one
+    sample. If concurrent is True, assumes the callers are run at the same time
+    (so RAM is added up and time is the longest caller), otherwise
+    assumes they are run one after the other. Returns (None, None)
+    if there is no model for any of the callers'''
+    if input_bytes is None or len(callers) == 0 or any(x not in model for x in callers):
+        return None, None
+
+    predictions = [predict(model, caller, input_bytes) for caller in callers]
+    ram = [x[0] for x in predictions]
+    wall_clock = [x[1] for x in predictions]
+    if concurrent:
+        return sum(ram), max(wall_clock)
+    else:
+        return max(ram), sum(wall_clock)
+
+
+def make_model_file(pipeline_dir, outfile, threads=1, incremental=False):
+    '''Fits model from all results in the pipeline directory,
+    and writes it to a JSON file. See collect_observations
+    for incremental'''
+    pipe_dir = pipeline_output_dir.PipelineOutputDir(pipeline_dir)
+    observations = collect_observations(pipe_dir, threads=threads, incremental=incremental)
+    model = fit_model(observations)
+    logging.info(f'Fitted resource model for {len(model)} callers using {len(observations)} caller runs')
+    with open(outfile, 'w') as f:
+        json.dump(model, f, sort_keys=True, indent=4)
+
+
+def load_model_file(infile):
+    with open(infile) as f:
+        return json.load(f)
@@ -0,0 +1,184 @@
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+proc_dir = '/proc'
+clock_ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+series_names = ['time', 'rss', 'cpu_percent', 'threads', 'read_bytes', 'write_bytes']
+
+
+def read_proc_stat(pid):
+    '''Returns dict of ppid, cpu_ticks, threads, rss (bytes) from /proc/<pid>/stat,
+    or None if the process does not exist. cpu_ticks includes the time of
+    children that have finished and been waited for'''
+    try:
+        with open(os.path.join(proc_dir, str(pid), 'stat')) as f:
+            line = f.read()
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        return None
+
+    # The command name is in brackets and can have spaces in it,
+    # so only split what comes after it. fields[0] is field 3 in "man proc"
+    fields = line[line.rindex(')') + 2:].split()
+    return {
+        'ppid': int(fields[1]),
+        'cpu_ticks': sum(int(x) for x in fields[11:15]),
+        'threads': int(fields[17]),
+        'rss': int(fields[21]) * page_size,
+    }
+
+
+def read_proc_io(pid):
+    '''Returns (read_bytes, write_bytes) from /proc/<pid>/io, or (0, 0)
+    if it can't be read'''
+    read_bytes = write_bytes = 0
+    try:
+        with open(os.path.join(proc_dir, str(pid), 'io')) as f:
+            for line in f:
+                if line.startswith('read_bytes:'):
+                    read_bytes = int(line.split()[1])
+                elif line.startswith('write_bytes:'):
+                    write_bytes = int(line.split()[1])
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        pass
+    return read_bytes, write_bytes
+
+
+def process_tree_stats(root_pid):
+    '''Returns dict of the summed rss, cpu_ticks, threads, read_bytes,
+    write_bytes of root_pid and all its descendants that are running now.
+    Returns None if root_pid is not running'''
+    stats = {}
+    for name in os.listdir(proc_dir):
+        if name.isdigit():
+            stat = read_proc_stat(name)
+            if stat is not None:
+                stats[int(name)] = stat
+
+    if root_pid not in stats:
+        return None
+
+    children = {}
+    for pid, stat in stats.items():
+        children.setdefault(stat['ppid'], []).append(pid)
+
+    totals = {'rss': 0, 'cpu_ticks': 0, 'threads': 0, 'read_bytes': 0, 'write_bytes': 0}
+    to_visit = [root_pid]
+    while len(to_visit) > 0:
+        pid = to_visit.pop()
+        for key in 'rss', 'cpu_ticks', 'threads':
+            totals[key] += stats[pid][key]
+        read_bytes, write_bytes = read_proc_io(pid)
+        totals['read_bytes'] += read_bytes
+        totals['write_bytes'] += write_bytes
+        to_visit.extend(children.get(pid, []))
+
+    return totals
+
+
+class ProcessTreeProfiler:
+    '''Samples the resources used by a process and all its descendants
+    every interval seconds, in a background thread, until stop() is
+    called. Only works on systems with /proc'''
+    def __init__(self, pid, interval=1.0):
+        self.pid = pid
+        self.interval = interval
+        self.series = {name: [] for name in series_names}
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._start_time = None
+        self._last_cpu = None
+
+
+    def start(self):
+        if not os.path.exists(os.path.join(proc_dir, str(self.pid))):
+            logging.warning(f'Cannot profile process {self.pid} because {proc_dir} not found or process not running')
+            return
+        self._start_time = time.monotonic()
+        self._thread.start()
+
+
+    def stop(self):
+        if self._thread.is_alive():
+            self._stop_event.set()
+            self._thread.join()
+
+
+    def sample(self):
+        '''Adds one sample to the time series. Returns False if the
+        process has finished, otherwise True'''
+        totals = process_tree_stats(self.pid)
+        if totals is None:
+            return False
+
+        now = time.monotonic() - self._start_time
+        if self._last_cpu is None:
+            cpu_percent = 0.0
+        else:
+            last_time, last_ticks = self._last_cpu
+            elapsed = now - last_time
+            cpu_percent = 0.0 if elapsed <= 0 else max(0.0, 100 * (totals['cpu_ticks'] - last_ticks) / clock_ticks / elapsed)
+        self._last_cpu = (now, totals['cpu_ticks'])
+
+        self.series['time'].append(now)
+        self.series['cpu_percent'].append(cpu_percent)
+        for key in 'rss', 'threads', 'read_bytes', 'write_bytes':
+            self.series[key].append(totals[key])
+        return True
+
+
+    def _run(self):
+        while self.sample() and not self._stop_event.wait(self.interval):
+            pass
+
+
+    def arrays(self):
+        '''Returns dict of name -> numpy array of the time series'''
+        return {
+            'time': np.array(self.series['time'], dtype=np.float32),
+            'rss': np.array(self.series['rss'], dtype=np.int64),
+            'cpu_percent': np.array(self.series['cpu_percent'], dtype=np.float32),
+            'threads': np.array(self.series['threads'], dtype=np.int32),
+            'read_bytes': np.array(self.series['read_bytes'], dtype=np.int64),
+            'write_bytes': np.array(self.series['write_bytes'], dtype=np.int64),
+        }
+
+
+    def save(self, outfile):
+        '''Writes the time series to a compressed numpy .npz file'''
+        with open(outfile, 'wb') as f:
+            np.savez_compressed(f, interval=np.float32(self.interval), **self.arrays())
+
+
+    def summary(self):
+        '''Returns dict of peak and percentile stats of the time series.
+        RAM is in kB, to match the ram from /usr/bin/time'''
+        arrays = self.arrays()
+        stats = {'samples': len(arrays['time']), 'interval': self.interval}
+        if stats['samples'] == 0:
+            return stats
+
+        ram = arrays['rss'] / 1024
+        stats.update({
+            'ram_peak': float(ram.max()),
+            'ram_p50': float(np.percentile(ram, 50)),
+            'ram_p95': float(np.percentile(ram, 95)),
+            'cpu_percent_mean': float(arrays['cpu_percent'].mean()),
+            'cpu_percent_p95': float(np.percentile(arrays['cpu_percent'], 95)),
+            'cpu_percent_peak': float(arrays['cpu_percent'].max()),
+            'threads_peak': int(arrays['threads'].max()),
+            'read_bytes_peak': int(arrays['read_bytes'].max()),
+            'write_bytes_peak': int(arrays['write_bytes'].max()),
+        })
+        return stats
+
+
+def load_profile(infile):
+    '''Returns dict of name -> numpy array from a file made by
+    ProcessTreeProfiler.save'''
+    with np.load(infile, allow_pickle=False) as npz:
+        return {k: npz[k] for k in npz.files}
@@ -0,0 +1,165 @@
+import functools
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+
+from evalrescallers import caller_adapters, json_io
+
+# Options of the callers (see caller_adapters.CallerAdapter.build_command)
+# that are the names of files or directories. Their contents are used in
+# the cache key, instead of the names
+path_options = {'mykrobe_custom_probe_file', 'mykrobe_custom_var_to_res', 'ariba_ref'}
+
+
+def cache_dir():
+    '''Directory of the result cache. Set by the environment variable
+    EVALRESCALLERS_RESULT_CACHE_DIR. Returns None if it is not set, which
+    means that no results are cached'''
+    d = os.environ.get('EVALRESCALLERS_RESULT_CACHE_DIR')
+    return None if d is None or d == '' else os.path.abspath(d)
+
+
+@functools.lru_cache(maxsize=None)
+def tool_version(caller):
+    '''Returns the version string printed by the tool, or None if
+    it could not be run'''
+    version_command = caller_adapters.get_adapter(caller).version_command
+    if version_command is None:
+        return None
+    completed_process = subprocess.run(version_command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    if completed_process.returncode != 0:
+        return None
+    return completed_process.stdout.strip()
+
+
+@functools.lru_cache(maxsize=None)
+def _reads_fingerprint(filename, size, mtime_ns):
+    # Use the MD5 sum if it was saved when the reads were downloaded
+    # (see ten_k_reads_download), because it is already known. Only trust
+    # the MD5 file if it was written after the reads file.
+    # Otherwise hash the whole file
+    md5_file = os.path.join(os.path.dirname(filename), 'reads.md5')
+    if os.path.exists(md5_file) and os.stat(md5_file).st_mtime_ns >= mtime_ns:
+        with open(md5_file) as f:
+            for line in f:
+                md5, name = line.rstrip().split(maxsplit=1)
+                if name == os.path.basename(filename):
+                    return f'md5:{md5}'
+
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1_048_576), b''):
+            md5.update(chunk)
+    return f'md5:{md5.hexdigest()}'
+
+
+def reads_fingerprint(filename):
+    '''Returns a string that identifies the contents of a reads file. This
+    is the MD5 sum of the file, taken from reads.md5 in the same directory
+    if it is there, otherwise made by reading the whole file (once for each
+    file, size and modification time)'''
+    stat = os.stat(filename)
+    return _reads_fingerprint(os.path.realpath(filename), stat.st_size, stat.st_mtime_ns)
+
+
+def path_hash(path):
+    '''Returns sha256 of the contents of a file, or of all the files in a
+    directory (including their relative paths). Returns None if path is None'''
+    if path is None:
+        return None
+
+    sha = hashlib.sha256()
+    if os.path.isdir(path):
+        filenames = []
+        for root, dirs, files in os.walk(path):
+            filenames.extend(os.path.join(root, x) for x in files)
+        filenames = sorted(filenames)
+    else:
+        filenames = [path]
+
+    for filename in filenames:
+        sha.update(os.path.relpath(filename, path).encode())
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(1_048_576), b''):
+                sha.update(chunk)
+    return sha.hexdigest()
+
+
+def cache_key(caller, reads1, reads2, command_line_opts=None, **options):
+    '''Returns the key of a caller run in the cache, made from everything
+    that can change the results: the contents of the reads files, the caller
+    and its version, the command line options, and the options in
+    the cache_options of the caller's adapter (eg the panel and probe files of
+    Mykrobe). Other options are ignored, because the caller does not use them.
+    Returns None if the tool version could not be found, in which case the
+    run should not be cached'''
+    version = tool_version(caller)
+    if version is None:
+        return None
+
+    key_data = {
+        'caller': caller,
+        'version': version,
+        'reads': [reads_fingerprint(reads1), reads_fingerprint(reads2)],
+        # None and '' both mean no options
+        'command_line_opts': command_line_opts if command_line_opts else None,
+    }
+    for name in caller_adapters.get_adapter(caller).cache_options:
+        value = options.get(name)
+        key_data[name] = path_hash(value) if name in path_options else value
+    return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode()).hexdigest()
+
+
+def _cache_file(directory, key):
+    return os.path.join(directory, key[:2], f'{key}.json')
+
+
+def _raw_output_file(directory, key):
+    return os.path.join(directory, key[:2], f'{key}.out.json')
+
+
+def get(directory, key, raw_output_file=None):
+    '''Returns the summary data stored for key, or None if it is not in the
+    cache. If raw_output_file is given, the raw output of the caller
+    (out.json) is copied to it, and None is returned if the cache does not
+    have the raw output'''
+    cache_file = _cache_file(directory, key)
+    try:
+        summary_data = json_io.load(cache_file)
+    except FileNotFoundError:
+        return None
+    except json.decoder.JSONDecodeError:
+        logging.warning(f'Error loading result cache file {cache_file}. Ignoring it')
+        return None
+
+    if raw_output_file is not None:
+        try:
+            shutil.copyfile(_raw_output_file(directory, key), raw_output_file)
+        except FileNotFoundError:
+            return None
+    return summary_data
+
+
+def _write_atomic(outfile, write_function):
+    tmp_file = f'{outfile}.{os.getpid()}.tmp'
+    write_function(tmp_file)
+    os.replace(tmp_file, outfile)
+
+
+def put(directory, key, summary_data, raw_output_file=None):
+    '''Stores summary_data for key, and a copy of the file raw_output_file
+    (the out.json file of the caller) if it is given. The files are written
+    under temporary names and then renamed, so that other processes never see
+    a partial file. The raw output is stored first, so that it is there
+    whenever the summary is'''
+    cache_file = _cache_file(directory, key)
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        if raw_output_file is not None:
+            _write_atomic(_raw_output_file(directory, key), lambda x: shutil.copyfile(raw_output_file, x))
+        _write_atomic(cache_file, lambda x: json_io.write(summary_data, x))
+    except OSError:
+        logging.warning(f'Could not write result cache file {cache_file}. Continuing without it')
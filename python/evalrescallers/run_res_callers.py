@@ -1,45 +1,59 @@
 import collections
-import json
+import concurrent.futures
 import logging
 import os
 import shutil
+import tempfile
 import traceback
 
-from evalrescallers import res_caller
+from evalrescallers import caller_adapters, json_io, reads_subsample, res_caller
 logging.basicConfig(level=logging.INFO)
 
 
-Caller = collections.namedtuple('Caller', ['name', 'force', 'outdir_name', 'mykrobe_species', 'mykrobe_panel', 'mykrobe_probes', 'mykrobe_var_to_res', 'command_line_opts'])
+Caller = collections.namedtuple('Caller', ['name', 'force', 'outdir_name', 'mykrobe_species', 'mykrobe_panel', 'mykrobe_probes', 'mykrobe_var_to_res', 'command_line_opts', 'threads', 'ram'], defaults=[1, None])
 
 def load_callers_file(infile):
     callers = []
-    allowed_callers = {'ARIBA', 'KvarQ', 'MTBseq', 'Mykrobe', 'TB-Profiler'}
+    allowed_callers = caller_adapters.caller_names()
     allowed_mykrobe_species = {'staph', 'tb'}
 
     with open(infile) as f:
         for line in f:
-            tool, force, outdir_name, mykrobe_species, mykrobe_panel, mykrobe_probes, mykrobe_var_to_res, command_line_opts = line.rstrip().split('\t')
+            fields = line.rstrip().split('\t')
+            tool, force, outdir_name, mykrobe_species, mykrobe_panel, mykrobe_probes, mykrobe_var_to_res, command_line_opts = fields[:8]
             assert tool in allowed_callers
             force = force == '1'
             if command_line_opts == '.':
                 command_line_opts = None
 
+            # Optional columns 9 and 10 are the number of CPUs and the RAM
+            # in GB that the caller needs. Only used when running
+            # callers at the same time. If not given, use the defaults
+            # of the caller's adapter
+            threads, ram = caller_adapters.get_adapter(tool).resource_profile()
+            if len(fields) > 8 and fields[8] != '.':
+                threads = int(fields[8])
+                assert threads > 0
+            if len(fields) > 9 and fields[9] != '.':
+                ram = float(fields[9])
+            resources = {'threads': threads, 'ram': ram}
+
             if tool == 'ARIBA':
                 # We're also using mykrobe_panel column for the ariba reference directory.
                 assert mykrobe_panel != '.'
-                callers.append(Caller(tool, force, outdir_name, None, mykrobe_panel, None, None, command_line_opts))
+                callers.append(Caller(tool, force, outdir_name, None, mykrobe_panel, None, None, command_line_opts, **resources))
             elif tool == 'Mykrobe':
                 assert mykrobe_species in allowed_mykrobe_species
 
                 if mykrobe_species == 'staph' and mykrobe_probes == '.':
-                    callers.append(Caller(tool, force, outdir_name, mykrobe_species, None, None, None, command_line_opts))
+                    callers.append(Caller(tool, force, outdir_name, mykrobe_species, None, None, None, command_line_opts, **resources))
                 elif mykrobe_panel in {'bradley-2015', 'walker-2015', 'Fail'}:
-                    callers.append(Caller(tool, force,outdir_name,  mykrobe_species, mykrobe_panel, None, None, command_line_opts))
+                    callers.append(Caller(tool, force,outdir_name,  mykrobe_species, mykrobe_panel, None, None, command_line_opts, **resources))
                 else:
                     assert mykrobe_probes != '.' and mykrobe_var_to_res != '.'
-                    callers.append(Caller(tool, force, outdir_name, mykrobe_species, mykrobe_panel, mykrobe_probes, mykrobe_var_to_res, command_line_opts))
+                    callers.append(Caller(tool, force, outdir_name, mykrobe_species, mykrobe_panel, mykrobe_probes, mykrobe_var_to_res, command_line_opts, **resources))
             else:
-                callers.append(Caller(tool, force, outdir_name, None, None, None, None, command_line_opts))
+                callers.append(Caller(tool, force, outdir_name, None, None, None, None, command_line_opts, **resources))
 
 
     logging.debug(f'Loaded callers file {infile}')
@@ -51,39 +65,135 @@ def summary_json_from_all_callers(json_files_dict, outfile):
 
     for caller_name, json_file in json_files_dict.items():
         if os.path.exists(json_file):
-            with open(json_file) as f:
-                json_data = json.load(f)
+            json_data = json_io.load(json_file)
             json_data['Success'] = True
             summary_data[caller_name] = json_data
         else:
             summary_data[caller_name] = {'Success': False}
 
-    with open(outfile, 'w') as f:
-        json.dump(summary_data, f, sort_keys=True, indent=4)
+    json_io.write(summary_data, outfile)
 
 
-def run_res_callers(callers_file, outdir, reads1, reads2, testing=False):
-    logging.info(f'Run callers from file {callers_file}')
+def run_one_caller(caller, caller_outdir, reads1, reads2, panel_name, testing=False, profile_interval=1.0, subsample_info=None):
+    '''Runs one caller, writing the "done" file in its output
+    directory if it succeeded. If subsample_info is given (the reads are a
+    subsample, see reads_subsample), it is added to the caller's summary.json
+    before the "done" file is written. Returns True/False for success/fail'''
+    success_file = os.path.join(caller_outdir, 'done')
+    this_res_caller = res_caller.ResCaller(caller.name, caller_outdir)
+
+    try:
+        logging.info(f'Start running {caller}')
+        this_res_caller.run(reads1, reads2,
+            mykrobe_panel=panel_name,
+            mykrobe_species=caller.mykrobe_species,
+            mykrobe_custom_probe_file=caller.mykrobe_probes,
+            mykrobe_custom_var_to_res=caller.mykrobe_var_to_res,
+            fake_for_fast_test=testing,
+            command_line_opts=caller.command_line_opts,
+            ariba_ref=caller.mykrobe_panel,
+            profile_interval=profile_interval,
+            threads=caller.threads,
+        )
+        if subsample_info is not None:
+            _add_to_summary_json(this_res_caller.summary_output_json, 'subsample', subsample_info)
+    except Exception:
+        logging.info(f'Failed {caller}. Traceback is:')
+        logging.info(traceback.format_exc())
+        return False
+
+    with open(success_file, 'w') as f:
+        pass
+
+    return True
+
+
+def callers_that_fit(pending, free_threads, free_ram, any_running):
+    '''Returns the callers from the list pending that can be started
+    now, given the free CPUs and RAM (in GB, or None for no RAM limit).
+    Callers are packed largest first. If nothing is running, then
+    the first pending caller is always returned, so that a caller asking
+    for more than the whole budget still gets run (on its own)'''
+    to_start = []
+
+    for caller in sorted(pending, key=lambda x: (-x.threads, -(x.ram or 0))):
+        ram_ok = free_ram is None or caller.ram is None or caller.ram <= free_ram
+        if caller.threads <= free_threads and ram_ok:
+            to_start.append(caller)
+            free_threads -= caller.threads
+            if free_ram is not None and caller.ram is not None:
+                free_ram -= caller.ram
+
+    if len(to_start) == 0 and not any_running and len(pending) > 0:
+        to_start.append(sorted(pending, key=lambda x: (-x.threads, -(x.ram or 0)))[0])
+
+    return to_start
+
+
+def _run_callers_concurrently(jobs, threads, ram):
+    '''jobs = list of (caller, run_one_caller args tuple).
+    Runs the jobs in a process pool, only starting a caller when there
+    are enough free CPUs and RAM. Returns True iff all callers succeeded'''
+    pending = {caller: args for caller, args in jobs}
+    running = {}
+    free_threads = threads
+    free_ram = ram
+    any_fails = False
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max(1, min(threads, len(jobs)))) as executor:
+        while len(pending) > 0 or len(running) > 0:
+            for caller in callers_that_fit(list(pending), free_threads, free_ram, len(running) > 0):
+                logging.info(f'Submitting {caller} (threads={caller.threads}, ram={caller.ram})')
+                future = executor.submit(run_one_caller, *pending.pop(caller))
+                running[future] = caller
+                free_threads -= caller.threads
+                if free_ram is not None and caller.ram is not None:
+                    free_ram -= caller.ram
+
+            done, not_done = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                caller = running.pop(future)
+                free_threads += caller.threads
+                if free_ram is not None and caller.ram is not None:
+                    free_ram += caller.ram
+                try:
+                    success = future.result()
+                except Exception:
+                    logging.info(f'Failed {caller}. Traceback is:')
+                    logging.info(traceback.format_exc())
+                    success = False
+                any_fails = any_fails or not success
+
+    return not any_fails
+
+
+def caller_jobs_for_one_sample(callers, outdir, reads1, reads2, testing=False, profile_interval=1.0, only_caller=None):
+    '''Works out which of the callers need to be run on one sample, deleting
+    any old caller output directories that are to be rerun (ie when the
+    caller has force set, or the old run did not finish). If only_caller
+    is given, only the caller with that outdir_name is considered, and the
+    output directories of the other callers are left alone. Returns tuple:
+    (dict of caller outdir_name -> summary JSON file of every caller,
+    list of (caller, run_one_caller args tuple) of the callers to run)'''
     root_outdir = os.path.abspath(outdir)
-    if not os.path.exists(root_outdir):
-        os.mkdir(root_outdir)
     reads1 = os.path.abspath(reads1)
     reads2 = os.path.abspath(reads2)
-    ran_any_caller = False
     summary_json_files = {}
-    callers_to_run = load_callers_file(callers_file)
-    any_fails = False
-    panel_name = None
+    jobs = []
 
-    for caller in callers_to_run:
+    for caller in callers:
         logging.info(f'Setting up to run caller {caller}')
-        if caller.name == 'Mykrobe':
-            if caller.mykrobe_species == 'tb':
-                panel_name = caller.mykrobe_panel if caller.mykrobe_probes is None else None
+        # Only Mykrobe uses the panel. It is in the result cache key, so
+        # must not be given to other callers
+        panel_name = None
+        if caller.name == 'Mykrobe' and caller.mykrobe_species == 'tb' and caller.mykrobe_probes is None:
+            panel_name = caller.mykrobe_panel
 
         caller_outdir = os.path.join(root_outdir, caller.outdir_name)
         success_file = os.path.join(caller_outdir, 'done')
         summary_json_files[caller.outdir_name] = os.path.join(caller_outdir, 'summary.json')
+        if only_caller is not None and caller.outdir_name != only_caller:
+            continue
 
         if os.path.exists(caller_outdir):
             if caller.force or not os.path.exists(success_file):
@@ -92,32 +202,122 @@ def run_res_callers(callers_file, outdir, reads1, reads2, testing=False):
             else:
                 continue
 
-        this_res_caller = res_caller.ResCaller(caller.name, caller_outdir)
-        ran_any_caller = True
-
-        try:
-            logging.info(f'Start running {caller}')
-            this_res_caller.run(reads1, reads2,
-                mykrobe_panel=panel_name,
-                mykrobe_species=caller.mykrobe_species,
-                mykrobe_custom_probe_file=caller.mykrobe_probes,
-                mykrobe_custom_var_to_res=caller.mykrobe_var_to_res,
-                fake_for_fast_test=testing,
-                command_line_opts=caller.command_line_opts,
-                ariba_ref=caller.mykrobe_panel,
-            )
-        except Exception:
-            any_fails = True
-            logging.info(f'Failed {caller}. Traceback is:')
-            logging.info(traceback.format_exc())
+        jobs.append((caller, (caller, caller_outdir, reads1, reads2, panel_name, testing, profile_interval)))
+
+    return summary_json_files, jobs
+
+
+def run_res_caller(callers_file, outdir_name, outdir, reads1, reads2, testing=False, profile_interval=1.0):
+    '''Runs one caller from callers_file on one sample, where outdir_name
+    is the caller's name in column 3 of the file. Does not make the sample
+    summary.json file (use merge_sample_summary when all the callers of the
+    sample have been run). Does nothing if the caller has already finished,
+    unless it has force set. Returns True/False for success/fail'''
+    root_outdir = os.path.abspath(outdir)
+    if not os.path.exists(root_outdir):
+        os.mkdir(root_outdir)
+    callers = load_callers_file(callers_file)
+    if outdir_name not in {x.outdir_name for x in callers}:
+        raise Exception(f'Caller "{outdir_name}" not found in callers file {callers_file}')
+
+    summary_json_files, jobs = caller_jobs_for_one_sample(callers, root_outdir, reads1, reads2, testing=testing, profile_interval=profile_interval, only_caller=outdir_name)
+    if len(jobs) == 0:
+        logging.info(f'Caller {outdir_name} already finished in {root_outdir}. Not rerunning')
+        return True
+
+    caller, args = jobs[0]
+    return run_one_caller(*args)
+
+
+def merge_sample_summary(callers_file, outdir):
+    '''Writes the summary.json file of one sample in outdir, from the
+    summary files of the callers in callers_file. Callers that have not
+    finished (eg because they failed) are in the summary with Success false'''
+    root_outdir = os.path.abspath(outdir)
+    summary_json_files = {x.outdir_name: os.path.join(root_outdir, x.outdir_name, 'summary.json') for x in load_callers_file(callers_file)}
+    summary_json_from_all_callers(summary_json_files, os.path.join(root_outdir, 'summary.json'))
+
+
+def _add_to_summary_json(json_file, key, value):
+    data = json_io.load(json_file)
+    data[key] = value
+    json_io.write(data, json_file)
+
+
+def subsample_settings(subsample_info):
+    '''Returns the settings that were asked for (target depth, method, and
+    seed if random), from the subsample details in a caller summary.json
+    file (see reads_subsample.subsample_reads). Returns None if
+    subsample_info is None, ie all the reads were used'''
+    if subsample_info is None:
+        return None
+    return {x: subsample_info[x] for x in ('target_depth', 'method', 'seed') if x in subsample_info}
+
+
+def check_finished_callers_subsample(summary_json_files, finished, wanted):
+    '''Raises an exception if any of the callers in the list finished (of
+    outdir_names) were run on a different subsample of the reads (or without
+    subsampling) from wanted (see subsample_settings)'''
+    for outdir_name in finished:
+        json_file = summary_json_files[outdir_name]
+        if not os.path.exists(json_file):
             continue
+        got = subsample_settings(json_io.load(json_file).get('subsample'))
+        if got != wanted:
+            raise Exception(f'Caller {outdir_name} was already run in {os.path.dirname(json_file)} with subsample {got}, but asked for subsample {wanted}. Use a different output directory, or set column 2 of the callers file to 1 to rerun the caller')
+
+
+def run_res_callers(callers_file, outdir, reads1, reads2, testing=False, threads=1, ram=None, profile_interval=1.0, subsample_depth=None, subsample_method='first', subsample_seed=42):
+    '''Runs all the callers in callers_file. If threads > 1, callers are
+    run at the same time, using at most threads CPUs and ram GB of RAM
+    in total (or no RAM limit if ram is None), where the CPUs and RAM
+    each caller needs are taken from the callers file. Each caller is told
+    to use its number of CPUs, capped at threads.
+    profile_interval is the time in seconds between samples of each caller's
+    RAM, CPU etc (see resource_profiler). Use 0 or None for no profiling.
+    If subsample_depth is given, the callers are run on a subsample of the
+    reads with that depth of the H37Rv genome (see reads_subsample), and
+    details of the subsample are added to each caller's summary.json.
+    Raises an exception if any callers that are not being rerun were
+    run with different subsample settings (or without subsampling), so that
+    the sample summary never mixes depths'''
+    logging.info(f'Run callers from file {callers_file}')
+    root_outdir = os.path.abspath(outdir)
+    if not os.path.exists(root_outdir):
+        os.mkdir(root_outdir)
+    # A caller never gets more CPUs than are available in total
+    callers_to_run = [x._replace(threads=min(x.threads, threads)) for x in load_callers_file(callers_file)]
+    summary_json_files, jobs = caller_jobs_for_one_sample(callers_to_run, root_outdir, reads1, reads2, testing=testing, profile_interval=profile_interval)
+    if subsample_depth is None:
+        wanted_subsample = None
+    else:
+        wanted_subsample = {'target_depth': subsample_depth, 'method': subsample_method}
+        if subsample_method == 'random':
+            wanted_subsample['seed'] = subsample_seed
+    to_run = {caller.outdir_name for caller, args in jobs}
+    check_finished_callers_subsample(summary_json_files, [x for x in summary_json_files if x not in to_run], wanted_subsample)
+    any_fails = False
+    subsample_dir = None
 
-        with open(success_file, 'w') as f:
-            pass
+    try:
+        if subsample_depth is not None and len(jobs) > 0:
+            subsample_dir = tempfile.mkdtemp(prefix='subsample.', dir=root_outdir)
+            sub1 = os.path.join(subsample_dir, 'reads_1.fastq.gz')
+            sub2 = os.path.join(subsample_dir, 'reads_2.fastq.gz')
+            subsample_info = reads_subsample.subsample_reads(reads1, reads2, sub1, sub2, subsample_depth, method=subsample_method, seed=subsample_seed)
+            jobs = [(caller, args[:2] + (sub1, sub2) + args[4:] + (subsample_info,)) for caller, args in jobs]
 
+        if threads > 1 and len(jobs) > 1:
+            any_fails = not _run_callers_concurrently(jobs, threads, ram)
+        else:
+            for caller, args in jobs:
+                if not run_one_caller(*args):
+                    any_fails = True
+    finally:
+        if subsample_dir is not None:
+            shutil.rmtree(subsample_dir)
 
-    if ran_any_caller:
+    if len(jobs) > 0:
         logging.info('Making summary JSON file')
         summary_json = os.path.join(root_outdir, 'summary.json')
         summary_data = summary_json_from_all_callers(summary_json_files, summary_json)
-
@@ -0,0 +1,111 @@
+import os
+import sqlite3
+
+
+class SampleIndex:
+    '''Index of the samples in a pipeline directory, in an SQLite file.
+    Each sample has a unique name and number. Samples are added in one
+    transaction, so a crash never leaves a partly added batch, and the file
+    uses write-ahead logging so that it can be read while samples are
+    being added. Samples can be added as pending, meaning that their
+    directories have not been made yet. Use as a context manager, or call
+    close()'''
+    def __init__(self, db_file, samples_per_dir=100):
+        self.db_file = os.path.abspath(db_file)
+        self.connection = sqlite3.connect(self.db_file, timeout=60, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS samples (number INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL, reads1 TEXT, reads2 TEXT, dir TEXT)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS pending (number INTEGER PRIMARY KEY)')
+        self.connection.execute('INSERT OR IGNORE INTO meta VALUES (?, ?)', ('samples_per_dir', str(samples_per_dir)))
+        self.samples_per_dir = int(self.connection.execute('SELECT value FROM meta WHERE key = ?', ('samples_per_dir',)).fetchone()[0])
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def close(self):
+        self.connection.close()
+
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM samples').fetchone()[0]
+
+
+    @classmethod
+    def _row_to_dict(cls, row):
+        if row is None:
+            return None
+        number, name, reads1, reads2, sample_dir = row
+        return {'name': name, 'reads': [reads1, reads2], 'number': number, 'dir': sample_dir}
+
+
+    def get(self, name):
+        '''Returns dict of the sample (in the same format as PipelineOutputDir.data)
+        with the given name, or None if it is not in the index'''
+        row = self.connection.execute('SELECT * FROM samples WHERE name = ?', (name,)).fetchone()
+        return SampleIndex._row_to_dict(row)
+
+
+    def get_by_number(self, number):
+        row = self.connection.execute('SELECT * FROM samples WHERE number = ?', (number,)).fetchone()
+        return SampleIndex._row_to_dict(row)
+
+
+    def __iter__(self):
+        '''Yields the samples (see get()), in order of sample number'''
+        for row in self.connection.execute('SELECT * FROM samples ORDER BY number'):
+            yield SampleIndex._row_to_dict(row)
+
+
+    def pending_samples(self):
+        '''Returns list of the pending samples (see get()), in order of
+        sample number'''
+        rows = self.connection.execute('SELECT samples.* FROM samples JOIN pending USING (number) ORDER BY number')
+        return [SampleIndex._row_to_dict(x) for x in rows]
+
+
+    def clear_pending(self, numbers):
+        '''Marks the samples with the given numbers as not pending'''
+        self.connection.executemany('DELETE FROM pending WHERE number = ?', [(x,) for x in numbers])
+
+
+    def add_samples(self, samples, number_to_dir, pending=False):
+        '''Adds samples to the index, numbered after the samples already there.
+        samples = list of dicts with keys name and reads, or also number and
+        dir to keep those (eg when importing from data.json).
+        number_to_dir(number, samples_per_dir) gives the directory of a new sample.
+        If pending is True, the new samples are marked as pending, until
+        clear_pending() is called.
+        Raises an exception, and adds nothing, if any of the names is already
+        in the index. Returns list of the new samples'''
+        new_samples = []
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            next_number = self.connection.execute('SELECT COALESCE(MAX(number) + 1, 0) FROM samples').fetchone()[0]
+            for sample in samples:
+                if self.connection.execute('SELECT 1 FROM samples WHERE name = ?', (sample['name'],)).fetchone() is not None:
+                    raise Exception('Sample already exists. Cannot add another with the same name. Sample name: ' + sample['name'])
+                number = sample.get('number')
+                if number is None:
+                    number = next_number
+                sample_dir = sample.get('dir')
+                if sample_dir is None:
+                    sample_dir = number_to_dir(number, self.samples_per_dir)
+                next_number = max(next_number, number + 1)
+                self.connection.execute('INSERT INTO samples VALUES (?, ?, ?, ?, ?)', (number, sample['name'], sample['reads'][0], sample['reads'][1], sample_dir))
+                if pending:
+                    self.connection.execute('INSERT INTO pending VALUES (?)', (number,))
+                new_samples.append({'name': sample['name'], 'reads': list(sample['reads']), 'number': number, 'dir': sample_dir})
+        except:
+            self.connection.execute('ROLLBACK')
+            raise
+
+        self.connection.execute('COMMIT')
+        return new_samples
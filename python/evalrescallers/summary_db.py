@@ -0,0 +1,191 @@
+import os
+import sqlite3
+
+from evalrescallers import json_io
+
+columns = [
+    ('sample', 'TEXT'),
+    ('caller', 'TEXT'),
+    ('drug', 'TEXT'),
+    ('predict', 'TEXT'),
+    ('gene', 'TEXT'),
+    ('variant', 'TEXT'),
+    ('conf', 'INTEGER'),
+    ('ref_depth', 'INTEGER'),
+    ('alt_depth', 'INTEGER'),
+    ('expected_depth', 'INTEGER'),
+    ('wall_clock_time', 'REAL'),
+    ('user_time', 'REAL'),
+    ('system_time', 'REAL'),
+    ('ram', 'REAL'),
+    ('success', 'INTEGER'),
+]
+
+column_names = [x[0] for x in columns]
+indexed_columns = ['sample', 'drug', 'caller']
+
+
+def sample_summary_to_rows(sample, summary_data):
+    '''Yields one tuple per (caller, drug, call) from the summary data
+    of one sample (ie the contents of a sample summary.json file).
+    Values are in the same order as column_names. A caller with no calls
+    at all (including failed callers) gets one row with drug=None, so
+    that its time, memory and success are not lost'''
+    for caller, caller_data in sorted(summary_data.items()):
+        time_and_memory = caller_data.get('time_and_memory', {})
+        caller_values = (
+            time_and_memory.get('wall_clock_time'),
+            time_and_memory.get('user_time'),
+            time_and_memory.get('system_time'),
+            time_and_memory.get('ram'),
+            int(caller_data.get('Success', False)),
+        )
+        wrote_any = False
+
+        for drug, calls in sorted(caller_data.get('resistance_calls', {}).items()):
+            for predict, gene, variant, info in calls:
+                if not isinstance(info, dict):
+                    info = {}
+                yield (sample, caller, drug, predict, gene, variant,
+                    info.get('conf'),
+                    info.get('ref_depth'),
+                    info.get('alt_depth'),
+                    info.get('expected_depth'),
+                ) + caller_values
+                wrote_any = True
+
+        if not wrote_any:
+            yield (sample, caller) + (None,) * 8 + caller_values
+
+
+def _create_tables(connection):
+    # calls is the flat table of calls. sample_summaries has the whole
+    # summary of each sample as compact JSON, so that summary.json can be
+    # remade from this file without loading every sample summary.json again
+    column_defs = ', '.join(f'{name} {col_type}' for name, col_type in columns)
+    connection.execute(f'CREATE TABLE IF NOT EXISTS calls ({column_defs})')
+    connection.execute('CREATE TABLE IF NOT EXISTS sample_summaries (sample TEXT PRIMARY KEY, summary TEXT) WITHOUT ROWID')
+
+
+def _create_indexes(connection, index_columns):
+    for column in index_columns:
+        connection.execute(f'CREATE INDEX IF NOT EXISTS calls_{column} ON calls ({column})')
+
+
+_insert_calls_sql = f'INSERT INTO calls VALUES ({", ".join(["?"] * len(columns))})'
+
+
+class SummaryDb:
+    '''Flat table of all calls from all samples, in an SQLite file, with one
+    row per (sample, caller, drug, call). The file is built under a temporary
+    name, and only moved to the final filename by close()'''
+    def __init__(self, db_file):
+        self.db_file = os.path.abspath(db_file)
+        self.tmp_db_file = self.db_file + '.tmp'
+        if os.path.exists(self.tmp_db_file):
+            os.unlink(self.tmp_db_file)
+        self.connection = sqlite3.connect(self.tmp_db_file)
+        # Nothing reads the file until it is finished, so no need for
+        # a journal or syncing while it is built
+        self.connection.execute('PRAGMA journal_mode=OFF')
+        self.connection.execute('PRAGMA synchronous=OFF')
+        _create_tables(self.connection)
+
+
+    def add_sample(self, sample, summary_data):
+        self.connection.executemany(_insert_calls_sql, sample_summary_to_rows(sample, summary_data))
+        self.connection.execute('INSERT INTO sample_summaries VALUES (?, ?)', (sample, json_io.dumps(summary_data)))
+
+
+    def close(self):
+        _create_indexes(self.connection, indexed_columns)
+        self.connection.commit()
+        self.connection.close()
+        os.replace(self.tmp_db_file, self.db_file)
+
+
+class SummaryStore:
+    '''The same tables as SummaryDb, but samples are added to the file in
+    place as they finish, so that the file can be queried (eg with query())
+    while a pipeline is still running. Adding a sample that is already there
+    replaces it. Only the index on sample is made at the start, because it
+    is needed to replace samples. The others are made by finalize().
+    There is also the table sample_files, with the mtime (ns) and size of
+    the summary.json file each sample was added from, so that changed files
+    can be found. Use as a context manager, or call close()'''
+    def __init__(self, db_file):
+        self.db_file = os.path.abspath(db_file)
+        self.connection = sqlite3.connect(self.db_file, timeout=60, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        _create_tables(self.connection)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS sample_files (sample TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER) WITHOUT ROWID')
+        _create_indexes(self.connection, ['sample'])
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def close(self):
+        self.connection.close()
+
+
+    def samples(self):
+        '''Returns set of the names of the samples in the file'''
+        return {x[0] for x in self.connection.execute('SELECT sample FROM sample_summaries')}
+
+
+    def file_stats(self):
+        '''Returns dict of sample name -> (mtime_ns, size) of the file that
+        each sample was added from. Samples added without file_stat are
+        not included'''
+        return {x[0]: (x[1], x[2]) for x in self.connection.execute('SELECT sample, mtime_ns, size FROM sample_files')}
+
+
+    def add_sample(self, sample, summary_data, file_stat=None):
+        '''Adds one sample in one transaction, replacing it if it is
+        already there. file_stat = tuple (mtime_ns, size) of the file the
+        summary data came from (see file_stats())'''
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            self.connection.execute('DELETE FROM calls WHERE sample = ?', (sample,))
+            self.connection.executemany(_insert_calls_sql, sample_summary_to_rows(sample, summary_data))
+            self.connection.execute('INSERT OR REPLACE INTO sample_summaries VALUES (?, ?)', (sample, json_io.dumps(summary_data)))
+            if file_stat is None:
+                self.connection.execute('DELETE FROM sample_files WHERE sample = ?', (sample,))
+            else:
+                self.connection.execute('INSERT OR REPLACE INTO sample_files VALUES (?, ?, ?)', (sample,) + tuple(file_stat))
+        except:
+            self.connection.execute('ROLLBACK')
+            raise
+
+        self.connection.execute('COMMIT')
+
+
+    def iter_sample_summaries(self):
+        '''Yields tuples (sample name, summary data), sorted by sample name'''
+        for sample, summary in self.connection.execute('SELECT sample, summary FROM sample_summaries ORDER BY sample'):
+            yield sample, json_io.loads(summary)
+
+
+    def finalize(self):
+        '''Makes the rest of the indexes, so that the file has the same
+        indexes as one made by SummaryDb. Also stops using write-ahead
+        logging, so that the finished file is one file on its own'''
+        _create_indexes(self.connection, indexed_columns)
+        self.connection.execute('PRAGMA journal_mode=DELETE')
+
+
+def query(db_file, sql, parameters=()):
+    '''Runs the query sql on the database db_file.
+    Returns a list of dicts, one per row'''
+    connection = sqlite3.connect(f'file:{os.path.abspath(db_file)}?mode=ro', uri=True)
+    connection.row_factory = sqlite3.Row
+    rows = [dict(x) for x in connection.execute(sql, parameters)]
+    connection.close()
+    return rows
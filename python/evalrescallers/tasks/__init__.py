@@ -1,7 +1,16 @@
 __all__ = [
+    'add_sample_to_summary',
+    'benchmark',
+    'finalize_summary',
     'make_summary_json',
+    'merge_sample_summary',
+    'reparse',
+    'resource_model',
     'run_callers_on_one_sample',
+    'run_one_caller',
+    'run_pipeline',
     'setup_pipeline_outdir',
+    'verify_reads',
     'download_nejm_reads',
     'version',
 ]
@@ -0,0 +1,5 @@
+from evalrescallers import pipeline_output_dir
+
+def run(options):
+    pipe_dir = pipeline_output_dir.PipelineOutputDir(options.pipeline_dir)
+    pipe_dir.add_sample_to_summary(options.sample, options.sqlite_file)
@@ -0,0 +1,26 @@
+import logging
+import os
+
+from evalrescallers import benchmark, json_io
+
+def run(options):
+    sizes = None if options.sizes is None else [int(x) for x in options.sizes.split(',')]
+    stages = None if options.stages is None else set(options.stages.split(','))
+    results = benchmark.run_benchmarks(
+        sizes=sizes,
+        stages=stages,
+        repeats=options.repeats,
+        workdir=options.workdir,
+        keep_workdir=options.keep_workdir,
+    )
+    json_io.write(results, options.outfile, pretty=True)
+
+    if options.baseline is not None:
+        if not os.path.exists(options.baseline):
+            raise FileNotFoundError(f'Baseline file not found: {options.baseline}')
+        regressions = benchmark.compare_to_baseline(results, json_io.load(options.baseline), tolerance=options.tolerance)
+        for stage, metric, old, new in regressions:
+            logging.warning(f'Regression in {stage}: {metric} was {old}, now {new}')
+        if len(regressions) > 0:
+            raise Exception(f'{len(regressions)} benchmark regressions compared to baseline {options.baseline}')
+        logging.info(f'No benchmark regressions compared to baseline {options.baseline}')
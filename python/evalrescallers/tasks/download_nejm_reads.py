@@ -1,5 +1,13 @@
 from evalrescallers import ten_k_reads_download
 
 def run(options):
-    ten_k_reads_download.get_samples(options.outdir, threads=options.threads)
-
+    ten_k_reads_download.get_samples(
+        options.outdir,
+        threads=options.threads,
+        transport=options.transport,
+        requests_per_second=options.max_requests_per_second,
+        mb_per_second=options.max_mb_per_second,
+        retries=options.retries,
+        progress_interval=options.progress_interval,
+        verify=not options.no_verify,
+    )
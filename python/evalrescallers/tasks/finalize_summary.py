@@ -0,0 +1,10 @@
+from evalrescallers import pipeline_output_dir
+
+def run(options):
+    pipe_dir = pipeline_output_dir.PipelineOutputDir(options.pipeline_dir)
+    pipe_dir.finalize_summary(
+        options.outfile,
+        options.sqlite_file,
+        threads=options.threads,
+        pretty=options.pretty,
+    )
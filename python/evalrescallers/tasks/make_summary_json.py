@@ -2,5 +2,11 @@ from evalrescallers import pipeline_output_dir
 
 def run(options):
     pipe_dir = pipeline_output_dir.PipelineOutputDir(options.pipeline_dir)
-    pipe_dir.make_summary_json_of_all_samples(options.outfile, threads=options.threads)
-
+    pipe_dir.make_summary_json_of_all_samples(
+        options.outfile,
+        threads=options.threads,
+        shards_dir=options.shards_dir,
+        incremental=options.incremental,
+        sqlite_file=options.sqlite,
+        pretty=options.pretty,
+    )
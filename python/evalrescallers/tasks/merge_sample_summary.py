@@ -0,0 +1,4 @@
+from evalrescallers import run_res_callers
+
+def run(options):
+    run_res_callers.merge_sample_summary(options.callers_file, options.outdir)
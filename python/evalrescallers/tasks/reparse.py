@@ -0,0 +1,10 @@
+from evalrescallers import reparse
+
+def run(options):
+    reparse.reparse_pipeline_dir(
+        options.pipeline_dir,
+        options.callers_file,
+        options.outfile,
+        threads=options.threads,
+        dry_run=options.dry_run,
+    )
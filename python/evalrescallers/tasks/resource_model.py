@@ -0,0 +1,4 @@
+from evalrescallers import resource_model
+
+def run(options):
+    resource_model.make_model_file(options.pipeline_dir, options.outfile, threads=options.threads, incremental=options.incremental)
@@ -7,5 +7,10 @@ def run(options):
         options.reads1,
         options.reads2,
         testing=options.testing, 
+        threads=options.threads,
+        ram=options.ram,
+        profile_interval=options.profile_interval,
+        subsample_depth=options.subsample_depth,
+        subsample_method=options.subsample_method,
+        subsample_seed=options.subsample_seed,
     )
-
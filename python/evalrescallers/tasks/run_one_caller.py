@@ -0,0 +1,14 @@
+from evalrescallers import run_res_callers
+
+def run(options):
+    success = run_res_callers.run_res_caller(
+        options.callers_file,
+        options.caller,
+        options.outdir,
+        options.reads1,
+        options.reads2,
+        testing=options.testing,
+        profile_interval=options.profile_interval,
+    )
+    if not success:
+        raise Exception(f'Error running caller {options.caller} in {options.outdir}')
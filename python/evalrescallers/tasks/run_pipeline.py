@@ -0,0 +1,15 @@
+from evalrescallers import local_pipeline
+
+def run(options):
+    local_pipeline.run_pipeline(
+        options.input_data_file,
+        options.callers_file,
+        options.output_dir,
+        no_new_data=options.no_new_data,
+        threads=options.threads,
+        ram=options.ram,
+        retries=options.retries,
+        testing=options.testing,
+        profile_interval=options.profile_interval,
+        summary_threads=options.summary_threads,
+    )
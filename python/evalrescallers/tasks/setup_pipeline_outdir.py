@@ -1,9 +1,40 @@
-from evalrescallers import pipeline_output_dir
+import os
+
+from evalrescallers import pipeline_output_dir, resource_model, run_res_callers
 
 def run(options):
     pipe_dir = pipeline_output_dir.PipelineOutputDir(options.outdir)
-    if not options.no_new_data:
-        pipe_dir.add_data_from_file(options.data_tsv)
-        pipe_dir.write_json_data_file()
-    pipe_dir.write_tsv_file(options.out_tsv)
+    model = None
+    if options.resource_model is not None and os.path.exists(options.resource_model):
+        model = resource_model.load_model_file(options.resource_model)
+
+    callers = None
+    with_hints = model is not None
+    if options.per_caller is not None:
+        callers = run_res_callers.load_callers_file(options.per_caller)
+        with_hints = with_hints or any(x.ram is not None for x in callers)
+    elif model is not None:
+        if options.callers_file is None:
+            raise Exception('Must use --callers_file with --resource_model, so that the RAM and time of the callers that will be run are added up')
+        caller_names = [x.outdir_name for x in run_res_callers.load_callers_file(options.callers_file)]
+
+    def write_sample(writer, sample_dict):
+        input_bytes = None if model is None else resource_model.reads_bytes(sample_dict['reads'])
+        if callers is None:
+            hints = None if model is None else resource_model.sample_hints(model, input_bytes, caller_names, concurrent=options.concurrent_callers)
+            writer.add(sample_dict, hints=hints)
+        else:
+            for caller in callers:
+                hints = resource_model.caller_hints(model, caller.outdir_name, input_bytes, ram=caller.ram)
+                writer.add(sample_dict, hints=hints, caller=caller)
+
+    # Samples from previous runs already have their directories, so write
+    # those first. Then write each new sample as soon as its directory has
+    # been made, instead of waiting for all of them
+    with pipeline_output_dir.JobsTsvWriter(options.out_tsv, with_hints=with_hints, per_caller=callers is not None) as writer:
+        for sample, d in sorted(pipe_dir.data['samples'].items()):
+            write_sample(writer, d)
 
+        if not options.no_new_data:
+            for d in pipe_dir.iter_add_data_from_file(options.data_tsv, threads=options.threads, write_json_data=options.write_data_json):
+                write_sample(writer, d)
@@ -0,0 +1,7 @@
+import logging
+
+from evalrescallers import reads_verify
+
+def run(options):
+    fails = reads_verify.verify_download_dir(options.download_dir, options.outfile, threads=options.threads)
+    logging.info(f'Number of samples that failed verification: {fails}')
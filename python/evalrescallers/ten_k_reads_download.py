@@ -1,9 +1,10 @@
 import csv
-import multiprocessing
 import os
-import subprocess
+import shutil
+import threading
 
 import evalrescallers
+from evalrescallers import ena_download, reads_verify
 
 
 def make_dir(d):
@@ -11,94 +12,75 @@ def make_dir(d):
         os.mkdir(d)
 
 
-def download_one_run(run_id, outdir):
-    success_file = f'{outdir}.success'
-    fail_file = f'{outdir}.fail'
-    if os.path.exists(success_file):
-        return True
-    elif os.path.exists(fail_file):
-        return False
-
-    command = f'enaDataGet -f fastq -d {outdir} {run_id}'
-    print(command)
-    completed_process = subprocess.run(command, shell=True, stdout=subprocess.PIPE)
-    if completed_process.returncode == 0:
-        with open(success_file, 'w') as f:
-            return True
-    else:
-        with open(fail_file, 'w') as f:
+def finish_sample(outdir, run_statuses, writer, verify=True):
+    '''Called when all runs of a sample have been downloaded (or failed).
+    The reads have already been written to reads_1.fastq.gz and
+    reads_2.fastq.gz by writer (a SampleReadsWriter). Closes the reads files,
+    writes their MD5 sums to reads.md5, and the MD5 sums of each run that were
+    checked against the ENA to ena.md5, tidies up the files of each run and
+    writes the file "success" or "fail" in outdir. If verify is True, the
+    reads files are checked (see reads_verify.verify_sample), and the sample
+    fails if there are any problems. Returns True/False for success/fail'''
+    md5s = writer.close()
+
+    if False in run_statuses.values():
+        for filename in list(writer.filenames.values()) + [writer.progress_file]:
+            if os.path.exists(filename):
+                os.unlink(filename)
+        with open(os.path.join(outdir, 'fail'), 'w') as f:
             return False
 
+    for filename in os.listdir(outdir):
+        path = os.path.join(outdir, filename)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+    if os.path.exists(writer.progress_file):
+        os.unlink(writer.progress_file)
+
+    with open(os.path.join(outdir, 'reads.md5'), 'w') as f:
+        for filename, md5 in sorted(md5s.items()):
+            print(md5, filename, sep='  ', file=f)
+
+    if len(writer.checked_md5s) > 0:
+        with open(os.path.join(outdir, reads_verify.ena_md5_filename), 'w') as f:
+            for filename, md5 in sorted(writer.checked_md5s.items()):
+                print(md5, filename, sep='  ', file=f)
+
+    if verify:
+        manifest = reads_verify.verify_sample(outdir)
+        if not manifest['ok']:
+            print('Verification failed', outdir, ';'.join(manifest['errors']), flush=True)
+            with open(os.path.join(outdir, 'fail'), 'w') as f:
+                return False
 
-def cat_reads_and_clean(to_cat, outfile):
-    if len(to_cat) == 1:
-        os.rename(to_cat[0], outfile)
+    with open(os.path.join(outdir, 'success'), 'w') as f:
         return True
-    else:
-        cat = 'cat ' + ' '.join(to_cat) + ' > ' + outfile
-        print(cat)
-        completed_process = subprocess.run(cat, shell=True, stdout=subprocess.PIPE)
-        if completed_process.returncode == 0:
-            for f in to_cat:
-                os.unlink(f)
-
-            return True
-        else:
-            return False
-
 
-def download_sample(outdir, sample_id, run_ids):
-    success_file = os.path.join(outdir, 'success')
-    fail_file = os.path.join(outdir, 'fail')
 
-    if os.path.exists(success_file):
+def sample_status(outdir):
+    '''Returns True/False if the sample in outdir already succeeded/failed,
+    or None if it still needs downloading. The runs that were finished by an
+    unfinished previous attempt are kept, and are not downloaded again
+    (see ena_download.SampleReadsWriter)'''
+    if os.path.exists(os.path.join(outdir, 'success')):
         return True
-    elif os.path.exists(fail_file):
+    elif os.path.exists(os.path.join(outdir, 'fail')):
         return False
-    elif os.path.exists(outdir):
-        completed_process = subprocess.run(f'rm -rf {outdir}', shell=True)
+    return None
 
-    make_dir(outdir)
-    success_statuses = {}
-    fwd_reads = []
-    rev_reads = []
-
-    for run_id in sorted(run_ids):
-        run_out = os.path.join(outdir, run_id)
-        success_statuses[run_id] = download_one_run(run_id, run_out)
-        if not success_statuses[run_id]:
-            with open(fail_file, 'w') as f:
-                return False
 
-        fwd = os.path.join(outdir, run_id, run_id, f'{run_id}_1.fastq.gz')
-        fwd_reads.append(fwd)
-        rev = os.path.join(outdir, run_id, run_id, f'{run_id}_2.fastq.gz')
-        rev_reads.append(rev)
-        if not (os.path.exists(fwd) and os.path.exists(rev)):
-            with open(fail_file, 'w') as f:
-                return False
+def download_sample(outdir, sample_id, run_ids, transport=None, limits=None, retries=3, verify=True):
+    status = sample_status(outdir)
+    if status is not None:
+        return status
 
-    fwd_reads.sort()
-    rev_reads.sort()
-    fwd = os.path.join(outdir, 'reads_1.fastq.gz')
-    rev = os.path.join(outdir, 'reads_2.fastq.gz')
-    fwd_cat_ok = cat_reads_and_clean(fwd_reads, fwd)
-    if fwd_cat_ok:
-        rev_cat_ok = cat_reads_and_clean(rev_reads, rev)
-        if rev_cat_ok:
-            for f in os.listdir(outdir):
-                f_path = os.path.join(outdir, f)
-                if os.path.isdir(f_path) or f.endswith('.success'):
-                    command = f'rm -rf {f_path}'
-                    completed_process = subprocess.run(command, shell=True, stdout=subprocess.PIPE)
-                    if completed_process.returncode != 0:
-                        with open(fail_file, 'w') as f:
-                            return False
-            with open(success_file, 'w') as f:
-                return True
-
-    with open(fail_file, 'w') as f:
-        return False
+    if transport is None:
+        transport = ena_download.EnaDataGetTransport()
+    make_dir(outdir)
+    writer = ena_download.SampleReadsWriter(outdir)
+    jobs = [ena_download.RunJob(sample_id, run_id, os.path.join(outdir, run_id)) for run_id in sorted(run_ids)]
+    results = ena_download.download_runs(jobs, transport, {sample_id: writer}, limits=limits, retries=retries)
+    return finish_sample(outdir, {run_id: results[(sample_id, run_id)] for run_id in run_ids}, writer, verify=verify)
 
 
 def load_accessions():
@@ -114,26 +96,58 @@ def load_accessions():
     return accessions
 
 
-def get_sample(sample):
-    runs = sorted(sample.split('.'))
-    print('Getting', sample, ','.join(runs))
-    samples_dir = sample[:6]
-    make_dir(samples_dir)
-    sample_dir = os.path.join(samples_dir, sample)
-    if download_sample(sample_dir, sample, runs):
-        print('Success', sample, ','.join(runs))
-    else:
-        print('Fail', sample, ','.join(runs))
-
-
-
-def get_samples(output_dir, threads=1):
+def get_samples(output_dir, threads=1, transport='enaDataGet', requests_per_second=None, mb_per_second=None, retries=3, progress_interval=30, verify=True):
+    '''Downloads all the samples. Each run of each sample is a separate
+    download, with up to threads downloads at once. Samples with the most
+    runs are started first. Each run is written straight into the sample reads
+    files as it is downloaded, one run at a time per sample (see
+    ena_download.download_runs). requests_per_second and mb_per_second
+    limit the downloads from each host (None means no limit). If verify is
+    True, each sample is checked when it has finished downloading
+    (see reads_verify)'''
     samples = load_accessions()
-    print(f'Going to download {len(samples)} samples using {threads} thread(s)...')
     make_dir(output_dir)
     os.chdir(output_dir)
+    transport = ena_download.transports[transport]()
+    limits = ena_download.HostLimits(
+        requests_per_second=requests_per_second,
+        bytes_per_second=None if mb_per_second is None else mb_per_second * 1_000_000,
+    )
+
+    jobs = []
+    runs_left = {}
+    run_statuses = {}
+    writers = {}
+    for sample in samples:
+        sample_dir = os.path.join(sample[:6], sample)
+        if sample_status(sample_dir) is not None:
+            continue
+        make_dir(sample[:6])
+        make_dir(sample_dir)
+        runs = sorted(sample.split('.'))
+        runs_left[sample] = len(runs)
+        run_statuses[sample] = {}
+        writers[sample] = ena_download.SampleReadsWriter(sample_dir)
+        jobs.append([ena_download.RunJob(sample, run_id, os.path.join(sample_dir, run_id)) for run_id in runs])
+
+    jobs = [job for sample_jobs in sorted(jobs, key=len, reverse=True) for job in sample_jobs]
+    print(f'Going to download {len(runs_left)} samples ({len(jobs)} runs) using {threads} thread(s)...', flush=True)
+    lock = threading.Lock()
+
+    def skip(job):
+        with lock:
+            return False in run_statuses[job.sample].values()
+
+    def on_run_done(job, success):
+        with lock:
+            run_statuses[job.sample][job.run_id] = success
+            runs_left[job.sample] -= 1
+            if runs_left[job.sample] > 0:
+                return
+        runs = sorted(run_statuses[job.sample])
+        if finish_sample(os.path.join(job.sample[:6], job.sample), run_statuses[job.sample], writers.pop(job.sample), verify=verify):
+            print('Success', job.sample, ','.join(runs), flush=True)
+        else:
+            print('Fail', job.sample, ','.join(runs), flush=True)
 
-    with multiprocessing.Pool(threads) as pool:
-        pool.map(get_sample, samples)
-
-
+    ena_download.download_runs(jobs, transport, writers, threads=threads, limits=limits, retries=retries, on_run_done=on_run_done, skip=skip, progress_interval=progress_interval)
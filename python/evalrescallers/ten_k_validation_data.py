@@ -1,7 +1,12 @@
+from collections import namedtuple
 import csv
+import functools
 import os
 
+import numpy as np
+
 import evalrescallers
+from evalrescallers import truth_data_cache
 
 # The samples from the sources below constitute the
 # "test" dataset, to be kept back until the final evaluaiton.
@@ -17,6 +22,14 @@ test_sources = {
 eval_dir = os.path.abspath(os.path.dirname(evalrescallers.__file__))
 data_dir = os.path.join(eval_dir, 'data')
 sources_file = os.path.join(data_dir, '10k_validation.sample_sources.tsv')
+all_data_files = [
+    os.path.join(data_dir, '10k_validation.phenotype.tsv'),
+    os.path.join(data_dir, '10k_validation.prediction.tsv'),
+    os.path.join(data_dir, '10k_validation.extra_phenotypes.tsv'),
+    sources_file,
+]
+
+TenKMatrices = namedtuple('TenKMatrices', ['samples', 'drugs', 'pheno', 'predict', 'is_test', 'country'])
 
 def load_sample_to_res_file(infile):
     sample_to_res = {}
@@ -99,3 +112,35 @@ def load_all_data():
 
     return drugs, pheno_data_validation, pheno_data_test, predict_data
 
+
+# Version of the arrays made by _build_all_data_matrices. Change this
+# when that function changes, so that old cache files are not used
+matrices_version = 1
+
+
+def _build_all_data_matrices():
+    drugs, pheno_validation, pheno_test, predict_data = load_all_data()
+    guid_to_source = load_sources_file(sources_file)
+    drugs = sorted(drugs)
+    samples = sorted(set(pheno_validation).union(pheno_test, predict_data))
+    pheno_data = {**pheno_validation, **pheno_test}
+    return {
+        'samples': np.array(samples),
+        'drugs': np.array(drugs),
+        'pheno': truth_data_cache.pheno_dict_to_matrix(pheno_data, samples, drugs),
+        'predict': truth_data_cache.pheno_dict_to_matrix(predict_data, samples, drugs),
+        'is_test': np.array([x in pheno_test for x in samples], dtype=bool),
+        'country': np.array([guid_to_source.get(x, ('', ''))[1] for x in samples]),
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def load_all_data_matrices():
+    '''Returns the same data as load_all_data, as a TenKMatrices tuple of
+    numpy arrays: samples and drugs (sorted names), pheno and predict
+    (samples x drugs int8 matrices, using the values in truth_data_cache),
+    is_test (True iff the sample is in the test set), and country
+    (empty string if not known). The matrices are cached on disk after
+    the first call (see truth_data_cache), and are read only'''
+    arrays = truth_data_cache.load_or_build('10k_validation', all_data_files, _build_all_data_matrices, build_version=matrices_version)
+    return TenKMatrices(**{k: arrays[k] for k in TenKMatrices._fields})
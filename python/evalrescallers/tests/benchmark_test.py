@@ -0,0 +1,55 @@
+import os
+import shutil
+import unittest
+
+from evalrescallers import benchmark
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_run_benchmarks(self):
+        '''test run_benchmarks'''
+        tmp_dir = 'tmp.benchmark.run_benchmarks'
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.mkdir(tmp_dir)
+        got = benchmark.run_benchmarks(sizes=[3], workdir=tmp_dir)
+        expected_stages = {
+            'bash_out_to_time_and_memory',
+            'json_to_resistance_calls.ARIBA',
+            'json_to_resistance_calls.KvarQ',
+            'json_to_resistance_calls.Mykrobe',
+            'json_to_resistance_calls.TB-Profiler',
+            'make_summary_json_of_all_samples',
+            'make_summary_json_of_all_samples.incremental',
+            'mtbseq_tab_file_to_res_calls',
+        }
+        self.assertEqual(expected_stages, set(got['sizes']['3']))
+        self.assertEqual(3, got['sizes']['3']['make_summary_json_of_all_samples']['items'])
+        self.assertIn('load_all_data', got)
+        self.assertEqual([], os.listdir(tmp_dir))
+
+        got = benchmark.run_benchmarks(sizes=[2], stages={'mtbseq_tab_file_to_res_calls'}, workdir=tmp_dir)
+        self.assertEqual({'2': ['mtbseq_tab_file_to_res_calls']}, {k: list(v) for k, v in got['sizes'].items()})
+        self.assertNotIn('load_all_data', got)
+        shutil.rmtree(tmp_dir)
+
+
+    def test_compare_to_baseline(self):
+        '''test compare_to_baseline'''
+        baseline = {
+            'load_all_data': {'items_per_second': 10, 'peak_mb': 20},
+            'sizes': {'100': {'s1': {'items_per_second': 100, 'peak_mb': 1}, 's2': {'items_per_second': 100, 'peak_mb': 1}}},
+        }
+        results = {
+            'load_all_data': {'items_per_second': 9, 'peak_mb': 21},
+            'sizes': {
+                '100': {'s1': {'items_per_second': 70, 'peak_mb': 1}, 's2': {'items_per_second': 100, 'peak_mb': 1.5}, 's3': {'items_per_second': 1, 'peak_mb': 100}},
+                '1000': {'s1': {'items_per_second': 1, 'peak_mb': 100}},
+            },
+        }
+        expected = [
+            ('100:s1', 'items_per_second', 100, 70),
+            ('100:s2', 'peak_mb', 1, 1.5),
+        ]
+        self.assertEqual(expected, benchmark.compare_to_baseline(results, baseline))
+        self.assertEqual([], benchmark.compare_to_baseline(results, baseline, tolerance=0.6))
@@ -0,0 +1,72 @@
+import os
+import unittest
+from unittest import mock
+
+from evalrescallers import caller_adapters, run_res_callers
+
+
+class FakeAdapter(caller_adapters.CallerAdapter):
+    name = 'FakeCaller'
+    version_command = 'echo 1.0'
+    threads = 4
+    ram = 2.5
+
+    def build_command(self, outdir, reads1, reads2, json_results_file, command_line_opts='', threads=1, **options):
+        return f'fake_caller {command_line_opts} {reads1} {reads2} {json_results_file}'
+
+
+    def parse_json(self, json_data, json_in):
+        return json_data
+
+
+class TestCallerAdapters(unittest.TestCase):
+    def test_get_adapter(self):
+        '''test get_adapter'''
+        self.assertEqual({'ARIBA', 'KvarQ', 'MTBseq', 'Mykrobe', 'TB-Profiler'}, caller_adapters.caller_names())
+        self.assertIsInstance(caller_adapters.get_adapter('Mykrobe'), caller_adapters.MykrobeAdapter)
+        with self.assertRaises(Exception):
+            caller_adapters.get_adapter('not_a_caller')
+
+
+    def test_build_command(self):
+        '''test build_command'''
+        adapter = caller_adapters.get_adapter('TB-Profiler')
+        self.assertEqual('tb-profiler profile --opt --threads 1 -1 r1 -2 r2 -p out', adapter.build_command('outdir', 'r1', 'r2', 'out.json', '--opt'))
+        self.assertEqual('tb-profiler profile --opt --threads 4 -1 r1 -2 r2 -p out', adapter.build_command('outdir', 'r1', 'r2', 'out.json', '--opt', threads=4))
+        self.assertEqual('tb-profiler profile --threads 2  -1 r1 -2 r2 -p out', adapter.build_command('outdir', 'r1', 'r2', 'out.json', '--threads 2', threads=4))
+        adapter = caller_adapters.get_adapter('KvarQ')
+        self.assertEqual('kvarq scan  -l MTBC -t 3 -p r1 out.json', adapter.build_command('outdir', 'r1', 'r2', 'out.json', threads=3))
+        adapter = caller_adapters.get_adapter('Mykrobe')
+        expected = 'mykrobe predict sample tb  --threads 2 --panel walker-2015 --seq r1 r2 --output out.json'
+        self.assertEqual(expected, adapter.build_command('outdir', 'r1', 'r2', 'out.json', threads=2, mykrobe_species='tb', mykrobe_panel='walker-2015'))
+        expected = 'mykrobe predict sample tb  --threads 1 --panel custom --custom_probe_set_path p --custom_variant_to_resistance_json v --seq r1 r2 --output out.json'
+        self.assertEqual(expected, adapter.build_command('outdir', 'r1', 'r2', 'out.json', mykrobe_species='tb', mykrobe_custom_probe_file='p', mykrobe_custom_var_to_res='v'))
+        with self.assertRaises(Exception):
+            caller_adapters.get_adapter('ARIBA').build_command('outdir', 'r1', 'r2', 'out.json', ariba_ref='not_a_file')
+
+
+    def test_register(self):
+        '''test register'''
+        with mock.patch.dict(caller_adapters.registry):
+            caller_adapters.register(FakeAdapter)
+            self.assertIn('FakeCaller', caller_adapters.caller_names())
+            self.assertEqual((4, 2.5), caller_adapters.get_adapter('FakeCaller').resource_profile())
+
+            tmp_file = 'tmp.caller_adapters.callers.tsv'
+            with open(tmp_file, 'w') as f:
+                print('FakeCaller', '0', 'fake', '.', '.', '.', '.', '.', sep='\t', file=f)
+                print('FakeCaller', '0', 'fake.1', '.', '.', '.', '.', '.', '1', sep='\t', file=f)
+            got = run_res_callers.load_callers_file(tmp_file)
+            os.unlink(tmp_file)
+            self.assertEqual([(4, 2.5), (1, 2.5)], [(x.threads, x.ram) for x in got])
+
+        self.assertNotIn('FakeCaller', caller_adapters.caller_names())
+
+
+    def test_entry_points(self):
+        '''test adapters are loaded from entry points'''
+        entry_point = mock.Mock()
+        entry_point.load.return_value = FakeAdapter
+        with mock.patch.dict(caller_adapters.registry, clear=True), mock.patch.object(caller_adapters, '_entry_points', return_value=[entry_point]):
+            self.assertIn('FakeCaller', caller_adapters.caller_names())
+            self.assertIn('Mykrobe', caller_adapters.caller_names())
@@ -0,0 +1,330 @@
+import gzip
+import hashlib
+import http.server
+import io
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+from evalrescallers import ena_download, ten_k_reads_download
+
+
+def fake_reads(run_id, mate):
+    return gzip.compress(f'@{run_id}/{mate}\nACGT\n+\nIIII\n'.encode())
+
+
+class FakeTransport:
+    '''Writes fake reads. Runs called "flaky" fail the first time (after
+    writing some data), and runs called "bad" always fail'''
+    def __init__(self):
+        self.attempts = {}
+        self.lock = threading.Lock()
+
+    def stream(self, run_id, outdir, limits, progress, writer):
+        with self.lock:
+            self.attempts[run_id] = self.attempts.get(run_id, 0) + 1
+            attempts = self.attempts[run_id]
+        if run_id.startswith('bad'):
+            raise Exception('Fake error')
+        writer.write(1, fake_reads(run_id, 1))
+        if run_id.startswith('flaky') and attempts == 1:
+            raise Exception('Fake error')
+        writer.write(2, fake_reads(run_id, 2))
+
+
+class FakeEnaHandler(http.server.BaseHTTPRequestHandler):
+    files = {}
+    # MD5 sums to report instead of the real ones, to test mismatches
+    wrong_md5s = {}
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.startswith('/filereport'):
+            run_id = self.path.split('accession=')[1].split('&')[0]
+            host = f'127.0.0.1:{self.server.server_port}'
+            paths = [f'{host}/files/{run_id}_{i}.fastq.gz' for i in (1, 2)]
+            md5s = [self.wrong_md5s.get(f'{run_id}_{i}.fastq.gz', hashlib.md5(self.files[f'{run_id}_{i}.fastq.gz']).hexdigest()) for i in (1, 2)]
+            body = f'run_accession\tfastq_ftp\tfastq_md5\tfastq_bytes\n{run_id}\t{";".join(paths)}\t{";".join(md5s)}\t1;1\n'.encode()
+        else:
+            body = self.files[os.path.basename(self.path)]
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_fake_ena_server(files):
+    FakeEnaHandler.files = files
+    server = http.server.HTTPServer(('127.0.0.1', 0), FakeEnaHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+# Used instead of enaDataGet. Writes the files that the fake ENA server has
+# for the run, except that the reads of runs called "corrupt" are changed
+fake_ena_data_get = '''import os, sys
+outdir, run_id = sys.argv[-2], sys.argv[-1]
+os.makedirs(os.path.join(outdir, run_id))
+for mate in 1, 2:
+    with open(os.path.join(os.environ['FAKE_ENA_FILES'], f'{run_id}_{mate}.fastq.gz'), 'rb') as f:
+        data = f.read()
+    if run_id.startswith('corrupt'):
+        data = data[:-1] + bytes([data[-1] ^ 1])
+    with open(os.path.join(outdir, run_id, f'{run_id}_{mate}.fastq.gz'), 'wb') as f:
+        f.write(data)
+'''
+
+
+class TestEnaDownload(unittest.TestCase):
+    def test_token_bucket(self):
+        '''test TokenBucket'''
+        bucket = ena_download.TokenBucket(100, capacity=10)
+        start = time.monotonic()
+        for i in range(3):
+            bucket.consume(10)
+        # First 10 are free, then 20 more at 100 per second
+        self.assertGreater(time.monotonic() - start, 0.15)
+
+
+    def test_download_runs(self):
+        '''test download_runs'''
+        tmp_dir = 'tmp.ena_download.download_runs'
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.mkdir(tmp_dir)
+        jobs = [ena_download.RunJob('sample', x, os.path.join(tmp_dir, x)) for x in ('ok', 'flaky', 'bad')]
+        transport = FakeTransport()
+        writer = ena_download.SampleReadsWriter(tmp_dir)
+        done = []
+        got = ena_download.download_runs(jobs, transport, {'sample': writer}, threads=2, retries=1, backoff=0, on_run_done=lambda job, success: done.append((job.run_id, success)))
+        expected = {('sample', 'ok'): True, ('sample', 'flaky'): True, ('sample', 'bad'): False}
+        self.assertEqual(expected, got)
+        self.assertEqual({'ok': 1, 'flaky': 2, 'bad': 2}, transport.attempts)
+        self.assertEqual(sorted([('ok', True), ('flaky', True), ('bad', False)]), sorted(done))
+        self.assertEqual(['ok', 'flaky'], writer.runs)
+        md5s = writer.close()
+
+        # The failed attempt of the flaky run should have been removed
+        for mate in 1, 2:
+            filename = os.path.join(tmp_dir, f'reads_{mate}.fastq.gz')
+            with open(filename, 'rb') as f:
+                data = f.read()
+            self.assertEqual(hashlib.md5(data).hexdigest(), md5s[f'reads_{mate}.fastq.gz'])
+            with gzip.open(filename, 'rt') as f:
+                got_names = sorted(x.rstrip() for x in f if x.startswith('@'))
+            self.assertEqual([f'@flaky/{mate}', f'@ok/{mate}'], got_names)
+
+        # Rerunning should not download the finished runs again, and they
+        # should be kept in the reads files. Partial data written after the
+        # last finished run (eg by a crash) should be removed
+        with open(os.path.join(tmp_dir, 'reads_1.fastq.gz'), 'ab') as f:
+            f.write(b'partial run')
+        transport = FakeTransport()
+        writer = ena_download.SampleReadsWriter(tmp_dir)
+        got = ena_download.download_runs(jobs, transport, {'sample': writer}, threads=2, retries=1, backoff=0)
+        self.assertEqual(expected, got)
+        self.assertEqual({'bad': 2}, transport.attempts)
+        self.assertEqual(md5s, writer.close())
+        with gzip.open(os.path.join(tmp_dir, 'reads_1.fastq.gz'), 'rt') as f:
+            self.assertEqual(['@flaky/1', '@ok/1'], sorted(x.rstrip() for x in f if x.startswith('@')))
+        shutil.rmtree(tmp_dir)
+
+
+    def test_sample_reads_writer_start_run_fails(self):
+        '''test SampleReadsWriter start_run when the files cannot be opened'''
+        tmp_dir = 'tmp.ena_download.start_run_fails'
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        writer = ena_download.SampleReadsWriter(tmp_dir)
+        with self.assertRaises(OSError):
+            writer.start_run('run1')
+        # The writer is not left locked, so later runs do not wait forever
+        self.assertTrue(writer.lock.acquire(blocking=False))
+        writer.lock.release()
+
+        # download_one_run counts it as a failed attempt
+        job = ena_download.RunJob('sample', 'run1', os.path.join(tmp_dir, 'run1'))
+        progress = ena_download.Progress(1, outfile=io.StringIO())
+        self.assertFalse(ena_download.download_one_run(job, FakeTransport(), ena_download.HostLimits(), progress, writer, retries=1, backoff=0))
+
+        os.mkdir(tmp_dir)
+        self.assertTrue(ena_download.download_one_run(job, FakeTransport(), ena_download.HostLimits(), progress, writer, retries=0))
+        writer.close()
+        shutil.rmtree(tmp_dir)
+
+
+    def test_download_runs_one_run_per_sample_at_once(self):
+        '''test download_runs does not download two runs of a sample at the same time'''
+        tmp_dir = 'tmp.ena_download.download_runs_one_run_per_sample_at_once'
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.mkdir(tmp_dir)
+        running = {}
+        max_running = {}
+        lock = threading.Lock()
+
+        class SlowTransport:
+            def stream(self, run_id, outdir, limits, progress, writer):
+                sample = run_id.split('_')[0]
+                with lock:
+                    running[sample] = running.get(sample, 0) + 1
+                    max_running[sample] = max(max_running.get(sample, 0), running[sample])
+                time.sleep(0.02)
+                writer.write(1, fake_reads(run_id, 1))
+                writer.write(2, fake_reads(run_id, 2))
+                with lock:
+                    running[sample] -= 1
+
+        jobs = []
+        writers = {}
+        for sample in 's1', 's2':
+            os.mkdir(os.path.join(tmp_dir, sample))
+            writers[sample] = ena_download.SampleReadsWriter(os.path.join(tmp_dir, sample))
+            jobs.extend(ena_download.RunJob(sample, f'{sample}_{i}', os.path.join(tmp_dir, sample, str(i))) for i in range(4))
+        got = ena_download.download_runs(jobs, SlowTransport(), writers, threads=4)
+        self.assertTrue(all(got.values()))
+        self.assertEqual({'s1': 1, 's2': 1}, max_running)
+        for sample, writer in writers.items():
+            self.assertEqual([f'{sample}_{i}' for i in range(4)], writer.runs)
+            writer.close()
+        shutil.rmtree(tmp_dir)
+
+
+    def test_download_sample(self):
+        '''test download_sample'''
+        tmp_dir = 'tmp.ena_download.download_sample'
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        self.assertTrue(ten_k_reads_download.download_sample(tmp_dir, 'run1.run2', ['run1', 'run2'], transport=FakeTransport()))
+        self.assertEqual(['manifest.json', 'reads.md5', 'reads_1.fastq.gz', 'reads_2.fastq.gz', 'success'], sorted(os.listdir(tmp_dir)))
+        with gzip.open(os.path.join(tmp_dir, 'reads_1.fastq.gz'), 'rt') as f:
+            self.assertEqual(['@run1/1', '@run2/1'], [x.rstrip() for x in f if x.startswith('@')])
+        with open(os.path.join(tmp_dir, 'reads_2.fastq.gz'), 'rb') as f:
+            md5 = hashlib.md5(f.read()).hexdigest()
+        with open(os.path.join(tmp_dir, 'reads.md5')) as f:
+            self.assertIn(f'{md5}  reads_2.fastq.gz\n', f.read())
+        shutil.rmtree(tmp_dir)
+
+        self.assertFalse(ten_k_reads_download.download_sample(tmp_dir, 'run1.bad1', ['run1', 'bad1'], transport=FakeTransport(), retries=0))
+        self.assertTrue(os.path.exists(os.path.join(tmp_dir, 'fail')))
+        self.assertFalse(os.path.exists(os.path.join(tmp_dir, 'reads_1.fastq.gz')))
+        shutil.rmtree(tmp_dir)
+
+        # Finished runs of an unfinished sample are kept when it is restarted
+        os.mkdir(tmp_dir)
+        writer = ena_download.SampleReadsWriter(tmp_dir)
+        ena_download.download_runs([ena_download.RunJob('sample', 'run1', os.path.join(tmp_dir, 'run1'))], FakeTransport(), {'sample': writer})
+        writer.close()
+        transport = FakeTransport()
+        self.assertTrue(ten_k_reads_download.download_sample(tmp_dir, 'run1.run2', ['run1', 'run2'], transport=transport))
+        self.assertEqual({'run2': 1}, transport.attempts)
+        self.assertEqual(['manifest.json', 'reads.md5', 'reads_1.fastq.gz', 'reads_2.fastq.gz', 'success'], sorted(os.listdir(tmp_dir)))
+        with gzip.open(os.path.join(tmp_dir, 'reads_1.fastq.gz'), 'rt') as f:
+            self.assertEqual(['@run1/1', '@run2/1'], [x.rstrip() for x in f if x.startswith('@')])
+        shutil.rmtree(tmp_dir)
+
+
+    def test_http_transport(self):
+        '''test HttpTransport'''
+        files = {}
+        for i in 1, 2:
+            buf = io.BytesIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+                f.write(f'@read\nACGT\n+\nIIII\n'.encode() * i)
+            files[f'run1_{i}.fastq.gz'] = buf.getvalue()
+        server = start_fake_ena_server(files)
+
+        tmp_dir = 'tmp.ena_download.http_transport'
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        transport = ena_download.HttpTransport(portal_url=f'http://127.0.0.1:{server.server_port}/filereport', scheme='http')
+        limits = ena_download.HostLimits(requests_per_second=100, bytes_per_second=1_000_000)
+        job = ena_download.RunJob('run1', 'run1', os.path.join(tmp_dir, 'run1'))
+        os.mkdir(tmp_dir)
+        writer = ena_download.SampleReadsWriter(tmp_dir)
+        got = ena_download.download_runs([job], transport, {'run1': writer}, limits=limits, retries=0)
+        writer.close()
+        self.assertEqual({('run1', 'run1'): True}, got)
+        for mate in 1, 2:
+            with open(os.path.join(tmp_dir, f'reads_{mate}.fastq.gz'), 'rb') as f:
+                self.assertEqual(files[f'run1_{mate}.fastq.gz'], f.read())
+        self.assertEqual({x: hashlib.md5(files[x]).hexdigest() for x in files}, writer.checked_md5s)
+        shutil.rmtree(tmp_dir)
+
+        # Data that does not match the MD5 from the ENA is not kept
+        os.mkdir(tmp_dir)
+        with mock.patch.object(FakeEnaHandler, 'wrong_md5s', {'run1_2.fastq.gz': 'x'}):
+            writer = ena_download.SampleReadsWriter(tmp_dir)
+            got = ena_download.download_runs([job], transport, {'run1': writer}, limits=limits, retries=0)
+        writer.close()
+        self.assertEqual({('run1', 'run1'): False}, got)
+        self.assertEqual(0, os.path.getsize(os.path.join(tmp_dir, 'reads_2.fastq.gz')))
+        self.assertEqual({}, writer.checked_md5s)
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(tmp_dir)
+
+
+    def test_ena_data_get_transport(self):
+        '''test EnaDataGetTransport'''
+        tmp_dir = os.path.abspath('tmp.ena_download.ena_data_get_transport')
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        files_dir = os.path.join(tmp_dir, 'ena_files')
+        bin_dir = os.path.join(tmp_dir, 'bin')
+        os.makedirs(files_dir)
+        os.mkdir(bin_dir)
+        files = {f'{run_id}_{mate}.fastq.gz': fake_reads(run_id, mate) for run_id in ('run1', 'corrupt1') for mate in (1, 2)}
+        for filename, data in files.items():
+            with open(os.path.join(files_dir, filename), 'wb') as f:
+                f.write(data)
+        script = os.path.join(bin_dir, 'enaDataGet')
+        with open(script, 'w') as f:
+            print(f'#!{sys.executable}', fake_ena_data_get, sep='\n', file=f)
+        os.chmod(script, 0o755)
+        server = start_fake_ena_server(files)
+        transport = ena_download.EnaDataGetTransport(portal_url=f'http://127.0.0.1:{server.server_port}/filereport')
+        jobs = [ena_download.RunJob(x, x, os.path.join(tmp_dir, x, 'download')) for x in ('run1', 'corrupt1')]
+        writers = {}
+        for job in jobs:
+            os.mkdir(os.path.join(tmp_dir, job.sample))
+            writers[job.sample] = ena_download.SampleReadsWriter(os.path.join(tmp_dir, job.sample))
+
+        env = {'PATH': bin_dir + os.pathsep + os.environ['PATH'], 'FAKE_ENA_FILES': files_dir}
+        with mock.patch.dict(os.environ, env):
+            got = ena_download.download_runs(jobs, transport, writers, retries=0)
+
+            # The bytes are counted for the progress and the bandwidth limit
+            progress = ena_download.Progress(1, outfile=io.StringIO())
+            limits = mock.Mock()
+            os.mkdir(os.path.join(tmp_dir, 'count'))
+            writer = ena_download.SampleReadsWriter(os.path.join(tmp_dir, 'count'))
+            writer.start_run('run1')
+            transport.stream('run1', os.path.join(tmp_dir, 'count', 'download'), limits, progress, writer)
+            writer.end_run(True)
+            writer.close()
+        run1_bytes = sum(len(files[f'run1_{i}.fastq.gz']) for i in (1, 2))
+        self.assertEqual(run1_bytes, progress.bytes)
+        self.assertEqual(run1_bytes, sum(x.args[1] for x in limits.transfer.call_args_list))
+        self.assertEqual({'127.0.0.1'}, {x.args[0] for x in limits.transfer.call_args_list})
+        server.shutdown()
+        server.server_close()
+        self.assertEqual({('run1', 'run1'): True, ('corrupt1', 'corrupt1'): False}, got)
+        self.assertEqual({f'run1_{i}.fastq.gz': hashlib.md5(files[f'run1_{i}.fastq.gz']).hexdigest() for i in (1, 2)}, writers['run1'].checked_md5s)
+        self.assertEqual(['@run1/1'], [x.rstrip() for x in gzip.open(os.path.join(tmp_dir, 'run1', 'reads_1.fastq.gz'), 'rt') if x.startswith('@')])
+        self.assertEqual(0, os.path.getsize(os.path.join(tmp_dir, 'corrupt1', 'reads_1.fastq.gz')))
+
+        # The MD5 sums checked against the ENA go in the sample manifest
+        self.assertTrue(ten_k_reads_download.finish_sample(os.path.join(tmp_dir, 'run1'), {'run1': True}, writers['run1']))
+        with open(os.path.join(tmp_dir, 'run1', 'manifest.json')) as f:
+            self.assertEqual(writers['run1'].checked_md5s, json.load(f)['ena_md5s'])
+        writers['corrupt1'].close()
+        shutil.rmtree(tmp_dir)
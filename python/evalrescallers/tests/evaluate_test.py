@@ -0,0 +1,133 @@
+import os
+import unittest
+
+import numpy as np
+
+from evalrescallers import evaluate, summary_db
+
+
+class TestEvaluate(unittest.TestCase):
+    def test_phenotypes_dataframe(self):
+        '''test phenotypes_dataframe'''
+        phenos = {
+            's1': {'Isoniazid': 'R', 'Rifampicin': 'S', 'Ethambutol': 'n/a'},
+            's2': {'Isoniazid': 'S', 'Rifampicin': 'U'},
+        }
+        got = evaluate.phenotypes_dataframe(phenos, split='test', sample_to_country={'s1': 'UK'})
+        self.assertEqual(['s1', 's1', 's2'], list(got['sample']))
+        self.assertEqual(['Isoniazid', 'Rifampicin', 'Isoniazid'], list(got['drug']))
+        self.assertEqual(['R', 'S', 'S'], list(got['pheno']))
+        self.assertEqual(['test'] * 3, list(got['split']))
+        self.assertEqual(['UK', 'UK'], list(got['country'][:2]))
+        self.assertTrue(got['country'].isna()[2])
+
+
+    def test_calls_dataframe(self):
+        '''test calls_dataframe'''
+        rows = [
+            ('s1', 'c1', 'Isoniazid', 'R', 1),
+            ('s1', 'c1', 'Isoniazid', 'R', 1),
+            ('s1', 'c2', 'Isoniazid', 'r', 1),
+            ('s1', 'c2', 'Rifampicin', 'S', 1),
+            ('s2', 'c1', None, None, 1),
+            ('s2', 'c2', None, None, 0),
+        ]
+        got = evaluate.calls_dataframe(rows, {'Isoniazid', 'Rifampicin'})
+        got = sorted(zip(got['sample'], got['caller'], got['drug'], got['pred']))
+        expect = [
+            ('s1', 'c1', 'Isoniazid', 'R'),
+            ('s1', 'c1', 'Rifampicin', 'S'),
+            ('s1', 'c2', 'Isoniazid', 'R'),
+            ('s1', 'c2', 'Rifampicin', 'S'),
+            ('s2', 'c1', 'Isoniazid', 'S'),
+            ('s2', 'c1', 'Rifampicin', 'S'),
+        ]
+        self.assertEqual(expect, got)
+
+
+    def test_calls_dataframe_from_summary_and_sqlite(self):
+        '''test calls_dataframe_from_summary and calls_dataframe_from_sqlite'''
+        summary = {
+            's1': {'c1': {'Success': True, 'resistance_calls': {'Isoniazid': [['R', 'katG', 'S315T', None]]}, 'time_and_memory': {}}},
+            's2': {'c1': {'Success': False}},
+        }
+        got = evaluate.calls_dataframe_from_summary(summary, {'Isoniazid', 'Rifampicin'})
+        expect = [('s1', 'c1', 'Isoniazid', 'R'), ('s1', 'c1', 'Rifampicin', 'S')]
+        self.assertEqual(expect, sorted(zip(got['sample'], got['caller'], got['drug'], got['pred'])))
+
+        tmp_db = 'tmp.evaluate.sqlite'
+        db = summary_db.SummaryDb(tmp_db)
+        for sample, data in summary.items():
+            db.add_sample(sample, data)
+        db.close()
+        got = evaluate.calls_dataframe_from_sqlite(tmp_db, {'Isoniazid', 'Rifampicin'})
+        self.assertEqual(expect, sorted(zip(got['sample'], got['caller'], got['drug'], got['pred'])))
+        os.unlink(tmp_db)
+
+
+    def test_calls_dataframe_to_matrices(self):
+        '''test calls_dataframe_to_matrices'''
+        rows = [
+            ('s1', 'c1', 'Isoniazid', 'R', 1),
+            ('s2', 'c1', None, None, 1),
+            ('s3', 'c1', 'Rifampicin', 'R', 1),
+            ('s1', 'c2', 'Rifampicin', 'R', 1),
+        ]
+        calls_df = evaluate.calls_dataframe(rows, {'Isoniazid', 'Rifampicin'})
+        got = evaluate.calls_dataframe_to_matrices(calls_df, ['s1', 's2', 's3'], ['Rifampicin', 'Isoniazid'])
+        self.assertEqual({'c1', 'c2'}, set(got))
+        self.assertEqual([[0, 1], [0, 0], [1, 0]], got['c1'].tolist())
+        self.assertEqual([[1, 0], [-1, -1], [-1, -1]], got['c2'].tolist())
+
+
+    def test_confusion_matrices(self):
+        '''test confusion_matrices'''
+        phenos = {
+            's1': {'Isoniazid': 'R', 'Rifampicin': 'S'},
+            's2': {'Isoniazid': 'S', 'Rifampicin': 'R'},
+            's3': {'Isoniazid': 'R', 'Rifampicin': 'R'},
+        }
+        pheno_df = evaluate.phenotypes_dataframe(phenos, split='validate', sample_to_country={'s1': 'UK', 's2': 'UK', 's3': 'Italy'})
+        rows = [
+            ('s1', 'c1', 'Isoniazid', 'R', 1),
+            ('s2', 'c1', 'Isoniazid', 'R', 1),
+            ('s3', 'c1', 'Rifampicin', 'R', 1),
+            ('s1', 'c2', 'Isoniazid', 'R', 1),
+            ('s2', 'c2', None, None, 1),
+        ]
+        calls_df = evaluate.calls_dataframe(rows, {'Isoniazid', 'Rifampicin'})
+        got = evaluate.confusion_matrices(pheno_df, calls_df, group_by=['caller', 'drug'])
+        got = {(x.caller, x.drug): (x.TP, x.FP, x.TN, x.FN) for x in got.itertuples()}
+        expect = {
+            ('c1', 'Isoniazid'): (1, 1, 0, 1),
+            ('c1', 'Rifampicin'): (1, 0, 1, 1),
+            ('c2', 'Isoniazid'): (1, 0, 1, 0),
+            ('c2', 'Rifampicin'): (0, 0, 1, 1),
+        }
+        self.assertEqual(expect, got)
+
+        got = evaluate.confusion_matrices(pheno_df, calls_df)
+        self.assertEqual(['caller', 'drug', 'split', 'country', 'TP', 'FP', 'TN', 'FN', 'sensitivity', 'specificity', 'PPV', 'NPV'], list(got.columns))
+        row = got[(got['caller'] == 'c1') & (got['drug'] == 'Isoniazid') & (got['country'] == 'UK')].iloc[0]
+        self.assertEqual((1, 1, 0, 0), (row.TP, row.FP, row.TN, row.FN))
+        self.assertEqual(1, row.sensitivity)
+        self.assertEqual(0.5, row.PPV)
+        self.assertEqual(0, row.specificity)
+        self.assertTrue(np.isnan(row.NPV))
+
+
+    def test_bootstrap_confidence_intervals(self):
+        '''test bootstrap_confidence_intervals'''
+        phenos = {f's{i}': {'Isoniazid': 'R' if i < 50 else 'S'} for i in range(100)}
+        pheno_df = evaluate.phenotypes_dataframe(phenos)
+        rows = [(f's{i}', 'c1', 'Isoniazid', 'R' if i < 40 or i >= 95 else 'S', 1) for i in range(100)]
+        calls_df = evaluate.calls_dataframe(rows, {'Isoniazid'})
+        confusion = evaluate.confusion_matrices(pheno_df, calls_df, group_by=['caller', 'drug'])
+        got = evaluate.bootstrap_confidence_intervals(confusion, samples=200, seed=42)
+        row = got.iloc[0]
+        self.assertEqual(0.8, row.sensitivity)
+        self.assertLess(row.sensitivity_low, 0.8)
+        self.assertGreater(row.sensitivity_high, 0.8)
+        self.assertLess(row.specificity_low, 0.9)
+        self.assertGreater(row.specificity_high, 0.9)
+        self.assertEqual(list(got['sensitivity_low']), list(evaluate.bootstrap_confidence_intervals(confusion, samples=200, seed=42)['sensitivity_low']))
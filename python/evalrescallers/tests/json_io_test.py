@@ -0,0 +1,65 @@
+import json
+import os
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from evalrescallers import json_io
+
+
+class TestJsonIo(unittest.TestCase):
+    def test_dumps(self):
+        '''test dumps'''
+        data = {'b': [1, 2.5, None, ('x', 'y')], 'a': {'d': True, 'c': 'é'}}
+        expected = '{"a":{"c":"é","d":true},"b":[1,2.5,null,["x","y"]]}'
+        self.assertEqual(expected, json_io.dumps(data))
+        with mock.patch.object(json_io, 'orjson', None):
+            self.assertEqual(expected, json_io.dumps(data))
+        self.assertEqual(json.dumps(data, sort_keys=True, indent=4), json_io.dumps(data, pretty=True))
+        self.assertEqual('{"x":1.5}', json_io.dumps({'x': np.float64(1.5)}))
+
+
+    def test_write_and_load(self):
+        '''test write and load'''
+        tmp_file = 'tmp.json_io.write_and_load.json'
+        data = {'a': [1, {'b': 'c'}]}
+        json_io.write(data, tmp_file)
+        self.assertEqual(data, json_io.load(tmp_file))
+        json_io.write(data, tmp_file, pretty=True)
+        with open(tmp_file) as f:
+            self.assertEqual(json.dumps(data, sort_keys=True, indent=4) + '\n', f.read())
+        self.assertEqual(data, json_io.load(tmp_file))
+
+        # Non-ASCII is not escaped without orjson either, so the file
+        # must be UTF-8 whatever the locale
+        with mock.patch.object(json_io, 'orjson', None):
+            json_io.write({'c': 'é'}, tmp_file)
+        with open(tmp_file, 'rb') as f:
+            self.assertEqual('{"c":"é"}\n'.encode('utf-8'), f.read())
+        self.assertEqual({'c': 'é'}, json_io.load(tmp_file))
+        os.unlink(tmp_file)
+
+
+    def test_load_selected(self):
+        '''test load_selected'''
+        tmp_file = 'tmp.json_io.load_selected.json'
+        data = {
+            'sample.1': {'susceptibility': {'Isoniazid': {'predict': 'R'}}, 'kmer': 21},
+            'list': [{'susceptibility': 'not selected'}],
+            'analyses': {'MTBC/resistance': ['a', 'b'], 'other': 1},
+        }
+        with open(tmp_file, 'w') as f:
+            json.dump(data, f)
+
+        tests = [
+            ([('*', 'susceptibility')], {'sample.1': {'susceptibility': {'Isoniazid': {'predict': 'R'}}}}),
+            ([('analyses', 'MTBC/resistance')], {'analyses': {'MTBC/resistance': ['a', 'b']}}),
+            ([('sample.1', 'kmer'), ('list',)], {'sample.1': {'kmer': 21}, 'list': [{'susceptibility': 'not selected'}]}),
+            ([('not_there',)], {}),
+        ]
+        for paths, expected in tests:
+            self.assertEqual(expected, json_io.load_selected(tmp_file, paths))
+            with mock.patch.object(json_io, 'ijson', None):
+                self.assertEqual(expected, json_io.load_selected(tmp_file, paths))
+        os.unlink(tmp_file)
@@ -0,0 +1,127 @@
+import collections
+import json
+import os
+import shutil
+import unittest
+from unittest import mock
+
+from evalrescallers import local_pipeline, run_res_callers
+
+modules_dir = os.path.dirname(os.path.abspath(local_pipeline.__file__))
+data_dir = os.path.join(modules_dir, 'tests', 'data', 'run_res_callers')
+
+
+def fake_run_one_caller(caller, caller_outdir, *args):
+    # Fails the first time for callers called "flaky", and always for "fail"
+    os.mkdir(caller_outdir)
+    attempts_file = caller_outdir + '.attempts'
+    with open(attempts_file, 'a') as f:
+        print('x', file=f)
+    with open(attempts_file) as f:
+        attempts = len(f.readlines())
+    if caller.outdir_name == 'fail' or (caller.outdir_name == 'flaky' and attempts == 1):
+        return False
+    with open(os.path.join(caller_outdir, 'done'), 'w'):
+        pass
+    return True
+
+
+class TestLocalPipeline(unittest.TestCase):
+    def test_tasks_that_fit(self):
+        '''test tasks_that_fit'''
+        Task = local_pipeline.Task
+        t1 = Task('s1', 'c1', None, 1, 1.0)
+        t2 = Task('s1', 'c2', None, 4, 8.0)
+        t3 = Task('s2', 'c1', None, 2, None)
+        t4 = Task('s2', 'c2', None, 8, 20.0)
+        pending = collections.deque([t1, t2, t3])
+        self.assertEqual([0, 1, 2], local_pipeline.tasks_that_fit(pending, 8, None, False))
+        self.assertEqual([0, 1], local_pipeline.tasks_that_fit(pending, 5, None, False))
+        self.assertEqual([0, 2], local_pipeline.tasks_that_fit(pending, 5, 5.0, False))
+        self.assertEqual([], local_pipeline.tasks_that_fit(pending, 0, None, True))
+        # Too big for the budget, but still runs if nothing else is running
+        self.assertEqual([], local_pipeline.tasks_that_fit(collections.deque([t4]), 4, 10.0, True))
+        self.assertEqual([0], local_pipeline.tasks_that_fit(collections.deque([t4]), 4, 10.0, False))
+        self.assertEqual([], local_pipeline.tasks_that_fit(collections.deque(), 4, 10.0, False))
+
+
+    def test_run_tasks(self):
+        '''test run_tasks'''
+        tmp_dir = 'tmp.local_pipeline.run_tasks'
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.mkdir(tmp_dir)
+        tasks = []
+        for sample in 's1', 's2':
+            for name, threads in ('ok', 1), ('flaky', 2), ('fail', 1):
+                caller = run_res_callers.Caller('KvarQ', False, name, None, None, None, None, None, threads, None)
+                caller_outdir = os.path.join(tmp_dir, f'{sample}.{name}')
+                tasks.append(local_pipeline.Task(sample, caller, (caller, caller_outdir), threads, None))
+
+        got_done = []
+        fails = local_pipeline.run_tasks(tasks, 2, retries=1, run_function=fake_run_one_caller,
+            on_task_done=lambda task, success: got_done.append((task.sample, task.caller.outdir_name, success)))
+        self.assertEqual(2, fails)
+        expected_done = [(s, n, n != 'fail') for s in ('s1', 's2') for n in ('ok', 'flaky', 'fail')]
+        self.assertEqual(sorted(expected_done), sorted(got_done))
+        for sample in 's1', 's2':
+            self.assertTrue(os.path.exists(os.path.join(tmp_dir, f'{sample}.flaky', 'done')))
+            self.assertFalse(os.path.exists(os.path.join(tmp_dir, f'{sample}.fail', 'done')))
+            for name, expected_attempts in ('ok', 1), ('flaky', 2), ('fail', 2):
+                with open(os.path.join(tmp_dir, f'{sample}.{name}.attempts')) as f:
+                    self.assertEqual(expected_attempts, len(f.readlines()))
+        shutil.rmtree(tmp_dir)
+
+
+    def test_run_pipeline(self):
+        '''test run_pipeline'''
+        tmp_dir = 'tmp.local_pipeline.run_pipeline'
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        reads1 = os.path.join(data_dir, 'run_res_callers.reads1')
+        reads2 = os.path.join(data_dir, 'run_res_callers.reads2')
+        data_tsv = 'tmp.local_pipeline.run_pipeline.tsv'
+        with open(data_tsv, 'w') as f:
+            for sample in 'sample1', 'sample2':
+                print(sample, reads1, reads2, sep='\t', file=f)
+        callers_file = os.path.join(data_dir, 'run_res_callers.callers.tsv')
+        fails = local_pipeline.run_pipeline(data_tsv, callers_file, tmp_dir, threads=2, testing=True)
+        self.assertEqual(0, fails)
+        with open(os.path.join(tmp_dir, 'summary.json')) as f:
+            summary = json.load(f)
+        self.assertEqual({'sample1', 'sample2'}, set(summary))
+        for sample_data in summary.values():
+            self.assertEqual({'outdir1', 'outdir2', 'outdir3'}, set(sample_data))
+            self.assertTrue(all(x['Success'] for x in sample_data.values()))
+        self.assertTrue(os.path.exists(os.path.join(tmp_dir, 'summary.sqlite')))
+        self.assertTrue(os.path.exists(os.path.join(tmp_dir, 'caller_output', '0', '0', 'outdir1', 'done')))
+
+        # Resuming with no new data should not rerun anything that is done
+        done_file = os.path.join(tmp_dir, 'caller_output', '0', '0', 'outdir3', 'done')
+        mtime = os.stat(done_file).st_mtime_ns
+        local_pipeline.run_pipeline(data_tsv, callers_file, tmp_dir, no_new_data=True, testing=True)
+        self.assertEqual(mtime, os.stat(done_file).st_mtime_ns)
+        shutil.rmtree(tmp_dir)
+        os.unlink(data_tsv)
+
+
+    def test_run_pipeline_new_output_dir(self):
+        '''test run_pipeline sets up a new output directory'''
+        tmp_dir = 'tmp.local_pipeline.run_pipeline_new_output_dir'
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        data_tsv = 'tmp.local_pipeline.run_pipeline_new_output_dir.tsv'
+        with open(data_tsv, 'w') as f:
+            print('sample1', os.path.join(data_dir, 'run_res_callers.reads1'), os.path.join(data_dir, 'run_res_callers.reads2'), sep='\t', file=f)
+        callers_file = os.path.join(data_dir, 'run_res_callers.callers.tsv')
+
+        def fake_run_tasks(tasks, *args, **kwargs):
+            self.assertEqual(['sample1'] * 3, [x.sample for x in tasks])
+            return 0
+
+        with mock.patch.object(local_pipeline, 'run_tasks', side_effect=fake_run_tasks):
+            self.assertEqual(0, local_pipeline.run_pipeline(data_tsv, callers_file, tmp_dir, testing=True))
+        self.assertTrue(os.path.isdir(os.path.join(tmp_dir, 'caller_output', '0', '0')))
+        self.assertTrue(os.path.exists(os.path.join(tmp_dir, 'summary.json')))
+        shutil.rmtree(tmp_dir)
+        os.unlink(data_tsv)
@@ -3,8 +3,9 @@ import json
 import os
 import shutil
 import unittest
+from unittest import mock
 
-from evalrescallers import mykrobe_pub_data
+from evalrescallers import mykrobe_pub_data, truth_data_cache
 
 modules_dir = os.path.dirname(os.path.abspath(mykrobe_pub_data.__file__))
 data_dir = os.path.join(modules_dir, 'tests', 'data', 'mykrobe_pub_data')
@@ -80,3 +81,25 @@ class TestMykrobePubData(unittest.TestCase):
         self.assertEqual(expect_drugs, got_drugs)
         self.assertEqual(got_sample_to_res, expect_sample_to_res)
         self.assertEqual({}, got_sample_to_country)
+
+
+    def test_load_all_nature_suppl_matrices(self):
+        '''test load_all_nature_suppl_matrices'''
+        tmp_cache = os.path.abspath('tmp.load_all_nature_suppl_matrices.cache')
+        to_int = {'R': truth_data_cache.RESISTANT, 'S': truth_data_cache.SUSCEPTIBLE}
+
+        for species in 'staph', 'tb':
+            drugs, sample_to_res, sample_to_country = mykrobe_pub_data.load_all_nature_suppl_files(species)
+            with mock.patch.dict(os.environ, {'EVALRESCALLERS_CACHE_DIR': tmp_cache}):
+                mykrobe_pub_data.load_all_nature_suppl_matrices.cache_clear()
+                got = mykrobe_pub_data.load_all_nature_suppl_matrices(species)
+                mykrobe_pub_data.load_all_nature_suppl_matrices.cache_clear()
+
+            self.assertEqual(sorted(drugs), got.drugs.tolist())
+            self.assertEqual(sorted(sample_to_res), got.samples.tolist())
+            for i, sample in enumerate(got.samples):
+                self.assertEqual(sample_to_country.get(sample, ''), got.country[i])
+                for j, drug in enumerate(got.drugs):
+                    self.assertEqual(to_int.get(sample_to_res[sample].get(drug), truth_data_cache.MISSING), got.pheno[i, j])
+
+        shutil.rmtree(tmp_cache)
@@ -3,8 +3,9 @@ import json
 import os
 import shutil
 import unittest
+from unittest import mock
 
-from evalrescallers import pipeline_output_dir
+from evalrescallers import json_io, pipeline_output_dir, run_res_callers, sample_index, summary_db
 
 modules_dir = os.path.dirname(os.path.abspath(pipeline_output_dir.__file__))
 data_dir = os.path.join(modules_dir, 'tests', 'data', 'pipeline_output_dir')
@@ -40,6 +41,65 @@ class TestOtherFunctions(unittest.TestCase):
         self.assertEqual(expect, got_dict)
 
 
+    def test_load_one_sample_summary_json_file_incremental(self):
+        '''test load_one_sample_summary_json_file_incremental'''
+        tmp_dir = 'tmp.load_one_sample_summary_json_file_incremental'
+        os.mkdir(tmp_dir)
+        json_file = os.path.abspath(os.path.join(tmp_dir, 'summary.json'))
+        self.assertEqual(('sample', None, None, False), pipeline_output_dir.load_one_sample_summary_json_file_incremental(('sample', json_file, None, None)))
+
+        with open(json_file, 'w') as f:
+            json.dump({'x': 1}, f)
+        got_sample, got_data, got_entry, got_parsed = pipeline_output_dir.load_one_sample_summary_json_file_incremental(('sample', json_file, None, None))
+        self.assertEqual(('sample', {'x': 1}, True), (got_sample, got_data, got_parsed))
+        self.assertEqual(json_file, got_entry['path'])
+        self.assertEqual(8, got_entry['size'])
+
+        # Put different data in the shard, so we know the shard was used
+        # instead of the JSON file
+        writer = pipeline_output_dir.ShardWriter(os.path.join(tmp_dir, 'shards'))
+        writer.write_line(0, 'foo')
+        offset, length = writer.write_line(0, json.dumps({'sample': 'sample', 'summary': {'x': 2}}))
+        writer.close()
+        got_entry.update({'shard': 0, 'offset': offset, 'length': length})
+        data_tuple = ('sample', json_file, got_entry, os.path.join(tmp_dir, 'shards'))
+        self.assertEqual({'x': 2}, pipeline_output_dir.load_one_sample_summary_json_file_incremental(data_tuple)[1])
+
+        # Changed mtime but same contents: still use the shard
+        got_entry['mtime_ns'] -= 1
+        self.assertEqual({'x': 2}, pipeline_output_dir.load_one_sample_summary_json_file_incremental(data_tuple)[1])
+
+        # Offset, length or sample in the manifest not matching the shard
+        # (eg shard rewritten after a crash): use the JSON file
+        for key, value in ('offset', offset - 1), ('offset', offset + 1), ('length', length - 1), ('length', length + 5), ('offset', 0):
+            bad_entry = dict(got_entry)
+            bad_entry[key] = value
+            self.assertEqual({'x': 1}, pipeline_output_dir.load_one_sample_summary_json_file_incremental(('sample', json_file, bad_entry, os.path.join(tmp_dir, 'shards')))[1])
+        self.assertEqual({'x': 1}, pipeline_output_dir.load_one_sample_summary_json_file_incremental(('sample', json_file, got_entry, os.path.join(tmp_dir, 'no_shards')))[1])
+        self.assertEqual({'x': 1}, pipeline_output_dir.load_one_sample_summary_json_file_incremental(('other_sample', json_file, got_entry, os.path.join(tmp_dir, 'shards')))[1])
+
+        # Changed contents: use the JSON file
+        with open(json_file, 'w') as f:
+            json.dump({'x': 3}, f)
+        self.assertEqual({'x': 3}, pipeline_output_dir.load_one_sample_summary_json_file_incremental(data_tuple)[1])
+        shutil.rmtree(tmp_dir)
+
+
+    def test_shard_writer(self):
+        '''test ShardWriter'''
+        tmp_dir = 'tmp.shard_writer'
+        writer = pipeline_output_dir.ShardWriter(tmp_dir, max_open=2)
+        lines = [(0, 'a'), (1, 'b'), (2, 'c'), (0, 'd'), (3, 'e'), (1, 'f')]
+        for bucket, line in lines:
+            writer.write_line(bucket, line)
+        writer.close()
+        self.assertEqual(['0.jsonl', '1.jsonl', '2.jsonl', '3.jsonl'], sorted(os.listdir(tmp_dir)))
+        for bucket, expect in [(0, 'a\nd\n'), (1, 'b\nf\n'), (2, 'c\n'), (3, 'e\n')]:
+            with open(os.path.join(tmp_dir, f'{bucket}.jsonl')) as f:
+                self.assertEqual(expect, f.read())
+        shutil.rmtree(tmp_dir)
+
+
 class TestPipelineOutputDir(unittest.TestCase):
     def test_init(self):
         '''test init'''
@@ -110,6 +170,112 @@ class TestPipelineOutputDir(unittest.TestCase):
         shutil.rmtree(tmp_dir)
 
 
+    def test_iter_add_data_from_file(self):
+        '''test iter_add_data_from_file'''
+        tmp_dir = 'tmp.pipeline_output_dir.iter_add_data_from_file'
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        tmp_data_file = 'tmp.pipeline_output_dir.iter_add_data_from_file.tsv'
+        with open(tmp_data_file, 'w') as f:
+            for i in range(7):
+                print(f's{i}', f'r{i}_1.fq.gz', f'r{i}_2.fq.gz', file=f)
+        tmp_tsv = 'tmp.pipeline_output_dir.iter_add_data_from_file.jobs.tsv'
+        pipe_dir = pipeline_output_dir.PipelineOutputDir(tmp_dir, samples_per_dir=3)
+
+        got_samples = []
+        with pipeline_output_dir.JobsTsvWriter(tmp_tsv) as writer:
+            for d in pipe_dir.iter_add_data_from_file(tmp_data_file, threads=2):
+                self.assertTrue(os.path.isdir(os.path.join(tmp_dir, d['dir'])))
+                writer.add(d)
+                # Lines are flushed, so can be read before all samples are done
+                with open(tmp_tsv) as f:
+                    self.assertEqual(len(got_samples) + 2, len(f.readlines()))
+                got_samples.append(d['name'])
+
+        self.assertEqual([f's{i}' for i in range(7)], sorted(got_samples))
+        self.assertEqual(['0', '1', '2', 'samples.db'], sorted(x for x in os.listdir(tmp_dir) if not x.startswith('samples.db-')))
+        self.assertEqual(['6'], os.listdir(os.path.join(tmp_dir, '2')))
+        expected_dirs = {f's{i}': os.path.join(str(i // 3), str(i)) for i in range(7)}
+        self.assertEqual(expected_dirs, {k: v['dir'] for k, v in pipeline_output_dir.PipelineOutputDir(tmp_dir).data['samples'].items()})
+        os.unlink(tmp_data_file)
+        os.unlink(tmp_tsv)
+        shutil.rmtree(tmp_dir)
+
+
+    def test_add_data_from_file_migrates_data_json(self):
+        '''test add_data_from_file with old data.json'''
+        tmp_dir = 'tmp.pipeline_output_dir.migrate'
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        shutil.copytree(os.path.join(data_dir, 'init'), tmp_dir)
+        pipe_dir = pipeline_output_dir.PipelineOutputDir(tmp_dir)
+        pipe_dir.add_data_from_file(os.path.join(data_dir, 'add_data_from_file.1.tsv'))
+        self.assertTrue(os.path.exists(pipe_dir.sample_index_file))
+        self.assertTrue(os.path.exists(pipe_dir.json_data_file))
+        expected = {'samples_per_dir': 42,
+          'samples': {
+            'sample1': {'name': 'sample1', 'reads': ['file1.1', 'file1.2'], 'number': 0, 'dir': '0/0'},
+            'sample2': {'name': 'sample2', 'reads': ['file2.1', 'file2.2'], 'number': 1, 'dir': '0/1'},
+            's1': {'name': 's1', 'reads': ['s1_1.fq.gz', 's1_2.fq.gz'], 'number': 2, 'dir': os.path.join('0', '2')},
+          }
+        }
+        self.assertEqual(expected, pipe_dir.data)
+        self.assertTrue(os.path.exists(os.path.join(tmp_dir, '0', '2')))
+        # data.json is left as it was, unless asked for
+        with open(pipe_dir.json_data_file) as f:
+            old_data = json.load(f)
+        with open(os.path.join(data_dir, 'init', 'data.json')) as f:
+            self.assertEqual(json.load(f), old_data)
+
+        pipe_dir = pipeline_output_dir.PipelineOutputDir(tmp_dir)
+        self.assertEqual(expected['samples']['sample2'], pipe_dir.get_sample('sample2'))
+        self.assertIsNone(pipe_dir.get_sample('not_there'))
+        self.assertEqual(expected, pipe_dir.data)
+        with self.assertRaises(Exception):
+            pipe_dir.add_data_from_file(os.path.join(data_dir, 'add_data_from_file.1.tsv'))
+        self.assertEqual(expected, pipeline_output_dir.PipelineOutputDir(tmp_dir).data)
+
+        pipe_dir.add_data_from_file(os.path.join(data_dir, 'add_data_from_file.2.tsv'), write_json_data=True)
+        with open(pipe_dir.json_data_file) as f:
+            self.assertEqual(pipeline_output_dir.PipelineOutputDir(tmp_dir).data, json.load(f))
+        shutil.rmtree(tmp_dir)
+
+
+    def test_pending_samples(self):
+        '''test directories of pending samples are made when loaded'''
+        tmp_dir = 'tmp.pipeline_output_dir.pending_samples'
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.mkdir(tmp_dir)
+        pipe_dir = pipeline_output_dir.PipelineOutputDir(tmp_dir, samples_per_dir=2)
+
+        # Same as a run of iter_add_data_from_file that was killed after
+        # adding the samples to the index, and making one directory
+        with sample_index.SampleIndex(pipe_dir.sample_index_file, samples_per_dir=2) as index:
+            samples = [{'name': f's{i}', 'reads': [f'r{i}_1', f'r{i}_2']} for i in range(3)]
+            index.add_samples(samples, pipeline_output_dir.PipelineOutputDir.sample_number_to_dir, pending=True)
+            self.assertEqual(['s0', 's1', 's2'], [x['name'] for x in index.pending_samples()])
+        os.makedirs(os.path.join(tmp_dir, '0', '0'))
+
+        self.assertEqual(os.path.join('1', '2'), pipe_dir.get_sample('s2')['dir'])
+        for sample_dir in '0/0', '0/1', '1/2':
+            self.assertTrue(os.path.isdir(os.path.join(tmp_dir, sample_dir)))
+        with sample_index.SampleIndex(pipe_dir.sample_index_file) as index:
+            self.assertEqual([], index.pending_samples())
+
+        # New samples are not pending once their directories are made
+        tmp_data_file = 'tmp.pipeline_output_dir.pending_samples.tsv'
+        with open(tmp_data_file, 'w') as f:
+            print('s3', 'r3_1', 'r3_2', file=f)
+        pipe_dir.add_data_from_file(tmp_data_file)
+        os.unlink(tmp_data_file)
+        self.assertTrue(os.path.isdir(os.path.join(tmp_dir, '1', '3')))
+        with sample_index.SampleIndex(pipe_dir.sample_index_file) as index:
+            self.assertEqual([], index.pending_samples())
+            self.assertEqual(4, len(index))
+        shutil.rmtree(tmp_dir)
+
+
     def test_write_json_data_file(self):
         '''test write_json_data_file'''
         tmp_dir = 'tmp.pipeline_output_dir.write_json_data_file'
@@ -131,6 +297,43 @@ class TestPipelineOutputDir(unittest.TestCase):
         os.unlink(tmp_tsv)
 
 
+    def test_jobs_tsv_writer_per_caller(self):
+        '''test JobsTsvWriter with per_caller'''
+        tmp_tsv = 'tmp.pipeline_output_dir.jobs_tsv_writer_per_caller.tsv'
+        callers = [run_res_callers.Caller('ARIBA', False, 'ariba', None, 'ref', None, None, None, 2, 4.0),
+                   run_res_callers.Caller('KvarQ', False, 'kvarq', None, None, None, None, None, 1, None)]
+        sample = {'name': 's1', 'reads': ['r1', 'r2'], 'number': 0, 'dir': '0/0'}
+        with pipeline_output_dir.JobsTsvWriter(tmp_tsv, with_hints=True, per_caller=True) as writer:
+            writer.add(sample, hints=(4.0, None), caller=callers[0])
+            writer.add(sample, hints=(1.234, 0.5), caller=callers[1])
+        with open(tmp_tsv) as f:
+            got = [x.rstrip('\n').split('\t') for x in f]
+        expected = [
+            ['name', 'reads1', 'reads2', 'sample_dir', 'caller', 'cpus', 'memory_gb', 'time_hours'],
+            ['s1', 'r1', 'r2', '0/0', 'ariba', '2', '4.0', '.'],
+            ['s1', 'r1', 'r2', '0/0', 'kvarq', '1', '1.23', '0.5'],
+        ]
+        self.assertEqual(expected, got)
+        os.unlink(tmp_tsv)
+
+
+    def test_write_summary_json(self):
+        '''test write_summary_json'''
+        tmp_json = 'tmp.pipeline_output_dir.write_summary_json.json'
+        sample_summaries = [('s1', {'Tool1': {'Success': True}}), ('s2é', {'Tool1': {'note': 'é'}})]
+        # Non-ASCII is not escaped without orjson either, so the file
+        # must be UTF-8 whatever the locale
+        for pretty in False, True:
+            with mock.patch.object(json_io, 'orjson', None):
+                pipeline_output_dir.write_summary_json(sample_summaries, tmp_json, pretty=pretty)
+            with open(tmp_json, 'rb') as f:
+                got = f.read()
+            if not pretty:
+                self.assertEqual((json_io.dumps(dict(sample_summaries)) + '\n').encode('utf-8'), got)
+            self.assertEqual(dict(sample_summaries), json_io.load(tmp_json))
+        os.unlink(tmp_json)
+
+
     def test_make_summary_json_of_all_samples(self):
         '''test make_summary_json_of_all_samples'''
         tmp_pipe_dir = 'tmp.make_summary_json_of_all_samples'
@@ -158,13 +361,145 @@ class TestPipelineOutputDir(unittest.TestCase):
             got_data = data = json.load(f)
         self.assertEqual(json_data_to_write, got_data)
 
+        with open(tmp_json) as f:
+            self.assertEqual(json_io.dumps(json_data_to_write) + '\n', f.read())
+
         os.unlink(tmp_json)
-        pipe_dir.make_summary_json_of_all_samples(tmp_json, threads=2)
+        pipe_dir.make_summary_json_of_all_samples(tmp_json, pretty=True)
+        with open(tmp_json) as f:
+            self.assertEqual(json.dumps(json_data_to_write, sort_keys=True, indent=4) + '\n', f.read())
+
+        os.unlink(tmp_json)
+        tmp_shards = 'tmp.make_summary_json_of_all_samples.shards'
+        pipe_dir.make_summary_json_of_all_samples(tmp_json, threads=2, shards_dir=tmp_shards)
         with open(tmp_json) as f:
             got_data = data = json.load(f)
         self.assertEqual(json_data_to_write, got_data)
+        shards = list(pipeline_output_dir.iter_summary_shards(tmp_shards))
+        self.assertEqual([os.path.join(tmp_shards, '0.jsonl')], shards)
+        got_data = dict(pipeline_output_dir.iter_summary_shard(shards[0]))
+        self.assertEqual(json_data_to_write, got_data)
+        shutil.rmtree(tmp_shards)
+
+
+        os.unlink(tmp_json)
+        pipe_dir.make_summary_json_of_all_samples(tmp_json, incremental=True)
+        self.assertTrue(os.path.exists(pipe_dir.summary_manifest_file))
+        with open(tmp_json) as f:
+            self.assertEqual(json_data_to_write, json.load(f))
+
+        json_data_to_write['sample2']['x'] = 'z'
+        outfile = os.path.join(tmp_pipe_dir, pipe_dir.data['samples']['sample2']['dir'], 'summary.json')
+        with open(outfile, 'w') as f:
+            print(json.dumps(json_data_to_write['sample2'], sort_keys=True, indent=4), file=f)
+        pipe_dir.make_summary_json_of_all_samples(tmp_json, threads=2, incremental=True)
+        with open(tmp_json) as f:
+            self.assertEqual(json_data_to_write, json.load(f))
+        manifest = pipe_dir.load_summary_manifest()
+        self.assertEqual({'sample1', 'sample2'}, set(manifest['samples']))
+        self.assertEqual(pipe_dir.default_shards_dir, manifest['shards_dir'])
+
+        shutil.rmtree(tmp_pipe_dir)
+        os.unlink(tmp_data_file)
+        os.unlink(tmp_json)
+
+
+
+    def test_make_summary_json_of_all_samples_sqlite(self):
+        '''test make_summary_json_of_all_samples with sqlite_file'''
+        tmp_pipe_dir = 'tmp.make_summary_json_of_all_samples_sqlite'
+        tmp_data_file = 'tmp.make_summary_json_of_all_samples_sqlite.in.tsv'
+        tmp_json = 'tmp.make_summary_json_of_all_samples_sqlite.json'
+        tmp_sqlite = 'tmp.make_summary_json_of_all_samples_sqlite.sqlite'
+
+        with open(tmp_data_file, 'w') as f:
+            print('sample1', 'reads1.1', 'reads1.2', sep='\t', file=f)
+            print('sample2', 'reads2.1', 'reads2.2', sep='\t', file=f)
+
+        pipe_dir = pipeline_output_dir.PipelineOutputDir(tmp_pipe_dir)
+        pipe_dir.add_data_from_file(tmp_data_file)
+        for sample in pipe_dir.data['samples']:
+            outfile = os.path.join(tmp_pipe_dir, pipe_dir.data['samples'][sample]['dir'], 'summary.json')
+            with open(outfile, 'w') as f:
+                json.dump({'Tool1': {'Success': True, 'resistance_calls': {'Drug1': [['R', 'gene1', sample, None]]}, 'time_and_memory': {}}}, f)
+
+        pipe_dir.make_summary_json_of_all_samples(tmp_json, sqlite_file=tmp_sqlite)
+        got = summary_db.query(tmp_sqlite, 'SELECT sample, caller, drug, variant FROM calls ORDER BY sample')
+        expect = [
+            {'sample': 'sample1', 'caller': 'Tool1', 'drug': 'Drug1', 'variant': 'sample1'},
+            {'sample': 'sample2', 'caller': 'Tool1', 'drug': 'Drug1', 'variant': 'sample2'},
+        ]
+        self.assertEqual(expect, got)
 
         shutil.rmtree(tmp_pipe_dir)
         os.unlink(tmp_data_file)
         os.unlink(tmp_json)
+        os.unlink(tmp_sqlite)
+
 
+    def test_add_sample_to_summary_and_finalize_summary(self):
+        '''test add_sample_to_summary and finalize_summary'''
+        tmp_pipe_dir = 'tmp.pipeline_output_dir.finalize_summary'
+        if os.path.exists(tmp_pipe_dir):
+            shutil.rmtree(tmp_pipe_dir)
+        tmp_data_file = 'tmp.pipeline_output_dir.finalize_summary.in.tsv'
+        tmp_json = 'tmp.pipeline_output_dir.finalize_summary.json'
+        tmp_expect_json = 'tmp.pipeline_output_dir.finalize_summary.expect.json'
+        tmp_sqlite = 'tmp.pipeline_output_dir.finalize_summary.sqlite'
+
+        with open(tmp_data_file, 'w') as f:
+            for sample in 'sample1', 'sample2', 'sample3':
+                print(sample, f'{sample}.1', f'{sample}.2', sep='\t', file=f)
+
+        pipe_dir = pipeline_output_dir.PipelineOutputDir(tmp_pipe_dir)
+        pipe_dir.add_data_from_file(tmp_data_file)
+        for sample in 'sample1', 'sample2':
+            outfile = os.path.join(tmp_pipe_dir, pipe_dir.data['samples'][sample]['dir'], 'summary.json')
+            with open(outfile, 'w') as f:
+                json.dump({'Tool1': {'Success': True, 'resistance_calls': {'Drug1': [['R', 'gene1', sample, None]]}, 'time_and_memory': {}}}, f)
+
+        with self.assertRaises(Exception):
+            pipe_dir.add_sample_to_summary('sample3', tmp_sqlite)
+        with self.assertRaises(Exception):
+            pipe_dir.add_sample_to_summary('not_a_sample', tmp_sqlite)
+
+        # Samples can be queried as soon as they are added. Adding
+        # the same sample again replaces it
+        pipe_dir.add_sample_to_summary('sample2', tmp_sqlite)
+        pipe_dir.add_sample_to_summary('sample2', tmp_sqlite)
+        got = summary_db.query(tmp_sqlite, 'SELECT sample, variant FROM calls')
+        self.assertEqual([{'sample': 'sample2', 'variant': 'sample2'}], got)
+
+        # sample1 was not added, so finalize_summary should add it
+        pipe_dir.finalize_summary(tmp_json, tmp_sqlite)
+        pipe_dir.make_summary_json_of_all_samples(tmp_expect_json)
+        self.assertTrue(filecmp.cmp(tmp_expect_json, tmp_json, shallow=False))
+        got = summary_db.query(tmp_sqlite, 'SELECT sample, variant FROM calls ORDER BY sample')
+        self.assertEqual([{'sample': 'sample1', 'variant': 'sample1'}, {'sample': 'sample2', 'variant': 'sample2'}], got)
+        got = summary_db.query(tmp_sqlite, "SELECT name FROM sqlite_master WHERE type='index' ORDER BY name")
+        self.assertEqual([{'name': 'calls_caller'}, {'name': 'calls_drug'}, {'name': 'calls_sample'}], got)
+
+        pipe_dir.finalize_summary(tmp_json, tmp_sqlite, pretty=True)
+        pipe_dir.make_summary_json_of_all_samples(tmp_expect_json, pretty=True)
+        self.assertTrue(filecmp.cmp(tmp_expect_json, tmp_json, shallow=False))
+
+        # A summary.json changed after it was added (eg by reparse) replaces
+        # the sample. Files are compared using mtime and size, so changing
+        # sample1 without changing either of those is not noticed, but
+        # changing the size of sample2 is
+        def rewrite_keeping_mtime(sample, variant):
+            outfile = os.path.join(tmp_pipe_dir, pipe_dir.data['samples'][sample]['dir'], 'summary.json')
+            mtime_ns = os.stat(outfile).st_mtime_ns
+            with open(outfile, 'w') as f:
+                json.dump({'Tool1': {'Success': True, 'resistance_calls': {'Drug1': [['R', 'gene1', variant, None]]}, 'time_and_memory': {}}}, f)
+            os.utime(outfile, ns=(mtime_ns, mtime_ns))
+
+        rewrite_keeping_mtime('sample1', 'SAMPLE1')
+        rewrite_keeping_mtime('sample2', 'changed_sample2')
+        pipe_dir.finalize_summary(tmp_json, tmp_sqlite)
+        got = summary_db.query(tmp_sqlite, 'SELECT sample, variant FROM calls ORDER BY sample')
+        self.assertEqual([{'sample': 'sample1', 'variant': 'sample1'}, {'sample': 'sample2', 'variant': 'changed_sample2'}], got)
+
+        for filename in tmp_data_file, tmp_json, tmp_expect_json, tmp_sqlite:
+            os.unlink(filename)
+        shutil.rmtree(tmp_pipe_dir)
@@ -0,0 +1,57 @@
+import filecmp
+import gzip
+import os
+import unittest
+
+from evalrescallers import reads_subsample
+
+
+def read_names(filename):
+    with gzip.open(filename, 'rt') as f:
+        return [x.rstrip()[1:].split('/')[0] for i, x in enumerate(f) if i % 4 == 0]
+
+
+class TestReadsSubsample(unittest.TestCase):
+    def test_subsample_reads(self):
+        '''test subsample_reads'''
+        reads = ['tmp.reads_subsample.in_1.fq.gz', 'tmp.reads_subsample.in_2.fq.gz']
+        outs = ['tmp.reads_subsample.out_1.fq.gz', 'tmp.reads_subsample.out_2.fq.gz']
+        for i, filename in enumerate(reads):
+            with gzip.open(filename, 'wt') as f:
+                for j in range(100):
+                    print(f'@read{j}/{i + 1}', 'A' * 50, '+', 'I' * 50, sep='\n', file=f)
+
+        # 100 bases per pair, so depth 2 of a 1000bp genome needs 20 pairs
+        got = reads_subsample.subsample_reads(*reads, *outs, 2, genome_size=1000, method='first')
+        expected = {'method': 'first', 'target_depth': 2, 'genome_size': 1000, 'pairs': 20, 'bases': 2000, 'depth': 2.0}
+        self.assertEqual(expected, got)
+        self.assertEqual([f'read{j}' for j in range(20)], read_names(outs[0]))
+        self.assertEqual(read_names(outs[0]), read_names(outs[1]))
+
+        got = reads_subsample.subsample_reads(*reads, *outs, 2, genome_size=1000, method='random', seed=1)
+        expected['method'] = 'random'
+        expected['seed'] = 1
+        self.assertEqual(expected, got)
+        names = read_names(outs[0])
+        self.assertEqual(20, len(set(names)))
+        self.assertNotEqual([f'read{j}' for j in range(20)], names)
+        self.assertEqual(names, read_names(outs[1]))
+
+        # Same seed should make identical files
+        copies = [x + '.copy' for x in outs]
+        for original, copy in zip(outs, copies):
+            os.rename(original, copy)
+        reads_subsample.subsample_reads(*reads, *outs, 2, genome_size=1000, method='random', seed=1)
+        for original, copy in zip(outs, copies):
+            self.assertTrue(filecmp.cmp(original, copy, shallow=False))
+
+        # Not enough reads: should use all of them
+        got = reads_subsample.subsample_reads(*reads, *outs, 100, genome_size=1000, method='first')
+        self.assertEqual(100, got['pairs'])
+        self.assertEqual(10.0, got['depth'])
+
+        with self.assertRaises(Exception):
+            reads_subsample.subsample_reads(*reads, *outs, 2, method='foo')
+
+        for filename in reads + outs + copies:
+            os.unlink(filename)
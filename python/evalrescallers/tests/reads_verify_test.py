@@ -0,0 +1,84 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import unittest
+
+from evalrescallers import reads_verify
+
+
+def fastq_gz(names):
+    return gzip.compress(''.join(f'@{x}\nACGT\n+\nIIII\n' for x in names).encode())
+
+
+def write_file(filename, data):
+    with open(filename, 'wb') as f:
+        f.write(data)
+
+
+class TestReadsVerify(unittest.TestCase):
+    def test_verify_fastq_gz(self):
+        '''test verify_fastq_gz'''
+        tmp_file = 'tmp.reads_verify.fastq.gz'
+        # Two gzip members, like a file made from two runs
+        data = fastq_gz(['r1', 'r2']) + fastq_gz(['r3'])
+        write_file(tmp_file, data)
+        expected = {'bytes': len(data), 'md5': hashlib.md5(data).hexdigest(), 'records': 3, 'error': None}
+        self.assertEqual(expected, reads_verify.verify_fastq_gz(tmp_file))
+
+        write_file(tmp_file, data[:-10])
+        self.assertEqual('Truncated gzip data', reads_verify.verify_fastq_gz(tmp_file)['error'])
+
+        # Change the CRC of the last member
+        bad_crc = bytearray(data)
+        bad_crc[-5] ^= 0xFF
+        write_file(tmp_file, bytes(bad_crc))
+        self.assertTrue(reads_verify.verify_fastq_gz(tmp_file)['error'].startswith('Bad gzip data'))
+
+        write_file(tmp_file, gzip.compress(b'@r1\nACGT\n+\n'))
+        self.assertEqual('Number of lines (3) is not a multiple of 4', reads_verify.verify_fastq_gz(tmp_file)['error'])
+
+        write_file(tmp_file, gzip.compress(b'>r1\nACGT\n'))
+        self.assertEqual('Not a FASTQ file: does not start with "@"', reads_verify.verify_fastq_gz(tmp_file)['error'])
+        os.unlink(tmp_file)
+        self.assertTrue(reads_verify.verify_fastq_gz(tmp_file)['error'].startswith('Error reading file'))
+
+
+    def test_verify_sample_and_download_dir(self):
+        '''test verify_sample and verify_download_dir'''
+        tmp_dir = 'tmp.reads_verify'
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        good_dir = os.path.join(tmp_dir, 'ERR123', 'ERR123')
+        bad_dir = os.path.join(tmp_dir, 'ERR456', 'ERR456')
+        os.makedirs(good_dir)
+        os.makedirs(bad_dir)
+        reads = {'reads_1.fastq.gz': fastq_gz(['r1', 'r2']), 'reads_2.fastq.gz': fastq_gz(['r1', 'r2'])}
+        with open(os.path.join(good_dir, 'reads.md5'), 'w') as f:
+            for filename, data in reads.items():
+                write_file(os.path.join(good_dir, filename), data)
+                print(hashlib.md5(data).hexdigest(), filename, sep='  ', file=f)
+        write_file(os.path.join(bad_dir, 'reads_1.fastq.gz'), fastq_gz(['r1', 'r2']))
+        write_file(os.path.join(bad_dir, 'reads_2.fastq.gz'), fastq_gz(['r1']))
+
+        manifest = reads_verify.verify_sample(good_dir)
+        self.assertTrue(manifest['ok'])
+        self.assertEqual(2, manifest['files']['reads_2.fastq.gz']['records'])
+        with open(os.path.join(good_dir, 'manifest.json')) as f:
+            self.assertEqual(manifest, json.load(f))
+
+        manifest = reads_verify.verify_sample(good_dir, expected_md5s={'reads_1.fastq.gz': 'x'})
+        self.assertFalse(manifest['ok'])
+        self.assertEqual([f'reads_1.fastq.gz: MD5 mismatch. Expected x, got {hashlib.md5(reads["reads_1.fastq.gz"]).hexdigest()}'], manifest['errors'])
+
+        tmp_tsv = 'tmp.reads_verify.tsv'
+        self.assertEqual(1, reads_verify.verify_download_dir(tmp_dir, tmp_tsv, threads=2))
+        with open(tmp_tsv) as f:
+            lines = [x.rstrip('\n').split('\t') for x in f]
+        self.assertEqual(3, len(lines))
+        self.assertEqual(['ERR123', '1', '2', '2'], lines[1][:4])
+        self.assertEqual(['ERR456', '0', '2', '1'], lines[2][:4])
+        self.assertEqual('Different number of records in reads files: 2 and 1', lines[2][-1])
+        os.unlink(tmp_tsv)
+        shutil.rmtree(tmp_dir)
@@ -0,0 +1,92 @@
+import json
+import os
+import shutil
+import unittest
+
+from evalrescallers import caller_adapters, pipeline_output_dir, reparse
+
+modules_dir = os.path.dirname(os.path.abspath(reparse.__file__))
+data_dir = os.path.join(modules_dir, 'tests', 'data', 'res_caller')
+
+
+class TestReparse(unittest.TestCase):
+    def test_diff_resistance_calls(self):
+        '''test diff_resistance_calls'''
+        old = {'d1': [['R', 'g1', 'A1B', None]], 'd2': [['R', 'g2', 'C2D', None]]}
+        new = {'d1': [('R', 'g1', 'A1B', None)], 'd2': [('R', 'g2', 'C2E', None)], 'd3': [('R', 'g3', 'E3F', None)]}
+        expected = {
+            'd2': {'removed': [['R', 'g2', 'C2D', None]], 'added': [['R', 'g2', 'C2E', None]]},
+            'd3': {'removed': [], 'added': [['R', 'g3', 'E3F', None]]},
+        }
+        self.assertEqual(expected, reparse.diff_resistance_calls(old, new))
+        self.assertEqual({}, reparse.diff_resistance_calls(old, old))
+
+
+    def test_reparse_pipeline_dir(self):
+        '''test reparse_pipeline_dir'''
+        tmp_dir = 'tmp.reparse.pipeline_dir'
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.mkdir(tmp_dir)
+        data_tsv = os.path.join(tmp_dir, 'data.tsv')
+        with open(data_tsv, 'w') as f:
+            print('s1', 'r1_1.fq.gz', 'r1_2.fq.gz', file=f)
+            print('s2', 'r2_1.fq.gz', 'r2_2.fq.gz', file=f)
+        callers_tsv = os.path.join(tmp_dir, 'callers.tsv')
+        with open(callers_tsv, 'w') as f:
+            print('ARIBA', '0', 'ariba', '.', 'ref', '.', '.', '.', sep='\t', file=f)
+            print('MTBseq', '0', 'mtbseq', '.', '.', '.', '.', '.', sep='\t', file=f)
+        pipe_dir = pipeline_output_dir.PipelineOutputDir(os.path.join(tmp_dir, 'pipe'))
+        pipe_dir.add_data_from_file(data_tsv)
+        pipe_dir.write_json_data_file()
+
+        # Sample s1: ARIBA calls in summary are out of date, MTBseq
+        # has its Called/ directory kept. Sample s2: calls are up to date
+        time_and_memory = {'ram': 42, 'wall_clock_time': 10.0}
+        s1_dir = os.path.join(pipe_dir.output_dir, pipe_dir.data['samples']['s1']['dir'])
+        s2_dir = os.path.join(pipe_dir.output_dir, pipe_dir.data['samples']['s2']['dir'])
+        ariba_calls = reparse._normalise_calls(caller_adapters.get_adapter('ARIBA').parse_output(os.path.join(data_dir, 'json_to_resistance_calls.ARIBA.json')))
+        for sample_dir, calls in (s1_dir, {'Isoniazid': [['R', 'katG', 'S315X', None]]}), (s2_dir, ariba_calls):
+            os.mkdir(os.path.join(sample_dir, 'ariba'))
+            shutil.copy(os.path.join(data_dir, 'json_to_resistance_calls.ARIBA.json'), os.path.join(sample_dir, 'ariba', 'out.json'))
+            summary = {'resistance_calls': calls, 'time_and_memory': time_and_memory}
+            with open(os.path.join(sample_dir, 'ariba', 'summary.json'), 'w') as f:
+                json.dump(summary, f)
+            with open(os.path.join(sample_dir, 'summary.json'), 'w') as f:
+                json.dump({'ariba': dict(summary, Success=True), 'mtbseq': {'Success': False}}, f)
+        shutil.copytree(os.path.join(data_dir, 'mtbseq_outdir_to_res_calls_json_file'), os.path.join(s1_dir, 'mtbseq'))
+        with open(os.path.join(s1_dir, 'mtbseq', 'summary.json'), 'w') as f:
+            json.dump({'resistance_calls': {}, 'time_and_memory': time_and_memory}, f)
+
+        report = os.path.join(tmp_dir, 'report.tsv')
+        with open(os.path.join(s1_dir, 'summary.json')) as f:
+            s1_summary_before = f.read()
+        got = reparse.reparse_pipeline_dir(pipe_dir.output_dir, callers_tsv, report, dry_run=True)
+        self.assertEqual({'changed': 2, 'unchanged': 1, 'no_output': 1, 'error': 0}, got)
+        with open(os.path.join(s1_dir, 'summary.json')) as f:
+            self.assertEqual(s1_summary_before, f.read())
+        self.assertFalse(os.path.exists(os.path.join(s1_dir, 'mtbseq', 'out.json')))
+
+        got = reparse.reparse_pipeline_dir(pipe_dir.output_dir, callers_tsv, report, threads=2)
+        self.assertEqual({'changed': 2, 'unchanged': 1, 'no_output': 1, 'error': 0}, got)
+        with open(report) as f:
+            lines = [x.rstrip().split('\t') for x in f]
+        self.assertEqual(['sample', 'caller', 'status', 'drug', 'removed', 'added'], lines[0])
+        self.assertIn(['s1', 'ariba', 'changed', 'Isoniazid', '[["R", "katG", "S315X", null]]', '[["R", "katG", "S315T", null]]'], lines)
+        self.assertEqual({'s1'}, {x[0] for x in lines[1:]})
+
+        with open(os.path.join(s1_dir, 'ariba', 'summary.json')) as f:
+            self.assertEqual({'resistance_calls': ariba_calls, 'time_and_memory': time_and_memory}, json.load(f))
+        with open(os.path.join(s1_dir, 'summary.json')) as f:
+            s1_summary = json.load(f)
+        self.assertEqual(ariba_calls, s1_summary['ariba']['resistance_calls'])
+        self.assertEqual(time_and_memory, s1_summary['ariba']['time_and_memory'])
+        self.assertEqual({'Success': False}, s1_summary['mtbseq'])
+        with open(os.path.join(s1_dir, 'mtbseq', 'out.json')) as f:
+            mtbseq_calls = json.load(f)
+        with open(os.path.join(data_dir, 'mtbseq_outdir_to_res_calls_json_file.expect')) as f:
+            self.assertEqual(json.load(f), mtbseq_calls)
+
+        got = reparse.reparse_pipeline_dir(pipe_dir.output_dir, callers_tsv, report)
+        self.assertEqual({'changed': 0, 'unchanged': 3, 'no_output': 1, 'error': 0}, got)
+        shutil.rmtree(tmp_dir)
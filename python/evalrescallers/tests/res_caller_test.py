@@ -2,8 +2,9 @@ import filecmp
 import os
 import shutil
 import unittest
+from unittest import mock
 
-from evalrescallers import res_caller
+from evalrescallers import res_caller, result_cache
 
 modules_dir = os.path.dirname(os.path.abspath(res_caller.__file__))
 data_dir = os.path.join(modules_dir, 'tests', 'data', 'res_caller')
@@ -201,3 +202,38 @@ class TestResCaller(unittest.TestCase):
         self.assertTrue(os.path.exists(os.path.join(tmp_dir, 'command.out')))
         shutil.rmtree(tmp_dir)
 
+
+
+    def test_run_in_scratch_dir(self):
+        '''test run using a scratch directory'''
+        reads1 = os.path.join(modules_dir, 'tests', 'data', 'run_res_callers', 'run_res_callers.reads1')
+        reads2 = os.path.join(modules_dir, 'tests', 'data', 'run_res_callers', 'run_res_callers.reads2')
+        tmp_dir = 'tmp.res_caller.run_in_scratch_dir'
+        tmp_scratch = 'tmp.res_caller.run_in_scratch_dir.scratch'
+        tmp_cache = 'tmp.res_caller.run_in_scratch_dir.cache'
+        for d in tmp_dir, tmp_scratch, tmp_cache:
+            if os.path.exists(d):
+                shutil.rmtree(d)
+
+        # Use the result cache, so that no tool needs to be run
+        with mock.patch.object(result_cache, 'tool_version', return_value='kvarq 1.0'):
+            key = result_cache.cache_key('KvarQ', reads1, reads2)
+            os.mkdir(tmp_cache)
+            raw_output = os.path.join(tmp_cache, 'raw.json')
+            with open(raw_output, 'w') as f:
+                print('{}', file=f)
+            result_cache.put(tmp_cache, key, {'resistance_calls': {}, 'time_and_memory': {}}, raw_output_file=raw_output)
+            caller = res_caller.ResCaller('KvarQ', tmp_dir)
+            caller.run(reads1, reads2, result_cache_dir=tmp_cache, scratch_dir=tmp_scratch)
+        self.assertEqual(['out.json', 'summary.json'], sorted(os.listdir(tmp_dir)))
+        self.assertEqual([], os.listdir(tmp_scratch))
+        shutil.rmtree(tmp_dir)
+
+        # Scratch should be deleted if the caller fails
+        caller = res_caller.ResCaller('KvarQ', tmp_dir)
+        with self.assertRaises(FileNotFoundError):
+            caller.run('does_not_exist', reads2, scratch_dir=tmp_scratch)
+        self.assertEqual([], os.listdir(tmp_dir))
+        self.assertEqual([], os.listdir(tmp_scratch))
+        for d in tmp_dir, tmp_scratch, tmp_cache:
+            shutil.rmtree(d)
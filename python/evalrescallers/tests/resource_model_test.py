@@ -0,0 +1,140 @@
+import json
+import os
+import shutil
+import unittest
+from unittest import mock
+
+from evalrescallers import pipeline_output_dir, resource_model
+
+
+class TestResourceModel(unittest.TestCase):
+    def test_caller_ram_gb(self):
+        '''test caller_ram_gb'''
+        self.assertIsNone(resource_model.caller_ram_gb({}))
+        self.assertEqual(2.0, resource_model.caller_ram_gb({'ram': 2 * 1024 * 1024}))
+        self.assertEqual(3.0, resource_model.caller_ram_gb({'ram': 2 * 1024 * 1024, 'profile': {'ram_peak': 3 * 1024 * 1024}}))
+
+
+    def test_fit_model_and_predict(self):
+        '''test fit_model and predict'''
+        observations = [
+            ('c1', 1000, 2.0, 1.0),
+            ('c1', 2000, 3.0, 2.0),
+            ('c1', 3000, 4.0, 3.0),
+            ('c2', 1000, 5.0, 0.5),
+        ]
+        model = resource_model.fit_model(observations)
+        self.assertEqual({'c1', 'c2'}, set(model))
+        self.assertAlmostEqual(0.001, model['c1']['ram_gb']['slope'])
+        self.assertAlmostEqual(1.0, model['c1']['ram_gb']['intercept'])
+        self.assertAlmostEqual(0.0, model['c1']['ram_gb']['margin'])
+        self.assertEqual(3, model['c1']['ram_gb']['n'])
+        self.assertEqual(0, model['c2']['ram_gb']['slope'])
+        self.assertEqual(5.0, model['c2']['ram_gb']['intercept'])
+
+        ram, hours = resource_model.predict(model, 'c1', 4000)
+        self.assertAlmostEqual(5.0 * resource_model.safety_factor, ram)
+        self.assertAlmostEqual(4.0 * resource_model.safety_factor, hours)
+        ram, hours = resource_model.predict(model, 'c2', 4000)
+        self.assertAlmostEqual(5.0 * resource_model.safety_factor, ram)
+        self.assertAlmostEqual(0.5 * resource_model.safety_factor, hours)
+
+        got = resource_model.sample_hints(model, 4000, ['c1', 'c2'])
+        self.assertAlmostEqual(5.0 * resource_model.safety_factor, got[0])
+        self.assertAlmostEqual(4.5 * resource_model.safety_factor, got[1])
+        got = resource_model.sample_hints(model, 4000, ['c1', 'c2'], concurrent=True)
+        self.assertAlmostEqual(10.0 * resource_model.safety_factor, got[0])
+        self.assertAlmostEqual(4.0 * resource_model.safety_factor, got[1])
+        # Only the callers given are added up, not everything in the model
+        got = resource_model.sample_hints(model, 4000, ['c1'], concurrent=True)
+        self.assertAlmostEqual(5.0 * resource_model.safety_factor, got[0])
+        self.assertAlmostEqual(4.0 * resource_model.safety_factor, got[1])
+        self.assertEqual((None, None), resource_model.sample_hints(model, 4000, ['c1', 'c3']))
+        self.assertEqual((None, None), resource_model.sample_hints(model, None, ['c1']))
+        self.assertEqual((None, None), resource_model.sample_hints(model, 4000, []))
+        self.assertEqual((None, None), resource_model.sample_hints({}, 4000, ['c1']))
+
+        got = resource_model.caller_hints(model, 'c1', 4000)
+        self.assertAlmostEqual(5.0 * resource_model.safety_factor, got[0])
+        self.assertAlmostEqual(4.0 * resource_model.safety_factor, got[1])
+        got = resource_model.caller_hints(model, 'c1', 4000, ram=2.5)
+        self.assertEqual(2.5, got[0])
+        self.assertAlmostEqual(4.0 * resource_model.safety_factor, got[1])
+        self.assertEqual((2.5, None), resource_model.caller_hints(model, 'c3', 4000, ram=2.5))
+        self.assertEqual((None, None), resource_model.caller_hints(None, 'c1', 4000))
+
+
+    def test_collect_observations_no_pipeline_dir(self):
+        '''test collect_observations incremental when pipeline dir does not exist'''
+        tmp_pipe_dir = 'tmp.resource_model.no_pipe_dir'
+        if os.path.exists(tmp_pipe_dir):
+            shutil.rmtree(tmp_pipe_dir)
+        pipe_dir = pipeline_output_dir.PipelineOutputDir(tmp_pipe_dir)
+        self.assertEqual([], resource_model.collect_observations(pipe_dir, incremental=True))
+        self.assertFalse(os.path.exists(tmp_pipe_dir))
+        tmp_model = 'tmp.resource_model.no_pipe_dir.json'
+        resource_model.make_model_file(tmp_pipe_dir, tmp_model, incremental=True)
+        self.assertEqual({}, resource_model.load_model_file(tmp_model))
+        self.assertFalse(os.path.exists(tmp_pipe_dir))
+        os.unlink(tmp_model)
+
+
+    def test_make_model_file(self):
+        '''test make_model_file'''
+        tmp_pipe_dir = 'tmp.resource_model.pipe_dir'
+        tmp_data_file = 'tmp.resource_model.in.tsv'
+        tmp_model = 'tmp.resource_model.json'
+        tmp_tsv = 'tmp.resource_model.jobs.tsv'
+        os.mkdir(tmp_pipe_dir)
+        reads_files = {}
+        with open(tmp_data_file, 'w') as f:
+            for i in range(1, 4):
+                reads_files[f'sample{i}'] = [os.path.abspath(os.path.join(tmp_pipe_dir, f'reads{i}.{j}.fq')) for j in (1, 2)]
+                for filename in reads_files[f'sample{i}']:
+                    with open(filename, 'w') as f_reads:
+                        f_reads.write('x' * 500 * i)
+                print(f'sample{i}', *reads_files[f'sample{i}'], sep='\t', file=f)
+
+        pipe_dir = pipeline_output_dir.PipelineOutputDir(tmp_pipe_dir)
+        pipe_dir.add_data_from_file(tmp_data_file)
+        pipe_dir.write_json_data_file()
+        for i in range(1, 3):
+            summary = {
+                'c1': {'Success': True, 'time_and_memory': {'ram': i * 1024 * 1024, 'wall_clock_time': 3600 * i}},
+                'c2': {'Success': False},
+            }
+            outfile = os.path.join(tmp_pipe_dir, pipe_dir.data['samples'][f'sample{i}']['dir'], 'summary.json')
+            with open(outfile, 'w') as f:
+                json.dump(summary, f)
+
+        resource_model.make_model_file(tmp_pipe_dir, tmp_model)
+        model = resource_model.load_model_file(tmp_model)
+        self.assertEqual(['c1'], list(model))
+        self.assertAlmostEqual(0.001, model['c1']['ram_gb']['slope'])
+
+        # Incremental: only changed summary files are loaded again
+        self.assertFalse(os.path.exists(resource_model.observations_cache_file(pipe_dir)))
+        resource_model.make_model_file(tmp_pipe_dir, tmp_model, incremental=True)
+        self.assertEqual(model, resource_model.load_model_file(tmp_model))
+        self.assertTrue(os.path.exists(resource_model.observations_cache_file(pipe_dir)))
+        with mock.patch.object(resource_model, '_load_observations') as mock_load:
+            resource_model.make_model_file(tmp_pipe_dir, tmp_model, incremental=True)
+            mock_load.assert_not_called()
+        self.assertEqual(model, resource_model.load_model_file(tmp_model))
+        with open(outfile, 'w') as f:
+            json.dump({'c1': {'Success': True, 'time_and_memory': {'ram': 10 * 1024 * 1024, 'wall_clock_time': 360000}}}, f)
+        resource_model.make_model_file(tmp_pipe_dir, tmp_model, incremental=True)
+        self.assertEqual(resource_model.fit_model(resource_model.collect_observations(pipe_dir)), resource_model.load_model_file(tmp_model))
+        self.assertNotEqual(model, resource_model.load_model_file(tmp_model))
+
+        hints = {x: resource_model.sample_hints(model, resource_model.reads_bytes(reads_files[x]), ['c1']) for x in reads_files}
+        pipe_dir.write_tsv_file(tmp_tsv, resource_hints=hints)
+        with open(tmp_tsv) as f:
+            lines = [x.rstrip('\n').split('\t') for x in f]
+        self.assertEqual(['name', 'reads1', 'reads2', 'sample_dir', 'memory_gb', 'time_hours'], lines[0])
+        self.assertEqual(['sample3', '3.3', '3.3'], [lines[3][0], lines[3][4], lines[3][5]])
+
+        shutil.rmtree(tmp_pipe_dir)
+        os.unlink(tmp_data_file)
+        os.unlink(tmp_model)
+        os.unlink(tmp_tsv)
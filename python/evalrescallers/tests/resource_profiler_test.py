@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+import unittest
+
+from evalrescallers import resource_profiler
+
+
+class TestResourceProfiler(unittest.TestCase):
+    def test_read_proc_stat(self):
+        '''test read_proc_stat'''
+        got = resource_profiler.read_proc_stat(os.getpid())
+        self.assertEqual(os.getppid(), got['ppid'])
+        self.assertGreater(got['rss'], 0)
+        self.assertGreater(got['threads'], 0)
+        self.assertIsNone(resource_profiler.read_proc_stat('does_not_exist'))
+
+
+    def test_profile_process_tree(self):
+        '''test ProcessTreeProfiler'''
+        # Parent shell runs a python child that uses about 100MB
+        script = 'import time; x = bytearray(100_000_000); time.sleep(0.6)'
+        command = f'{sys.executable} -c "{script}"; sleep 0.1'
+        process = subprocess.Popen(command, shell=True, executable='/bin/bash')
+        profiler = resource_profiler.ProcessTreeProfiler(process.pid, interval=0.05)
+        profiler.start()
+        process.wait()
+        profiler.stop()
+
+        summary = profiler.summary()
+        self.assertGreater(summary['samples'], 3)
+        self.assertEqual(0.05, summary['interval'])
+        self.assertGreater(summary['ram_peak'], 90_000)
+        self.assertLessEqual(summary['ram_p50'], summary['ram_peak'])
+        self.assertGreaterEqual(summary['threads_peak'], 2)
+
+        tmp_file = 'tmp.resource_profiler.npz'
+        profiler.save(tmp_file)
+        got = resource_profiler.load_profile(tmp_file)
+        self.assertEqual(set(resource_profiler.series_names + ['interval']), set(got))
+        self.assertEqual(summary['samples'], len(got['rss']))
+        self.assertEqual(summary['ram_peak'], got['rss'].max() / 1024)
+        os.unlink(tmp_file)
+
+
+    def test_profile_finished_process(self):
+        '''test ProcessTreeProfiler when process already finished'''
+        process = subprocess.Popen('true', shell=True)
+        process.wait()
+        profiler = resource_profiler.ProcessTreeProfiler(process.pid, interval=0.05)
+        profiler.start()
+        profiler.stop()
+        self.assertEqual({'samples': 0, 'interval': 0.05}, profiler.summary())
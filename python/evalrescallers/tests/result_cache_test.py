@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import shutil
+import unittest
+from unittest import mock
+
+from evalrescallers import reparse, res_caller, result_cache
+
+modules_dir = os.path.dirname(os.path.abspath(result_cache.__file__))
+data_dir = os.path.join(modules_dir, 'tests', 'data', 'run_res_callers')
+
+
+class TestResultCache(unittest.TestCase):
+    def test_reads_fingerprint(self):
+        '''test reads_fingerprint'''
+        tmp_dir = 'tmp.result_cache.reads_fingerprint'
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.mkdir(tmp_dir)
+        reads1 = os.path.join(tmp_dir, 'reads_1.fastq.gz')
+        reads2 = os.path.join(tmp_dir, 'reads_2.fastq.gz')
+        reads3 = os.path.join(tmp_dir, 'reads_3.fastq.gz')
+        # reads3 has the same size, start and end as the others, but is
+        # different in the middle
+        for filename, data in (reads1, b'x' * 3_000_000), (reads2, b'x' * 3_000_000), (reads3, b'x' * 1_500_000 + b'y' + b'x' * 1_499_999):
+            with open(filename, 'wb') as f:
+                f.write(data)
+        got1 = result_cache.reads_fingerprint(reads1)
+        self.assertEqual('md5:' + hashlib.md5(b'x' * 3_000_000).hexdigest(), got1)
+        self.assertEqual(got1, result_cache.reads_fingerprint(reads2))
+        self.assertNotEqual(got1, result_cache.reads_fingerprint(reads3))
+
+        with open(os.path.join(tmp_dir, 'reads.md5'), 'w') as f:
+            print('abcdef', 'reads_1.fastq.gz', sep='  ', file=f)
+        os.utime(reads1, ns=(1, 1))
+        self.assertEqual('md5:abcdef', result_cache.reads_fingerprint(reads1))
+        shutil.rmtree(tmp_dir)
+
+
+    def test_path_hash(self):
+        '''test path_hash'''
+        self.assertIsNone(result_cache.path_hash(None))
+        self.assertEqual(64, len(result_cache.path_hash(data_dir)))
+        self.assertNotEqual(result_cache.path_hash(data_dir), result_cache.path_hash(os.path.join(data_dir, 'run_res_callers.reads1')))
+
+
+    def test_get_and_put(self):
+        '''test get and put'''
+        tmp_dir = 'tmp.result_cache.get_and_put'
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        self.assertIsNone(result_cache.get(tmp_dir, 'abc'))
+        result_cache.put(tmp_dir, 'abc', {'x': 1})
+        self.assertEqual({'x': 1}, result_cache.get(tmp_dir, 'abc'))
+        self.assertTrue(os.path.exists(os.path.join(tmp_dir, 'ab', 'abc.json')))
+
+        # No raw output stored, so a miss if the raw output is wanted
+        raw_in = os.path.join(tmp_dir, 'raw_in.json')
+        raw_out = os.path.join(tmp_dir, 'raw_out.json')
+        self.assertIsNone(result_cache.get(tmp_dir, 'abc', raw_output_file=raw_out))
+        with open(raw_in, 'w') as f:
+            print('{"raw": 1}', file=f)
+        result_cache.put(tmp_dir, 'abc', {'x': 2}, raw_output_file=raw_in)
+        self.assertEqual({'x': 2}, result_cache.get(tmp_dir, 'abc', raw_output_file=raw_out))
+        with open(raw_out) as f:
+            self.assertEqual({'raw': 1}, json.load(f))
+        shutil.rmtree(tmp_dir)
+
+
+    def test_cache_key_options(self):
+        '''test cache_key only uses the options of the caller'''
+        reads1 = os.path.join(data_dir, 'run_res_callers.reads1')
+        reads2 = os.path.join(data_dir, 'run_res_callers.reads2')
+        with mock.patch.object(result_cache, 'tool_version', return_value='1.0'):
+            key = result_cache.cache_key('TB-Profiler', reads1, reads2)
+            self.assertEqual(key, result_cache.cache_key('TB-Profiler', reads1, reads2, mykrobe_panel='walker-2015', mykrobe_species='tb'))
+            key = result_cache.cache_key('Mykrobe', reads1, reads2, mykrobe_species='tb', mykrobe_panel='walker-2015')
+            self.assertNotEqual(key, result_cache.cache_key('Mykrobe', reads1, reads2, mykrobe_species='tb', mykrobe_panel='bradley-2015'))
+            self.assertEqual(key, result_cache.cache_key('Mykrobe', reads1, reads2, mykrobe_species='tb', mykrobe_panel='walker-2015', ariba_ref='/not/used'))
+            key = result_cache.cache_key('ARIBA', reads1, reads2, ariba_ref=data_dir)
+            self.assertNotEqual(key, result_cache.cache_key('ARIBA', reads1, reads2, ariba_ref=reads1))
+            self.assertEqual(key, result_cache.cache_key('ARIBA', reads1, reads2, ariba_ref=data_dir, mykrobe_panel='walker-2015'))
+
+
+    def test_res_caller_uses_cache(self):
+        '''test ResCaller.run uses the result cache'''
+        tmp_cache = 'tmp.result_cache.cache'
+        tmp_out = 'tmp.result_cache.out'
+        for d in tmp_cache, tmp_out:
+            if os.path.exists(d):
+                shutil.rmtree(d)
+        reads1 = os.path.join(data_dir, 'run_res_callers.reads1')
+        reads2 = os.path.join(data_dir, 'run_res_callers.reads2')
+        with mock.patch.object(result_cache, 'tool_version', return_value=None):
+            self.assertIsNone(result_cache.cache_key('KvarQ', reads1, reads2))
+
+        with mock.patch.object(result_cache, 'tool_version', return_value='kvarq 1.0'):
+            key = result_cache.cache_key('KvarQ', reads1, reads2)
+            self.assertNotEqual(key, result_cache.cache_key('KvarQ', reads1, reads2, command_line_opts='--foo'))
+            self.assertNotEqual(key, result_cache.cache_key('TB-Profiler', reads1, reads2))
+            cached = {'resistance_calls': {'Isoniazid': [['R', 'katG', 'S315T', None]]}, 'time_and_memory': {'wall_clock_time': 42.0}}
+            os.mkdir(tmp_out)
+            raw_output = {'analyses': {'MTBC/resistance': ['Isoniazid resistance [2155168CG=katG.S315T]']}}
+            with open(os.path.join(tmp_out, 'raw.json'), 'w') as f:
+                json.dump(raw_output, f)
+            result_cache.put(tmp_cache, key, cached, raw_output_file=os.path.join(tmp_out, 'raw.json'))
+            shutil.rmtree(tmp_out)
+            caller = res_caller.ResCaller('KvarQ', tmp_out)
+            caller.run(reads1, reads2, result_cache_dir=tmp_cache)
+
+        with open(os.path.join(tmp_out, 'summary.json')) as f:
+            got = json.load(f)
+        cached['from_result_cache'] = True
+        self.assertEqual(cached, got)
+        self.assertFalse(os.path.exists(os.path.join(tmp_out, 'command.out')))
+        # The raw output is restored, so the calls can be made again from it
+        with open(os.path.join(tmp_out, 'out.json')) as f:
+            self.assertEqual(raw_output, json.load(f))
+        self.assertEqual('unchanged', reparse.reparse_caller_dir('KvarQ', tmp_out)[0])
+        shutil.rmtree(tmp_cache)
+        shutil.rmtree(tmp_out)
@@ -1,4 +1,5 @@
 import filecmp
+import json
 import os
 import shutil
 import unittest
@@ -12,20 +13,38 @@ class TestRunResCallers(unittest.TestCase):
     def test_load_callers_file(self):
         '''test load_callers_file'''
         expected = [
-            run_res_callers.Caller('Mykrobe', False, 'dir0', 'staph', 'panel_name', '/path/to/probes', '/path/to/var_to_res', '--opt1 val1'),
-            run_res_callers.Caller('Mykrobe', True, 'dir1', 'staph', None, None, None, '--opt1 val1'),
-            run_res_callers.Caller('Mykrobe', True, 'dir2', 'tb', 'walker-2015', None, None, None),
-            run_res_callers.Caller('Mykrobe', False, 'dir3', 'tb', 'panel_name', '/path/to/probes', '/path/to/var_to_res', '--opt2 val2'),
-            run_res_callers.Caller('TB-Profiler', False, 'dir4', None, None, None, None, None),
-            run_res_callers.Caller('KvarQ', True, 'dir5', None, None, None, None, None),
-            run_res_callers.Caller('MTBseq', True, 'dir6', None, None, None, None, None),
-            run_res_callers.Caller('ARIBA', False, 'dir7', None, 'ref_dir', None, None, None),
+            run_res_callers.Caller('Mykrobe', False, 'dir0', 'staph', 'panel_name', '/path/to/probes', '/path/to/var_to_res', '--opt1 val1', 2, None),
+            run_res_callers.Caller('Mykrobe', True, 'dir1', 'staph', None, None, None, '--opt1 val1', 2, None),
+            run_res_callers.Caller('Mykrobe', True, 'dir2', 'tb', 'walker-2015', None, None, None, 2, None),
+            run_res_callers.Caller('Mykrobe', False, 'dir3', 'tb', 'panel_name', '/path/to/probes', '/path/to/var_to_res', '--opt2 val2', 2, None),
+            run_res_callers.Caller('TB-Profiler', False, 'dir4', None, None, None, None, None, 4, None),
+            run_res_callers.Caller('KvarQ', True, 'dir5', None, None, None, None, None, 1, None),
+            run_res_callers.Caller('MTBseq', True, 'dir6', None, None, None, None, None, 4, None),
+            run_res_callers.Caller('ARIBA', False, 'dir7', None, 'ref_dir', None, None, None, 2, None),
+            run_res_callers.Caller('KvarQ', False, 'dir8', None, None, None, None, None, 1, 2.5),
+            run_res_callers.Caller('TB-Profiler', False, 'dir9', None, None, None, None, '--threads 4', 4, None),
         ]
         infile = os.path.join(data_dir, 'load_callers_file.tsv')
         got = run_res_callers.load_callers_file(infile)
         self.assertEqual(expected, got)
 
 
+    def test_callers_that_fit(self):
+        '''test callers_that_fit'''
+        c1 = run_res_callers.Caller('KvarQ', False, 'c1', None, None, None, None, None, 1, 1.0)
+        c2 = run_res_callers.Caller('TB-Profiler', False, 'c2', None, None, None, None, None, 4, 8.0)
+        c3 = run_res_callers.Caller('MTBseq', False, 'c3', None, None, None, None, None, 2, None)
+        c4 = run_res_callers.Caller('Mykrobe', False, 'c4', None, None, None, None, None, 8, 20.0)
+        self.assertEqual([c2, c3, c1], run_res_callers.callers_that_fit([c1, c2, c3], 8, None, False))
+        self.assertEqual([c2, c1], run_res_callers.callers_that_fit([c1, c2, c3], 5, None, False))
+        self.assertEqual([c3, c1], run_res_callers.callers_that_fit([c1, c2, c3], 4, 5.0, False))
+        self.assertEqual([], run_res_callers.callers_that_fit([c1, c2, c3], 0, None, True))
+        # Too big for the budget, but still runs if nothing else is running
+        self.assertEqual([], run_res_callers.callers_that_fit([c4], 4, 10.0, True))
+        self.assertEqual([c4], run_res_callers.callers_that_fit([c4], 4, 10.0, False))
+        self.assertEqual([], run_res_callers.callers_that_fit([], 4, 10.0, False))
+
+
     def test_summary_json_from_all_callers(self):
         '''test summary_json_from_all_callers'''
         json_dict = {
@@ -39,6 +58,79 @@ class TestRunResCallers(unittest.TestCase):
         os.unlink(tmp_file)
 
 
+    def test_check_finished_callers_subsample(self):
+        '''test subsample_settings and check_finished_callers_subsample'''
+        self.assertIsNone(run_res_callers.subsample_settings(None))
+        info = {'method': 'first', 'target_depth': 10, 'genome_size': 42, 'pairs': 2, 'bases': 400, 'depth': 9.524}
+        first_10 = {'method': 'first', 'target_depth': 10}
+        self.assertEqual(first_10, run_res_callers.subsample_settings(info))
+        random_10 = {'method': 'random', 'target_depth': 10, 'seed': 1}
+        self.assertEqual(random_10, run_res_callers.subsample_settings(dict(info, method='random', seed=1)))
+
+        tmp_dir = 'tmp.check_finished_callers_subsample'
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.mkdir(tmp_dir)
+        summary_files = {x: os.path.join(tmp_dir, f'{x}.json') for x in ('full', 'sub', 'missing')}
+        with open(summary_files['full'], 'w') as f:
+            json.dump({'resistance_calls': {}}, f)
+        with open(summary_files['sub'], 'w') as f:
+            json.dump({'resistance_calls': {}, 'subsample': info}, f)
+
+        run_res_callers.check_finished_callers_subsample(summary_files, ['full', 'missing'], None)
+        run_res_callers.check_finished_callers_subsample(summary_files, ['sub', 'missing'], first_10)
+        run_res_callers.check_finished_callers_subsample(summary_files, [], first_10)
+        for finished, wanted in (['full'], first_10), (['sub'], None), (['sub'], random_10), (['sub'], {'method': 'first', 'target_depth': 20}):
+            with self.assertRaises(Exception):
+                run_res_callers.check_finished_callers_subsample(summary_files, finished, wanted)
+        shutil.rmtree(tmp_dir)
+
+
+    def test_run_res_caller_and_merge_sample_summary(self):
+        '''test run_res_caller and merge_sample_summary'''
+        callers_file = os.path.join(data_dir, 'run_res_callers.callers.tsv')
+        reads1 = os.path.join(data_dir, 'run_res_callers.reads1')
+        reads2 = os.path.join(data_dir, 'run_res_callers.reads2')
+        tmp_out = 'tmp.run_res_caller'
+        if os.path.exists(tmp_out):
+            shutil.rmtree(tmp_out)
+        os.mkdir(tmp_out)
+        # outdir3 has finished. outdir1 is running (no done file yet), and must
+        # not be deleted when working out the jobs for another caller
+        for outdir in 'outdir1', 'outdir3':
+            os.mkdir(os.path.join(tmp_out, outdir))
+        with open(os.path.join(tmp_out, 'outdir3', 'done'), 'w'):
+            pass
+        with open(os.path.join(tmp_out, 'outdir3', 'summary.json'), 'w') as f:
+            print('{"resistance_calls": {}}', file=f)
+
+        callers = run_res_callers.load_callers_file(callers_file)
+        summary_files, jobs = run_res_callers.caller_jobs_for_one_sample(callers, tmp_out, reads1, reads2, only_caller='outdir2')
+        self.assertEqual(['outdir1', 'outdir2', 'outdir3'], sorted(summary_files))
+        self.assertEqual(['outdir2'], [x[0].outdir_name for x in jobs])
+        # outdir2 is Mykrobe staph, which has no panel. It should not get
+        # the panel of the Mykrobe tb caller outdir1
+        self.assertIsNone(jobs[0][1][4])
+        self.assertTrue(os.path.exists(os.path.join(tmp_out, 'outdir1')))
+        summary_files, jobs = run_res_callers.caller_jobs_for_one_sample(callers, tmp_out, reads1, reads2, only_caller='outdir1')
+        self.assertEqual('walker-2015', jobs[0][1][4])
+
+        self.assertTrue(run_res_callers.run_res_caller(callers_file, 'outdir3', tmp_out, reads1, reads2, testing=True))
+        with self.assertRaises(Exception):
+            run_res_callers.run_res_caller(callers_file, 'not_a_caller', tmp_out, reads1, reads2, testing=True)
+
+        run_res_callers.merge_sample_summary(callers_file, tmp_out)
+        with open(os.path.join(tmp_out, 'summary.json')) as f:
+            got = json.load(f)
+        expected = {
+            'outdir1': {'Success': False},
+            'outdir2': {'Success': False},
+            'outdir3': {'resistance_calls': {}, 'Success': True},
+        }
+        self.assertEqual(expected, got)
+        shutil.rmtree(tmp_out)
+
+
     def test_run_res_callers(self):
         '''test run_res_callers'''
         callers_file = os.path.join(data_dir, 'run_res_callers.callers.tsv')
@@ -63,3 +155,18 @@ class TestRunResCallers(unittest.TestCase):
         self.assertTrue(os.path.exists(os.path.join(tmp_out, 'outdir6', 'summary.json')))
         shutil.rmtree(tmp_out)
 
+
+
+    def test_run_res_callers_concurrently(self):
+        '''test run_res_callers with threads > 1'''
+        callers_file = os.path.join(data_dir, 'run_res_callers.callers.tsv')
+        reads1 = os.path.join(data_dir, 'run_res_callers.reads1')
+        reads2 = os.path.join(data_dir, 'run_res_callers.reads2')
+        tmp_out = 'tmp.run_res_callers_concurrently'
+        run_res_callers.run_res_callers(callers_file, tmp_out, reads1, reads2, testing=True, threads=3, ram=10)
+        for outdir in 'outdir1', 'outdir2', 'outdir3':
+            self.assertTrue(os.path.exists(os.path.join(tmp_out, outdir, 'command.out')))
+            self.assertTrue(os.path.exists(os.path.join(tmp_out, outdir, 'summary.json')))
+            self.assertTrue(os.path.exists(os.path.join(tmp_out, outdir, 'done')))
+        self.assertTrue(os.path.exists(os.path.join(tmp_out, 'summary.json')))
+        shutil.rmtree(tmp_out)
@@ -0,0 +1,40 @@
+import os
+import unittest
+
+from evalrescallers import pipeline_output_dir, sample_index
+
+
+class TestSampleIndex(unittest.TestCase):
+    def test_add_and_get(self):
+        '''test add_samples and get'''
+        tmp_db = 'tmp.sample_index.add_and_get.db'
+        if os.path.exists(tmp_db):
+            os.unlink(tmp_db)
+        number_to_dir = pipeline_output_dir.PipelineOutputDir.sample_number_to_dir
+
+        with sample_index.SampleIndex(tmp_db, samples_per_dir=2) as index:
+            got = index.add_samples([{'name': 's1', 'reads': ['r1', 'r2']}, {'name': 's2', 'reads': ['r3', 'r4']}], number_to_dir)
+            expected = [
+                {'name': 's1', 'reads': ['r1', 'r2'], 'number': 0, 'dir': os.path.join('0', '0')},
+                {'name': 's2', 'reads': ['r3', 'r4'], 'number': 1, 'dir': os.path.join('0', '1')},
+            ]
+            self.assertEqual(expected, got)
+
+            # A batch with a name already in the index adds nothing
+            with self.assertRaises(Exception):
+                index.add_samples([{'name': 's3', 'reads': ['r5', 'r6']}, {'name': 's1', 'reads': ['r7', 'r8']}], number_to_dir)
+            self.assertEqual(2, len(index))
+
+        # samples_per_dir is stored in the file, and the next number is
+        # after the biggest number already used
+        with sample_index.SampleIndex(tmp_db, samples_per_dir=42) as index:
+            self.assertEqual(2, index.samples_per_dir)
+            index.add_samples([{'name': 's3', 'reads': ['r5', 'r6']}], number_to_dir)
+            self.assertEqual({'name': 's3', 'reads': ['r5', 'r6'], 'number': 2, 'dir': os.path.join('1', '2')}, index.get('s3'))
+            self.assertEqual(expected[1], index.get_by_number(1))
+            self.assertIsNone(index.get('not_there'))
+            self.assertEqual(['s1', 's2', 's3'], [x['name'] for x in index])
+
+        for filename in tmp_db, tmp_db + '-wal', tmp_db + '-shm':
+            if os.path.exists(filename):
+                os.unlink(filename)
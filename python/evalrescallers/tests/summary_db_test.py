@@ -0,0 +1,83 @@
+import os
+import unittest
+
+from evalrescallers import summary_db
+
+
+sample_data = {
+    'Mykrobe': {
+        'Success': True,
+        'resistance_calls': {
+            'Ethambutol': [['R', 'embB', 'M306I', {'conf': 42, 'ref_depth': 0, 'alt_depth': 6, 'expected_depth': 7}]],
+            'Isoniazid': [['S', None, None, {}]],
+        },
+        'time_and_memory': {'ram': 100.0, 'system_time': 1.0, 'user_time': 2.0, 'wall_clock_time': 3.0},
+    },
+    'KvarQ': {
+        'Success': True,
+        'resistance_calls': {
+            'Rifampicin': [['R', 'rpoB', 'S450L', None], ['R', 'rpoB', 'H445Y', None]],
+        },
+        'time_and_memory': {'ram': 10.0, 'system_time': 0.1, 'user_time': 0.2, 'wall_clock_time': 0.3},
+    },
+    'TB-Profiler': {'Success': False},
+}
+
+
+class TestSummaryDb(unittest.TestCase):
+    def test_sample_summary_to_rows(self):
+        '''test sample_summary_to_rows'''
+        expect = [
+            ('s1', 'KvarQ', 'Rifampicin', 'R', 'rpoB', 'S450L', None, None, None, None, 0.3, 0.2, 0.1, 10.0, 1),
+            ('s1', 'KvarQ', 'Rifampicin', 'R', 'rpoB', 'H445Y', None, None, None, None, 0.3, 0.2, 0.1, 10.0, 1),
+            ('s1', 'Mykrobe', 'Ethambutol', 'R', 'embB', 'M306I', 42, 0, 6, 7, 3.0, 2.0, 1.0, 100.0, 1),
+            ('s1', 'Mykrobe', 'Isoniazid', 'S', None, None, None, None, None, None, 3.0, 2.0, 1.0, 100.0, 1),
+            ('s1', 'TB-Profiler', None, None, None, None, None, None, None, None, None, None, None, None, 0),
+        ]
+        got = list(summary_db.sample_summary_to_rows('s1', sample_data))
+        self.assertEqual(expect, got)
+
+
+    def test_summary_db(self):
+        '''test SummaryDb'''
+        tmp_db = 'tmp.summary_db.sqlite'
+        db = summary_db.SummaryDb(tmp_db)
+        db.add_sample('s1', sample_data)
+        db.add_sample('s2', {'KvarQ': sample_data['KvarQ']})
+        self.assertFalse(os.path.exists(tmp_db))
+        db.close()
+        self.assertFalse(os.path.exists(tmp_db + '.tmp'))
+
+        got = summary_db.query(tmp_db, 'SELECT sample, variant FROM calls WHERE drug=? ORDER BY sample, variant', ('Rifampicin',))
+        expect = [
+            {'sample': 's1', 'variant': 'H445Y'},
+            {'sample': 's1', 'variant': 'S450L'},
+            {'sample': 's2', 'variant': 'H445Y'},
+            {'sample': 's2', 'variant': 'S450L'},
+        ]
+        self.assertEqual(expect, got)
+        got = summary_db.query(tmp_db, 'SELECT COUNT(*) AS n FROM calls WHERE success=0')
+        self.assertEqual([{'n': 1}], got)
+        got = summary_db.query(tmp_db, "SELECT name FROM sqlite_master WHERE type='index' ORDER BY name")
+        self.assertEqual([{'name': 'calls_caller'}, {'name': 'calls_drug'}, {'name': 'calls_sample'}], got)
+        os.unlink(tmp_db)
+
+
+    def test_summary_store(self):
+        '''test SummaryStore'''
+        tmp_db = 'tmp.summary_db.summary_store.sqlite'
+        with summary_db.SummaryStore(tmp_db) as store:
+            store.add_sample('s2', {'KvarQ': sample_data['KvarQ']})
+            store.add_sample('s1', {'TB-Profiler': sample_data['TB-Profiler']})
+            got = summary_db.query(tmp_db, 'SELECT COUNT(*) AS n FROM calls')
+            self.assertEqual([{'n': 3}], got)
+            store.add_sample('s1', sample_data)
+            self.assertEqual({'s1', 's2'}, store.samples())
+            self.assertEqual([('s1', sample_data), ('s2', {'KvarQ': sample_data['KvarQ']})], list(store.iter_sample_summaries()))
+            store.finalize()
+
+        got = summary_db.query(tmp_db, 'SELECT COUNT(*) AS n FROM calls')
+        self.assertEqual([{'n': 7}], got)
+        got = summary_db.query(tmp_db, "SELECT name FROM sqlite_master WHERE type='index' ORDER BY name")
+        self.assertEqual([{'name': 'calls_caller'}, {'name': 'calls_drug'}, {'name': 'calls_sample'}], got)
+        os.unlink(tmp_db)
@@ -1,7 +1,9 @@
 import os
+import shutil
 import unittest
+from unittest import mock
 
-from evalrescallers import ten_k_validation_data
+from evalrescallers import ten_k_validation_data, truth_data_cache
 
 modules_dir = os.path.dirname(os.path.abspath(ten_k_validation_data.__file__))
 data_dir = os.path.join(modules_dir, 'tests', 'data', 'ten_k_validation_data')
@@ -71,3 +73,32 @@ class TestTenKValidationData(unittest.TestCase):
 
         self.assertEqual(expect_predict, got_predict)
 
+
+    def test_load_all_data_matrices(self):
+        '''test load_all_data_matrices'''
+        tmp_cache = os.path.abspath('tmp.load_all_data_matrices.cache')
+        drugs, pheno_validation, pheno_test, predict = ten_k_validation_data.load_all_data()
+        sources = ten_k_validation_data.load_sources_file(ten_k_validation_data.sources_file)
+
+        with mock.patch.dict(os.environ, {'EVALRESCALLERS_CACHE_DIR': tmp_cache}):
+            ten_k_validation_data.load_all_data_matrices.cache_clear()
+            got = ten_k_validation_data.load_all_data_matrices()
+            ten_k_validation_data.load_all_data_matrices.cache_clear()
+            got_from_cache = ten_k_validation_data.load_all_data_matrices()
+            ten_k_validation_data.load_all_data_matrices.cache_clear()
+
+        for field in ten_k_validation_data.TenKMatrices._fields:
+            self.assertEqual(getattr(got, field).tolist(), getattr(got_from_cache, field).tolist())
+
+        self.assertEqual(sorted(drugs), got.drugs.tolist())
+        self.assertEqual(sorted(set(pheno_validation).union(pheno_test)), got.samples.tolist())
+        to_int = {'R': truth_data_cache.RESISTANT, 'S': truth_data_cache.SUSCEPTIBLE}
+        for i, sample in enumerate(got.samples):
+            self.assertEqual(sample in pheno_test, got.is_test[i])
+            self.assertEqual(sources.get(sample, ('', ''))[1], got.country[i])
+            pheno = pheno_test[sample] if sample in pheno_test else pheno_validation[sample]
+            for j, drug in enumerate(got.drugs):
+                self.assertEqual(to_int.get(pheno.get(drug), truth_data_cache.MISSING), got.pheno[i, j])
+                self.assertEqual(to_int.get(predict.get(sample, {}).get(drug), truth_data_cache.MISSING), got.predict[i, j])
+
+        shutil.rmtree(tmp_cache)
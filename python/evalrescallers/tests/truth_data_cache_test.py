@@ -0,0 +1,64 @@
+import os
+import shutil
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from evalrescallers import truth_data_cache
+
+
+class TestTruthDataCache(unittest.TestCase):
+    def test_pheno_dict_to_matrix(self):
+        '''test pheno_dict_to_matrix'''
+        pheno = {
+            's1': {'d1': 'R', 'd2': 'S', 'd3': 'n/a'},
+            's2': {'d2': 'U', 'd4': 'R'},
+        }
+        got = truth_data_cache.pheno_dict_to_matrix(pheno, ['s1', 's2', 's3'], ['d1', 'd2', 'd3'])
+        expect = np.array([[1, 0, -1], [-1, -1, -1], [-1, -1, -1]], dtype=np.int8)
+        np.testing.assert_array_equal(expect, got)
+        self.assertEqual(np.int8, got.dtype)
+
+
+    def test_load_or_build(self):
+        '''test load_or_build'''
+        tmp_dir = os.path.abspath('tmp.truth_data_cache')
+        os.mkdir(tmp_dir)
+        source_file = os.path.join(tmp_dir, 'source.txt')
+        with open(source_file, 'w') as f:
+            print('foo', file=f)
+
+        calls = []
+        def build():
+            calls.append(1)
+            return {'x': np.array([len(calls)]), 'names': np.array(['a', 'b'])}
+
+        with mock.patch.dict(os.environ, {'EVALRESCALLERS_CACHE_DIR': os.path.join(tmp_dir, 'cache')}):
+            got = truth_data_cache.load_or_build('test', [source_file], build)
+            self.assertEqual([1], list(got['x']))
+            self.assertEqual(['a', 'b'], list(got['names']))
+            got = truth_data_cache.load_or_build('test', [source_file], build)
+            self.assertEqual([1], list(got['x']))
+            self.assertEqual(1, len(calls))
+            self.assertFalse(got['x'].flags.writeable)
+            with self.assertRaises(ValueError):
+                got['x'][0] = 42
+
+            # Changing the build version or the cache format makes a new cache file
+            got = truth_data_cache.load_or_build('test', [source_file], build, build_version=2)
+            self.assertEqual([2], list(got['x']))
+            self.assertFalse(got['x'].flags.writeable)
+            with mock.patch.object(truth_data_cache, 'cache_format_version', 2):
+                got = truth_data_cache.load_or_build('test', [source_file], build)
+            self.assertEqual([3], list(got['x']))
+            self.assertEqual(3, len(calls))
+
+            # Changing the source file makes a new cache file
+            with open(source_file, 'w') as f:
+                print('bar', file=f)
+            got = truth_data_cache.load_or_build('test', [source_file], build)
+            self.assertEqual([4], list(got['x']))
+            self.assertEqual(4, len(os.listdir(os.path.join(tmp_dir, 'cache'))))
+
+        shutil.rmtree(tmp_dir)
@@ -0,0 +1,89 @@
+import json
+import os
+import unittest
+
+from evalrescallers import caller_adapters, variant_parsers
+
+
+class TestVariantParsers(unittest.TestCase):
+    def test_kvarq_var_string_parser(self):
+        '''test kvarq_var_string_parser'''
+        self.assertEqual(('Isoniazid', 'inhA', 'promoter mutation -15'), variant_parsers.kvarq_var_string_parser('Isoniazid resistance::SNP1673425CT=inhA promoter mutation -15'))
+        self.assertEqual(('Ethambutol', 'embB', 'M306I'), variant_parsers.kvarq_var_string_parser('Ethambutol resistance::SNP4247431GC=embB.M306I'))
+        self.assertEqual(('Rifampicin', 'rpoB', 'S450L'), variant_parsers.kvarq_var_string_parser('Rifampicin resistance (RRDR) [761155CT=rpoB.S450L]'))
+        self.assertEqual((None, None, None), variant_parsers.kvarq_var_string_parser('remark: something'))
+
+        failures = []
+        bad_string = 'Fluoroquinolones resistance (QRDR) [7564GC=gyrA.G88A [NONE OF MUTATIONS DOCUMENTED IN REFERENCE]]'
+        for i in range(2):
+            got = variant_parsers.kvarq_var_string_parser(bad_string, failures=failures)
+            self.assertEqual(('Fluoroquinolones', 'Parse_error', 'Parse_error'), got)
+        self.assertEqual([variant_parsers.ParseFailure('KvarQ', bad_string, 'no variant found')] * 2, failures)
+
+        with self.assertLogs(level='WARNING') as logs:
+            variant_parsers.kvarq_var_string_parser(bad_string)
+        self.assertIn('KvarQ', logs.output[0])
+        self.assertNotIn('TB-Profiler', logs.output[0])
+
+        for bad_string in 'Isoniazid', 'Isoniazid resistance::SNP1=a.b.c', 'Isoniazid resistance::SNP1=katG':
+            with self.assertRaises(variant_parsers.VariantParseError):
+                variant_parsers.kvarq_var_string_parser(bad_string)
+
+
+    def test_tb_profiler_var_string_parser(self):
+        '''test tb_profiler_var_string_parser'''
+        self.assertEqual('C42G', variant_parsers.tb_profiler_var_string_parser('42C>42G'))
+        self.assertEqual('G-17T', variant_parsers.tb_profiler_var_string_parser('-17G>T'))
+        for bad_string in '42C<42G', '42>42G', '42C>42', '42C>43G', 'C>G', '42C>42G>G':
+            with self.assertRaises(variant_parsers.VariantParseError):
+                variant_parsers.tb_profiler_var_string_parser(bad_string)
+
+
+    def test_mykrobe_called_by_parser(self):
+        '''test mykrobe_called_by_parser'''
+        self.assertEqual(('embB', 'Q497R'), variant_parsers.mykrobe_called_by_parser('embB_Q497R-Q497R'))
+        self.assertEqual(('fabG1', 'C-15X-C'), variant_parsers.mykrobe_called_by_parser('fabG1_C-15X-C'))
+        self.assertEqual(('mecA', 'NA'), variant_parsers.mykrobe_called_by_parser('mecA'))
+        for bad_string in 'embB_Q497R-Q497K', 'embB_Q497R_Q497R':
+            with self.assertRaises(variant_parsers.VariantParseError):
+                variant_parsers.mykrobe_called_by_parser(bad_string)
+
+
+    def test_count_and_report_failures(self):
+        '''test count_failures and report_failures'''
+        failures = [
+            variant_parsers.ParseFailure('KvarQ', 'a', 'no variant found'),
+            variant_parsers.ParseFailure('KvarQ', 'b', 'no variant found'),
+            variant_parsers.ParseFailure('Other', 'c', 'reason'),
+        ]
+        expected = {('KvarQ', 'no variant found'): 2, ('Other', 'reason'): 1}
+        self.assertEqual(expected, variant_parsers.count_failures(failures))
+
+        with self.assertLogs(level='WARNING') as logs:
+            variant_parsers.report_failures(failures, 'file.json')
+        self.assertEqual(1, len(logs.output))
+        self.assertIn('Could not parse 3 variant strings from file.json', logs.output[0])
+        self.assertIn('KvarQ "no variant found": 2 (eg "a")', logs.output[0])
+
+
+    def test_kvarq_parse_output_failures(self):
+        '''test KvarQ parse_output with parse failures'''
+        tmp_json = 'tmp.variant_parsers.kvarq.json'
+        bad_string = 'Fluoroquinolones resistance (QRDR) [7564GC=gyrA.G88A [NONE OF MUTATIONS DOCUMENTED IN REFERENCE]]'
+        with open(tmp_json, 'w') as f:
+            json.dump({'analyses': {'MTBC/resistance': ['Ethambutol resistance::SNP4247431GC=embB.M306I', bad_string]}}, f)
+        adapter = caller_adapters.get_adapter('KvarQ')
+        expected = {
+            'Ethambutol': [('R', 'embB', 'M306I', None)],
+            'Quinolones': [('R', 'Parse_error', 'Parse_error', None)],
+        }
+
+        failures = []
+        self.assertEqual(expected, adapter.parse_output(tmp_json, failures=failures))
+        self.assertEqual([variant_parsers.ParseFailure('KvarQ', bad_string, 'no variant found')], failures)
+
+        with self.assertLogs(level='WARNING') as logs:
+            self.assertEqual(expected, adapter.parse_output(tmp_json))
+        self.assertEqual(1, len(logs.output))
+        self.assertIn(tmp_json, logs.output[0])
+        os.unlink(tmp_json)
@@ -1,6 +1,9 @@
+import itertools
 import os
 import unittest
 
+import numpy as np
+
 from evalrescallers import who_treatment
 
 modules_dir = os.path.dirname(os.path.abspath(who_treatment.__file__))
@@ -145,3 +148,41 @@ class TestWhoTreatment(unittest.TestCase):
         dst2 = who_treatment.DstProfile(phenos)
         self.assertTrue(dst1.has_same_regimen(dst2))
 
+
+    def test_regimen_numbers(self):
+        '''test regimen_numbers'''
+        # Check every combination of the first line drugs and Moxifloxacin,
+        # plus the case that needs Kanamycin etc to get regimen 7
+        drugs = ['Ofloxacin', 'Isoniazid', 'Rifampicin', 'Pyrazinamide', 'Ethambutol', 'Moxifloxacin']
+        rows = [list(x) for x in itertools.product((-1, 0, 1), repeat=len(drugs))]
+        matrix = np.array(rows, dtype=np.int8)
+        got = who_treatment.regimen_numbers(matrix, drugs)
+        to_pheno = {-1: None, 0: 'S', 1: 'R'}
+        for row, got_regimen in zip(rows, got):
+            profile = who_treatment.DstProfile({drug: to_pheno[x] for drug, x in zip(drugs, row)})
+            expect = who_treatment.NO_REGIMEN if profile.regimen is None else profile.regimen.number
+            self.assertEqual(expect, got_regimen)
+
+        drugs = ['Isoniazid', 'Rifampicin', 'Pyrazinamide', 'Ethambutol', 'Kanamycin', 'Amikacin', 'Capreomycin', 'Streptomycin']
+        matrix = np.array([[1, 0, 1, 1, 1, 1, 1, 0], [1, 0, 1, 1, 1, 1, 1, 1]], dtype=np.int8)
+        self.assertEqual([7, 6], who_treatment.regimen_numbers(matrix, drugs).tolist())
+
+
+    def test_batch_has_same_regimen(self):
+        '''test batch has_same_regimen'''
+        got = who_treatment.has_same_regimen([0, 0, 1, 1, 2], [0, 1, 1, 2, 2])
+        self.assertEqual([False, False, True, False, True], got.tolist())
+
+
+    def test_regimen_concordance(self):
+        '''test regimen_concordance'''
+        drugs = ['Isoniazid', 'Rifampicin', 'Pyrazinamide', 'Ethambutol']
+        pheno = np.array([[0, 0, 0, 0], [1, 0, 0, 0], [-1, 0, 0, 0]], dtype=np.int8)
+        caller1 = np.array([[0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0]], dtype=np.int8)
+        caller2 = np.array([[0, 0, 0, 0], [1, 0, 0, 0], [1, 0, 0, 0]], dtype=np.int8)
+        got = who_treatment.regimen_concordance(pheno, {'c1': caller1, 'c2': caller2}, drugs)
+        expect = {
+            'c1': {'same': 1, 'different': 1, 'no_regimen': 1},
+            'c2': {'same': 2, 'different': 0, 'no_regimen': 1},
+        }
+        self.assertEqual(expect, got)
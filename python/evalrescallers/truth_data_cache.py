@@ -0,0 +1,93 @@
+import hashlib
+import logging
+import os
+
+import numpy as np
+
+# Phenotypes are stored in samples x drugs int8 matrices, using these values.
+# Anything that is not R or S (eg "n/a", "U", or no data) is MISSING
+SUSCEPTIBLE = 0
+RESISTANT = 1
+MISSING = -1
+pheno_to_int = {'S': SUSCEPTIBLE, 'R': RESISTANT}
+
+# Part of the name of every cache file. Change this if the values above or
+# the way arrays are saved are changed, so that old cache files are not used
+cache_format_version = 1
+
+
+def cache_dir():
+    '''Directory used to store the cache files. Set by the environment
+    variable EVALRESCALLERS_CACHE_DIR, default is ~/.cache/evalrescallers'''
+    default = os.path.join(os.path.expanduser('~'), '.cache', 'evalrescallers')
+    return os.path.abspath(os.environ.get('EVALRESCALLERS_CACHE_DIR', default))
+
+
+def files_hash(filenames):
+    '''Returns hash of the names and contents of the files'''
+    sha = hashlib.sha256()
+    for filename in filenames:
+        sha.update(os.path.basename(filename).encode())
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(1_048_576), b''):
+                sha.update(chunk)
+    return sha.hexdigest()
+
+
+def pheno_dict_to_matrix(sample_to_pheno, samples, drugs):
+    '''Returns samples x drugs int8 matrix, made from
+    dict of sample -> drug -> phenotype string'''
+    matrix = np.full((len(samples), len(drugs)), MISSING, dtype=np.int8)
+    drug_to_column = {drug: i for i, drug in enumerate(drugs)}
+    for row, sample in enumerate(samples):
+        for drug, pheno in sample_to_pheno.get(sample, {}).items():
+            if pheno in pheno_to_int and drug in drug_to_column:
+                matrix[row, drug_to_column[drug]] = pheno_to_int[pheno]
+    return matrix
+
+
+def cache_key(source_files, build_version):
+    '''Returns the hash used in the name of the cache file, made from the
+    contents of source_files, cache_format_version and build_version'''
+    sha = hashlib.sha256()
+    sha.update(f'{cache_format_version}.{build_version}.'.encode())
+    sha.update(files_hash(source_files).encode())
+    return sha.hexdigest()
+
+
+def _read_only(arrays):
+    for array in arrays.values():
+        array.flags.writeable = False
+    return arrays
+
+
+def load_or_build(name, source_files, build_function, build_version=1):
+    '''Returns dict of name -> numpy array. If there is a cache file made from
+    the current contents of source_files and the same build_version, the arrays
+    are loaded from it. Otherwise, build_function() is called to make the dict
+    of arrays, and they are saved to a new cache file. Change build_version
+    whenever build_function makes different arrays from the same files (eg
+    different columns or column order). The cache file is written under a
+    temporary name and then renamed, so that other processes using the cache
+    at the same time never see a partial file. The returned arrays are read
+    only, because they can be shared by all callers'''
+    cache_file = os.path.join(cache_dir(), f'{name}.{cache_key(source_files, build_version)}.npz')
+
+    if os.path.exists(cache_file):
+        try:
+            with np.load(cache_file, allow_pickle=False) as npz:
+                return _read_only({k: npz[k] for k in npz.files})
+        except Exception:
+            logging.warning(f'Error loading cache file {cache_file}. Remaking it')
+
+    arrays = build_function()
+
+    try:
+        os.makedirs(cache_dir(), exist_ok=True)
+        tmp_file = f'{cache_file}.{os.getpid()}.tmp.npz'
+        np.savez(tmp_file, **arrays)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        logging.warning(f'Could not write cache file {cache_file}. Continuing without it')
+
+    return _read_only(arrays)
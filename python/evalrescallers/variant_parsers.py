@@ -0,0 +1,158 @@
+import collections
+import functools
+import logging
+import re
+
+# Parsers of the variant strings in the output of the callers. The same
+# few hundred catalogue variants are seen again and again across samples,
+# so results are cached. The cached functions must not log or change
+# anything, because they are not run again for a string seen before
+
+cache_size = 8192
+
+kvarq_drug_regex = re.compile(r'''^\s*(?P<drug>\S+)\s+(?P<the_rest>\S.*)$''', re.DOTALL)
+kvarq_after_colon_or_equals_regex = re.compile(r'''[^:=]*$''')
+kvarq_gene_dot_variant_regex = re.compile(r'''^(?P<gene>[^.]*)\.(?P<variant>[^.]*)$''')
+kvarq_gene_space_variant_regex = re.compile(r'''^\s*(?P<gene>\S+)\s+(?P<variant>\S.*)$''', re.DOTALL)
+kvarq_var_with_square_brackets_regex = re.compile(r'''^resistance.*\[.*=(?P<gene>.*)\.(?P<variant>[A-Z0-9]+)\]$''')
+tb_profiler_change_regex = re.compile(r'''^(?P<position>-?\d*)(?P<sequence>[A-Z\*]+)$''')
+mykrobe_called_by_regex = re.compile(r'''^(?P<gene>[^_]*)_(?P<change>[^_]*)$''')
+
+
+class VariantParseError(Exception):
+    '''Raised when a variant string from a caller is not in the expected format'''
+    pass
+
+
+# A variant string that could not be parsed, but did not stop the rest of
+# the file being parsed. reason is a short fixed description, so that
+# failures can be counted by type
+ParseFailure = collections.namedtuple('ParseFailure', ['caller', 'var_string', 'reason'])
+
+
+def count_failures(failures):
+    '''Returns Counter of (caller, reason) -> number of failures, from a
+    list of ParseFailure'''
+    return collections.Counter((x.caller, x.reason) for x in failures)
+
+
+def report_failures(failures, source):
+    '''Logs one warning with the number of each type of failure in the list
+    failures (of ParseFailure), with an example variant string of each.
+    source is where the failures came from (eg the file name).
+    Does nothing if the list is empty'''
+    if len(failures) == 0:
+        return
+
+    examples = {}
+    for failure in failures:
+        examples.setdefault((failure.caller, failure.reason), failure.var_string)
+    counts = [f'{caller} "{reason}": {n} (eg "{examples[(caller, reason)]}")' for (caller, reason), n in sorted(count_failures(failures).items())]
+    logging.warning(f'Could not parse {len(failures)} variant strings from {source}. ' + '; '.join(counts))
+
+
+@functools.lru_cache(maxsize=cache_size)
+def _parse_kvarq(var_string):
+    # Returns tuple (drug, gene, variant, reason). reason is None,
+    # unless the variant could not be found in the string
+    if var_string.startswith('remark'):
+        return None, None, None, None
+    elif 'resistance' not in var_string:
+        raise VariantParseError(f'Cannot parse line of KvarQ output: {var_string}')
+
+    match = kvarq_drug_regex.search(var_string)
+    if match is None:
+        raise VariantParseError(f'Cannot get drug from line of KvarQ output: {var_string}')
+    drug, the_rest = match.group('drug', 'the_rest')
+
+    if '::' in the_rest:
+        # looks like one of these:
+        #   Isoniazid resistance::SNP1673425CT=inhA promoter mutation -15'
+        #   Ethambutol resistance::SNP4247431GC=embB.M306I
+        if '=' in the_rest:
+            gene_and_mutation = kvarq_after_colon_or_equals_regex.search(the_rest).group()
+            if '.' in gene_and_mutation:
+                match = kvarq_gene_dot_variant_regex.search(gene_and_mutation)
+            else:
+                match = kvarq_gene_space_variant_regex.search(gene_and_mutation)
+            if match is None:
+                raise VariantParseError(f'Cannot get gene and variant from line of KvarQ output: {var_string}')
+            return drug, match.group('gene'), match.group('variant'), None
+    else:
+        # looks like:
+        #   Isoniazid resistance [2155168CG=katG.S315T]
+        #   Rifampicin resistance (RRDR) [761155CT=rpoB.S450L]
+        match = kvarq_var_with_square_brackets_regex.search(the_rest)
+
+        if match is not None:
+            return drug, match.group('gene'), match.group('variant'), None
+
+    return drug, 'Parse_error', 'Parse_error', 'no variant found'
+
+
+def kvarq_var_string_parser(var_string, failures=None):
+    '''Returns tuple (drug, gene, variant) from one line of the
+    MTBC/resistance list in KvarQ output, or (None, None, None) for a
+    remark line. If the drug is found but not the variant, gene and variant
+    are "Parse_error", and a ParseFailure is added to the list failures
+    (or logged if failures is None). Raises VariantParseError for lines that
+    cannot be parsed at all'''
+    drug, gene, variant, reason = _parse_kvarq(var_string)
+    if reason is not None:
+        failure = ParseFailure('KvarQ', var_string, reason)
+        if failures is None:
+            report_failures([failure], 'KvarQ output')
+        else:
+            failures.append(failure)
+    return drug, gene, variant
+
+
+@functools.lru_cache(maxsize=cache_size)
+def tb_profiler_var_string_parser(var_string):
+    '''Returns the variant in the same style as the other callers (eg C42G),
+    from a variant string from TB-Profiler (eg 42C>42G or 42C>G).
+    Raises VariantParseError if it is not in that format'''
+    if '>' not in var_string:
+        raise VariantParseError(f'Expected ">" in variant string from TB-Profiler, but got "{var_string}"')
+
+    change_before, _, change_after = var_string.partition('>')
+    match_before = tb_profiler_change_regex.search(change_before)
+    match_after = tb_profiler_change_regex.search(change_after)
+
+    if match_before is None or match_after is None:
+        raise VariantParseError(f'Error using regex on variant string "{var_string}" from TB-Profiler')
+
+    position_before, sequence_before = match_before.group('position', 'sequence')
+    position_after, sequence_after = match_after.group('position', 'sequence')
+
+    if len(position_before) == 0:
+        raise VariantParseError(f'Could not get position of variant from "{var_string}" from TB-Profiler')
+
+    if len(position_after) > 0 and position_before != position_after:
+        raise VariantParseError(f'Positions not the same in variant string "{var_string}" from TB-Profiler')
+
+    return sequence_before + position_before + sequence_after
+
+
+@functools.lru_cache(maxsize=cache_size)
+def mykrobe_called_by_parser(variant):
+    '''Returns tuple (gene, change) from a key of "called_by" in Mykrobe
+    output. Presence of a gene just has the gene name, and the change is "NA".
+    Variant calls have an underscore, and most look like this: embB_Q497R-Q497R.
+    But have also seen this: fabG1_C-15X-C, where the whole change is kept.
+    Raises VariantParseError if it is not in one of these formats'''
+    if '_' not in variant:
+        return variant, 'NA'
+
+    match = mykrobe_called_by_regex.search(variant)
+    if match is None:
+        raise VariantParseError(f'Unexpected format in "called_by" key: {variant}')
+    gene, change = match.group('gene', 'change')
+
+    changes = change.split('-')
+    if len(changes) == 2:
+        if changes[0] != changes[1]:
+            raise VariantParseError(f'Unexpected format in "called_by" key: {variant}')
+        return gene, changes[0]
+    else:
+        return gene, change
@@ -1,4 +1,10 @@
 from collections import namedtuple
+import functools
+import itertools
+
+import numpy as np
+
+from evalrescallers import truth_data_cache
 
 profile_drugs = {
     'Isoniazid': 'H',
@@ -250,3 +256,87 @@ class DstProfile:
     def has_same_regimen(self, other):
         return self.regimen != None and other.regimen != None and self.regimen.number == other.regimen.number
 
+
+# The only drugs used by DstProfile._set_regimen to choose the regimen.
+# The batch functions below use a lookup table over all combinations of
+# R/S/None for these drugs
+regimen_drugs = (
+    'Isoniazid',
+    'Rifampicin',
+    'Pyrazinamide',
+    'Ethambutol',
+    'Moxifloxacin',
+    'Kanamycin',
+    'Amikacin',
+    'Capreomycin',
+    'Streptomycin',
+)
+
+NO_REGIMEN = 0
+
+
+@functools.lru_cache(maxsize=None)
+def regimen_lookup_table():
+    '''Returns array of regimen numbers (NO_REGIMEN if there is no regimen),
+    with one element per combination of phenotypes of regimen_drugs.
+    The index of a combination is sum(code[i] * 3**i), where code[i] is 0, 1,
+    2 for S, R, None for regimen_drugs[i]'''
+    table = np.zeros(3 ** len(regimen_drugs), dtype=np.uint8)
+    for index, phenos in enumerate(itertools.product((None, 'R', 'S'), repeat=len(regimen_drugs))):
+        # product() varies the last element fastest, so reverse to make
+        # the first drug the least significant digit
+        phenos = {drug: pheno for drug, pheno in zip(regimen_drugs, reversed(phenos))}
+        codes = [{'S': 0, 'R': 1, None: 2}[phenos[drug]] for drug in regimen_drugs]
+        regimen = DstProfile(phenos).regimen
+        table[sum(code * 3 ** i for i, code in enumerate(codes))] = NO_REGIMEN if regimen is None else regimen.number
+    return table
+
+
+def regimen_numbers(pheno_matrix, drugs):
+    '''Returns array of regimen numbers, one per sample (ie row) of
+    pheno_matrix, which is a samples x drugs matrix of phenotypes using the
+    values in truth_data_cache. drugs = list of drug names of the columns.
+    Missing drugs are treated as having no phenotype. Gives the same
+    regimens as making a DstProfile for each sample, but with NO_REGIMEN
+    instead of None'''
+    pheno_matrix = np.asarray(pheno_matrix)
+    drug_to_column = {drug: i for i, drug in enumerate(drugs)}
+    index = np.zeros(pheno_matrix.shape[0], dtype=np.int64)
+    for i, drug in enumerate(regimen_drugs):
+        if drug in drug_to_column:
+            column = pheno_matrix[:, drug_to_column[drug]]
+            codes = np.where(column == truth_data_cache.RESISTANT, 1, np.where(column == truth_data_cache.SUSCEPTIBLE, 0, 2))
+        else:
+            codes = 2
+        index += codes * 3 ** i
+    return regimen_lookup_table()[index]
+
+
+def has_same_regimen(regimens1, regimens2):
+    '''Batch version of DstProfile.has_same_regimen. Takes two arrays
+    of regimen numbers (from regimen_numbers), and returns boolean
+    array that is True where both have the same regimen'''
+    regimens1 = np.asarray(regimens1)
+    regimens2 = np.asarray(regimens2)
+    return (regimens1 != NO_REGIMEN) & (regimens2 != NO_REGIMEN) & (regimens1 == regimens2)
+
+
+def regimen_concordance(pheno_matrix, caller_matrices, drugs):
+    '''Compares the regimens from the phenotypes and from each caller.
+    pheno_matrix and the values of the dict caller_matrices
+    (caller name -> matrix) are samples x drugs matrices with the same
+    rows and columns (drugs = column names). Returns dict of
+    caller name -> dict of counts: same, different (both have a regimen,
+    but not the same one), and no_regimen (either has no regimen)'''
+    pheno_regimens = regimen_numbers(pheno_matrix, drugs)
+    results = {}
+    for caller, matrix in caller_matrices.items():
+        caller_regimens = regimen_numbers(matrix, drugs)
+        same = has_same_regimen(pheno_regimens, caller_regimens)
+        no_regimen = (pheno_regimens == NO_REGIMEN) | (caller_regimens == NO_REGIMEN)
+        results[caller] = {
+            'same': int(same.sum()),
+            'different': int((~same & ~no_regimen).sum()),
+            'no_regimen': int(no_regimen.sum()),
+        }
+    return results
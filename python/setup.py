@@ -15,8 +15,14 @@ setup(
     test_suite='nose.collector',
     tests_require=['nose >= 1.3'],
     install_requires=[
+        'importlib_metadata; python_version < "3.8"',
+        'numpy',
+        'pandas',
         'seaborn'
     ],
+    extras_require={
+        'fast_json': ['orjson', 'ijson'],
+    },
     license='GPLv3',
     classifiers=[
         'Development Status :: 4 - Beta',